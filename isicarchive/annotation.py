@@ -64,6 +64,45 @@ _repr_pretty_list = {
     'features': 'features.{keys}',
 }
 
+# feature superpixel lists as (compact) arrays
+def _feature_arrays(fcont:dict):
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import numpy
+
+    if not isinstance(fcont, dict):
+        return
+    for (key, dtype) in [
+        ('idx', numpy.int32),
+        ('lst', numpy.float32),
+        ('area', numpy.int32),
+        ('area_pct', numpy.float32),
+        ('area_mpct', numpy.float32),
+        ]:
+        if key in fcont and not fcont[key] is None and not (
+            isinstance(fcont[key], numpy.ndarray) and fcont[key].dtype == dtype):
+            fcont[key] = numpy.asarray(fcont[key], dtype=dtype)
+
+# feature superpixel list (as returned by the API) into feature dict
+def _feature_from_list(feat_lst:list) -> dict:
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import numpy
+
+    feat_lst = numpy.asarray(feat_lst, dtype=numpy.float32)
+    feat_idx = numpy.flatnonzero(feat_lst > 0).astype(numpy.int32)
+    return {
+        'area': None,
+        'area_pct': None,
+        'area_mpct': None,
+        'idx': feat_idx,
+        'lst': feat_lst[feat_idx],
+        'num': feat_idx.size,
+        'tarea': None,
+        'tarea_pct': None,
+        'tarea_mpct': None,
+    }
+
 class Annotation(object):
     """
     Annotation object. If the details are not filled in, only the `id`,
@@ -79,7 +118,7 @@ class Annotation(object):
     Attributes
     ----------
     features : dict
-        List of features (fields: idx and msk)
+        Features (fields: idx as int32 and lst as float32 arrays, msk)
     id : str
         mongodb objectId of the annotation
     image : dict
@@ -126,6 +165,7 @@ class Annotation(object):
         """Annotation init."""
 
         self._api = api
+        self._feature_listeners = []
         self._image_obj = None
         self._in_archive = False
         self._model_type = 'annotation'
@@ -198,6 +238,8 @@ class Annotation(object):
         if ('features' in from_json and 
             isinstance(from_json['features'], dict)):
             self.features = from_json['features']
+            for fcont in self.features.values():
+                _feature_arrays(fcont)
         if (not load_data) and (self.state != 'complete'):
             return
         if self._api:
@@ -241,11 +283,21 @@ class Annotation(object):
             self._image_obj = None
         if clear_features:
             self.features = dict()
+            self._features_changed()
         if clear_masks:
             self.masks = dict()
 
+    # notify listeners (e.g. a study's annotation index) of feature changes
+    def _features_changed(self):
+        for listener in self._feature_listeners:
+            listener(self)
+
     # compute areas
     def compute_areas(self):
+
+        # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+        import numpy
+
         if not self._in_archive or not self._api:
             return
         try:
@@ -260,8 +312,8 @@ class Annotation(object):
                 except:
                     raise
             spx = self._image_obj.superpixels
-            szs = spx['szs']
-            iarea = float(sum(szs))
+            szs = numpy.asarray(spx['szs'], dtype=numpy.int32)
+            iarea = float(numpy.sum(szs, dtype=numpy.float64))
             if self._image_obj._segmentation is None:
                 try:
                     self._image_obj.load_segmentation()
@@ -270,17 +322,22 @@ class Annotation(object):
             try:
                 szp = spx['szp']
                 if szp is None:
-                    szp = [0.0] * len(szs)
+                    szp = numpy.zeros(szs.size, dtype=numpy.float32)
+                else:
+                    szp = numpy.asarray(szp, dtype=numpy.float32)
             except:
-                szp = [0.0] * len(szs)
+                szp = numpy.zeros(szs.size, dtype=numpy.float32)
             for fcont in self.features.values():
+                _feature_arrays(fcont)
                 idx = fcont['idx']
-                fcont['area'] = [szs[i] for i in idx]
-                fcont['area_pct'] = [szs[i] / iarea for i in idx]
-                fcont['area_mpct'] = [szp[i] for i in idx]
-                fcont['tarea'] = sum(fcont['area'])
-                fcont['tarea_pct'] = sum(fcont['area_pct'])
-                fcont['tarea_mpct'] = sum(fcont['area_mpct'])
+                fcont['area'] = szs[idx]
+                fcont['area_pct'] = (fcont['area'] / iarea).astype(numpy.float32)
+                fcont['area_mpct'] = szp[idx]
+                fcont['tarea'] = int(numpy.sum(fcont['area'], dtype=numpy.int64))
+                fcont['tarea_pct'] = float(numpy.sum(fcont['area'],
+                    dtype=numpy.float64)) / iarea
+                fcont['tarea_mpct'] = float(numpy.sum(fcont['area_mpct'],
+                    dtype=numpy.float64))
         except:
             raise
         
@@ -291,6 +348,7 @@ class Annotation(object):
         if load_masks:
             import imageio
         
+        features_changed = False
         try:
             for (key, value) in self.markups.items():
                 if not value:
@@ -305,20 +363,8 @@ class Annotation(object):
                         parse_json=False)
                     if not feat_lst.ok:
                         raise ValueError('Error loading feature ' + key)
-                    feat_lst = feat_lst.json()
-                    feat_idx = [fidx for fidx in range(len(feat_lst))
-                        if feat_lst[fidx] > 0]
-                    self.features[key] = dict()
-                    self.features[key]['area'] = None
-                    self.features[key]['area_pct'] = None
-                    self.features[key]['area_mpct'] = None
-                    self.features[key]['idx'] = feat_idx
-                    self.features[key]['lst'] = [v for v in filter(
-                        lambda v: v > 0, feat_lst)]
-                    self.features[key]['num'] = len(feat_idx)
-                    self.features[key]['tarea'] = None
-                    self.features[key]['tarea_pct'] = None
-                    self.features[key]['tarea_mpct'] = None
+                    self.features[key] = _feature_from_list(feat_lst.json())
+                    features_changed = True
                 if not load_masks or key in self.masks:
                     continue
                 cache_filename = self._api.cache_filename(self.id,
@@ -344,6 +390,8 @@ class Annotation(object):
                             warnings.warn('Error writing feature mask: ' + str(e))
         except Exception as e:
             warnings.warn('Error loading annotation: ' + str(e))
+        if features_changed:
+            self._features_changed()
 
     # overlap in features
     def overlap(self,
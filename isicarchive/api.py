@@ -65,6 +65,8 @@ dataset_list
     Yields a generator for dataset JSON dicts
 download_selected
     Downloads all selected images into a folder
+export_dataset
+    Export a selection of images into (resumable) fixed-size .npy shards
 feature_color
     Retrieve a feature-name-specific color
 feature_set_color
@@ -73,6 +75,8 @@ get
     Perform a GET request to the web-based API
 image
     Create an image object or retrieve a list of images
+image_hslhists
+    Compute HSL histogram features for a selection of images (batch)
 image_list
     Yields a generator for image JSON dicts
 list_datasets
@@ -341,6 +345,10 @@ class IsicApi(object):
         Retrieve one dataset (object) or datasets (list)
     image(object_id=None, name=None, params=None)
         Retrieve one image (object) or images (list)
+    image_cache_index(field, index_type='hash')
+        Add a secondary index on a (dotted) image_cache field
+    image_table(rebuild=False)
+        Columnar (MetaTable) representation of the image cache
     segmentation(object_id=None, image_name=Name, params=None)
         Retrieve on segmentation (object) or segmentations (list)
     study(object_id=None, name=None, params=None)
@@ -401,16 +409,20 @@ class IsicApi(object):
         self._defaults = {
             'heatmaps_mix_color': True,
             'image_display_size': vars.ISIC_IMAGE_DISPLAY_SIZE_MAX,
+            'render_cache_persist': False,
         }
         self._features = master_features
         self._feature_colors = dict()
         self._feature_filepart = dict()
         self._fonts = dict()
         self._hostname = hostname
+        self._image_cache_index = None
         self._image_cache_last = '0' * 24
         self._image_cache_timeout = 0.0
         self._image_objs = dict()
+        self._image_table = None
         self._init_time = time.time()
+        self._render_cache = dict()
         self._segmentation_objs = dict()
         self._store_objs = store_objs
         self._studies = dict()
@@ -420,6 +432,8 @@ class IsicApi(object):
         self.datasets = dict()
         self.features = {f['id']: f for f in master_features}
         self.image_cache = dict()
+        self._image_cache_index = func.index_create(
+            self.image_cache, vars.ISIC_IMAGE_CACHE_INDEXES)
         self.image_segmentations = dict()
         self.image_selection = None
         self.images = dict()
@@ -753,6 +767,7 @@ class IsicApi(object):
         for item in from_list:
             if not item['_id'] in self.image_cache:
                 self.image_cache[item['_id']] = item
+        func.index_update(self._image_cache_index, self.image_cache)
     def cache_images(self):
         """
         Create or update the local image details cache file.
@@ -1230,6 +1245,380 @@ class IsicApi(object):
             if download_seg_masks:
                 pass
 
+    # image ids from a selection (list, dict, Study, or Dataset)
+    def _selection_image_ids(self, images:Any = None) -> list:
+        if images is None:
+            if not self.image_selection:
+                raise ValueError('No images selected.')
+            images = self.image_selection
+        if isinstance(images, Dataset):
+            if not images.images:
+                images.load_images()
+            images = images.images
+        elif isinstance(images, Study):
+            images = images.images
+        if isinstance(images, dict):
+            image_ids = list(images.keys())
+        elif isinstance(images, list):
+            image_ids = []
+            for image in images:
+                if isinstance(image, dict) and '_id' in image:
+                    image_ids.append(image['_id'])
+                elif isinstance(image, str) and func.could_be_mongo_object_id(image):
+                    image_ids.append(image)
+                elif isinstance(image, str) and image in self.images:
+                    image_ids.append(self.images[image])
+                else:
+                    raise ValueError('Invalid image selection item.')
+        else:
+            raise ValueError('Invalid images parameter.')
+        return image_ids
+
+    # export images into fixed-size uint8 shards (training datasets)
+    def export_dataset(self,
+        target_folder:str,
+        images:Any = None,
+        size:Union[int, tuple] = 256,
+        kernel:str = 'box',
+        label_fields:list = None,
+        seg_mask:bool = False,
+        features:list = None,
+        shard_size:int = 1024,
+        workers:int = 4,
+        resume:bool = True,
+        verify:bool = True,
+        verbose:bool = True,
+        ) -> dict:
+        """
+        Export a selection of images into (resumable) fixed-size .npy shards
+
+        Parameters
+        ----------
+        target_folder : str
+            Folder into which the shards and the index are written
+        images : list, dict, Study, or Dataset
+            Image ids (or names), a selection dict (id -> details), or
+            a Study or Dataset object (default: self.image_selection)
+        size : int or tuple
+            If a (height, width) tuple, images are resized to that shape,
+            if an int, the longer side is resized to that size (keeping
+            the aspect) and the image is stored top-left in a size-by-size
+            canvas (the actual shape is stored in the index)
+        kernel : str
+            Resampling kernel (see imfunc.image_resample, default: 'box')
+        label_fields : list
+            Metadata fields (getxattr syntax, e.g. 'meta.clinical.diagnosis')
+            stored as labels in the index
+        seg_mask : bool
+            If True, add the (resized) segmentation mask as a channel
+        features : list
+            Feature names (requires images to be a Study), for each an
+            additional channel with the fraction (0...255) of the image's
+            annotations that marked a superpixel with that feature
+        shard_size : int
+            Number of images per shard (default: 1024)
+        workers : int
+            Number of threads loading and decoding images (default: 4)
+        resume : bool
+            If True (default), shards listed in an existing index (with
+            matching parameters) are kept and not exported again
+        verify : bool
+            If True (default), the checksums of kept shards are verified
+        verbose : bool
+            If True (default), print progress
+
+        Returns
+        -------
+        index : dict
+            Index (also stored as index.json.gz in the target folder) with
+            fields 'params', 'channels', 'image_ids', 'image_names',
+            'shapes', 'valid', 'labels', 'label_classes', 'label_codes',
+            and 'shards' (list of dicts with 'filename', 'first', 'count',
+            'shape', and 'sha256'), whereas each shard is an N-by-height-
+            by-width-by-channels uint8 .npy file (numpy.load(...,
+            mmap_mode='r') compatible)
+        """
+
+        # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        import hashlib
+        import numpy
+        from .func import getxattr
+        from .imfunc import image_resample
+
+        if not isinstance(target_folder, str) or target_folder == '':
+            raise ValueError('Invalid target_folder parameter.')
+        if not os.path.isdir(target_folder):
+            os.makedirs(target_folder)
+        study = None
+        if isinstance(images, Study):
+            study = images
+        image_ids = self._selection_image_ids(images)
+        if isinstance(size, int) and size > 0:
+            out_hw = (size, size)
+            keep_aspect = True
+        elif isinstance(size, (list, tuple)) and len(size) == 2 and all(
+            [isinstance(v, int) and v > 0 for v in size]):
+            out_hw = (size[0], size[1])
+            keep_aspect = False
+        else:
+            raise ValueError('Invalid size parameter.')
+        if label_fields is None:
+            label_fields = []
+        elif isinstance(label_fields, str):
+            label_fields = [label_fields]
+        if features is None:
+            features = []
+        elif isinstance(features, str):
+            features = [features]
+        if features and study is None:
+            raise ValueError('Feature channels require a Study as images.')
+        if not isinstance(shard_size, int) or shard_size < 1:
+            raise ValueError('Invalid shard_size parameter.')
+        if not isinstance(workers, int) or workers < 1:
+            workers = 1
+        channels = ['red', 'green', 'blue']
+        if seg_mask:
+            channels.append('mask')
+        channels.extend(['feature:' + f for f in features])
+        num_channels = len(channels)
+        num_images = len(image_ids)
+        params = {
+            'channels': channels,
+            'image_ids': image_ids,
+            'kernel': kernel,
+            'keep_aspect': keep_aspect,
+            'label_fields': label_fields,
+            'shard_size': shard_size,
+            'size': list(out_hw),
+        }
+
+        # existing index (resume)
+        index_filename = target_folder + os.sep + 'index.json.gz'
+        index = None
+        if resume and os.path.exists(index_filename):
+            try:
+                index = func.gzip_load_var(index_filename)
+                if index['params'] != params:
+                    raise ValueError('Export parameters differ.')
+            except Exception as e:
+                warnings.warn('Existing index not used: ' + str(e))
+                index = None
+        if index is None:
+            index = {
+                'params': params,
+                'channels': channels,
+                'image_ids': image_ids,
+                'image_names': [None] * num_images,
+                'shapes': [[0, 0]] * num_images,
+                'valid': [False] * num_images,
+                'labels': {f: [None] * num_images for f in label_fields},
+                'label_classes': dict(),
+                'label_codes': dict(),
+                'shards': [],
+            }
+
+        # shards to (re-)export
+        def file_checksum(filename:str) -> str:
+            sha = hashlib.sha256()
+            with open(filename, 'rb') as shard_file:
+                for chunk in iter(lambda: shard_file.read(1 << 24), b''):
+                    sha.update(chunk)
+            return sha.hexdigest()
+        num_shards = (num_images + shard_size - 1) // shard_size
+        done = dict()
+        for shard in index['shards']:
+            shard_filename = target_folder + os.sep + shard['filename']
+            try:
+                if not os.path.exists(shard_filename):
+                    raise ValueError('File not found.')
+                if verify and file_checksum(shard_filename) != shard['sha256']:
+                    raise ValueError('Checksum mismatch.')
+                done[shard['first'] // shard_size] = shard
+            except Exception as e:
+                warnings.warn('Shard {0:s} exported again: {1:s}'.format(
+                    shard['filename'], str(e)))
+        to_export = [s for s in range(num_shards) if not s in done]
+        index['shards'] = [done[s] for s in sorted(done.keys())]
+
+        # per-image feature fractions (superpixel values) from the study
+        sp_features = dict()
+        if features:
+            study.load_annotations()
+            num_annotations = dict()
+            for a_obj in study._obj_annotations.values():
+                if a_obj.status != 'ok':
+                    continue
+                image_id = a_obj.image_id
+                num_annotations[image_id] = num_annotations.get(image_id, 0) + 1
+                if not image_id in sp_features:
+                    sp_features[image_id] = [dict() for _ in features]
+                for (fidx, fkey) in enumerate(features):
+                    if not fkey in a_obj.features:
+                        continue
+                    sp_counts = sp_features[image_id][fidx]
+                    for sp in numpy.asarray(a_obj.features[fkey]['idx']).reshape(-1).tolist():
+                        sp_counts[sp] = sp_counts.get(sp, 0) + 1
+            for (image_id, sp_counts) in sp_features.items():
+                for (fidx, counts) in enumerate(sp_counts):
+                    sp_counts[fidx] = {sp: float(count) / float(
+                        num_annotations[image_id]) for (sp, count) in counts.items()}
+
+        # image loading and decoding (in worker threads)
+        def load_image(image_idx:int) -> dict:
+            image_id = image_ids[image_idx]
+            image_obj = self.image(object_id=image_id)
+            had_data = not image_obj.data is None
+            had_superpixels = not image_obj.superpixels['idx'] is None
+            had_mask = (not image_obj._segmentation is None and
+                not image_obj._segmentation.mask is None)
+            loaded = {'mask': None, 'fmaps': None}
+            try:
+                if not had_data:
+                    image_obj.load_image_data()
+                image_data = image_obj.data
+                if image_data is None:
+                    raise ValueError('No image data.')
+                if image_data.ndim == 2:
+                    image_data = numpy.repeat(image_data.reshape(
+                        (image_data.shape[0], image_data.shape[1], 1)), 3, axis=2)
+                elif image_data.shape[2] > 3:
+                    image_data = image_data[:,:,0:3]
+                if image_data.dtype != numpy.uint8:
+                    raise ValueError('Invalid image data type.')
+                loaded['image'] = image_data
+                if seg_mask:
+                    image_obj.load_segmentation()
+                    mask = None
+                    if image_obj._segmentation:
+                        mask = image_obj._segmentation.mask
+                    if mask is None:
+                        raise ValueError('No segmentation mask.')
+                    if mask.ndim > 2:
+                        mask = mask[:,:,0]
+                    loaded['mask'] = numpy.ascontiguousarray(mask, dtype=numpy.uint8)
+                if features:
+                    image_obj.load_superpixels()
+                    spidx = image_obj.superpixels['idx']
+                    if spidx is None:
+                        raise ValueError('No superpixels.')
+                    num_sp = image_obj.superpixels['max'] + 1
+                    fvals = numpy.zeros(len(features) * num_sp,
+                        dtype=numpy.uint8).reshape((len(features), num_sp,))
+                    for (fidx, values) in enumerate(
+                        sp_features.get(image_id, [dict()] * len(features))):
+                        for (sp, val) in values.items():
+                            if sp < num_sp:
+                                fvals[fidx,sp] = int(0.5 + 255.0 * val)
+                    loaded['fmaps'] = numpy.ascontiguousarray(numpy.moveaxis(
+                        fvals[:,spidx], 0, 2))
+                loaded['name'] = image_obj.name
+                loaded['labels'] = [getxattr(image_obj, f) for f in label_fields]
+                return loaded
+            finally:
+                try:
+                    image_obj.clear_data(clear_data=not had_data,
+                        clear_superpixels=not had_superpixels,
+                        clear_segmentation=not had_mask)
+                except:
+                    pass
+
+        # resizing and channel stacking (in this, the main, thread, as the
+        # parallel compiled functions must not be called from pool threads)
+        def resize(data:numpy.ndarray, new_shape:tuple) -> numpy.ndarray:
+            if data.shape[0] == new_shape[0] and data.shape[1] == new_shape[1]:
+                return data.reshape((new_shape[0], new_shape[1], -1))
+            return image_resample(data, new_shape, kernel).reshape(
+                (new_shape[0], new_shape[1], -1))
+        def stack_image(loaded:dict) -> numpy.ndarray:
+            im_shape = loaded['image'].shape
+            if keep_aspect:
+                sf = float(out_hw[0]) / float(max(im_shape[0], im_shape[1]))
+                new_shape = (max(1, min(out_hw[0], int(0.5 + sf * float(im_shape[0])))),
+                    max(1, min(out_hw[1], int(0.5 + sf * float(im_shape[1])))))
+            else:
+                new_shape = out_hw
+            out = numpy.zeros(new_shape[0] * new_shape[1] * num_channels,
+                dtype=numpy.uint8).reshape((new_shape[0], new_shape[1],
+                num_channels,))
+            out[:,:,0:3] = resize(loaded['image'], new_shape)
+            channel = 3
+            if not loaded['mask'] is None:
+                out[:,:,channel] = resize(loaded['mask'], new_shape)[:,:,0]
+                channel += 1
+            if not loaded['fmaps'] is None:
+                out[:,:,channel:] = resize(loaded['fmaps'], new_shape)
+            return out
+
+        # stream images of the shards to export through the pool
+        shard_shape = (shard_size, out_hw[0], out_hw[1], num_channels)
+        export_ids = [i for s in to_export for i in range(
+            s * shard_size, min(num_images, (s + 1) * shard_size))]
+        num_export = len(export_ids)
+        shard_array = None
+        shard_idx = -1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            next_image = 0
+            for (export_idx, image_idx) in enumerate(export_ids):
+                while next_image < num_export and len(pending) < 2 * workers:
+                    pending.append(executor.submit(load_image, export_ids[next_image]))
+                    next_image += 1
+                if image_idx // shard_size != shard_idx:
+                    shard_idx = image_idx // shard_size
+                    shard_first = shard_idx * shard_size
+                    shard_count = min(num_images, shard_first + shard_size) - shard_first
+                    shard_filename = 'shard_{0:05d}.npy'.format(shard_idx)
+                    shard_array = numpy.lib.format.open_memmap(target_folder +
+                        os.sep + shard_filename + '.part', mode='w+',
+                        dtype=numpy.uint8, shape=(shard_count,) + shard_shape[1:])
+                try:
+                    loaded = pending.popleft().result()
+                    image_out = stack_image(loaded)
+                    (image_name, labels) = (loaded['name'], loaded['labels'])
+                    shard_array[image_idx-shard_first,0:image_out.shape[0],
+                        0:image_out.shape[1],:] = image_out
+                    index['image_names'][image_idx] = image_name
+                    index['shapes'][image_idx] = [image_out.shape[0], image_out.shape[1]]
+                    index['valid'][image_idx] = True
+                    for (field, label) in zip(label_fields, labels):
+                        if not label is None and not isinstance(
+                            label, (bool, int, float, str)):
+                            label = str(label)
+                        index['labels'][field][image_idx] = label
+                except Exception as e:
+                    warnings.warn('Error exporting image {0:s}: {1:s}'.format(
+                        image_ids[image_idx], str(e)))
+                    index['valid'][image_idx] = False
+                if image_idx == shard_first + shard_count - 1:
+                    shard_array.flush()
+                    shard_array = None
+                    os.replace(target_folder + os.sep + shard_filename + '.part',
+                        target_folder + os.sep + shard_filename)
+                    index['shards'].append({
+                        'filename': shard_filename,
+                        'first': shard_first,
+                        'count': shard_count,
+                        'shape': [shard_count] + list(shard_shape[1:]),
+                        'sha256': file_checksum(target_folder + os.sep + shard_filename),
+                    })
+                    index['shards'].sort(key=lambda s: s['first'])
+                    func.gzip_save_var(index_filename, index)
+                if verbose:
+                    func.print_progress(export_idx + 1, num_export, 'Exporting images:')
+
+        # label classes and codes (-1 for missing labels)
+        for field in label_fields:
+            values = index['labels'][field]
+            classes = sorted(set([v for v in values if not v is None]), key=str)
+            class_codes = {v: c for (c, v) in enumerate(classes)}
+            index['label_classes'][field] = classes
+            index['label_codes'][field] = [class_codes.get(v, -1)
+                if not v is None else -1 for v in values]
+        func.gzip_save_var(index_filename, index)
+        return index
+
     # lookup color code
     def feature_color(self, feature:str = None) -> list:
         """
@@ -1275,6 +1664,61 @@ class IsicApi(object):
                     pass
         return self._feature_colors[feature]
     
+    # render cache (get, from memory or, if enabled with
+    # set_default('render_cache_persist', True), from the cache folder)
+    def _render_cache_get(self, key:str) -> tuple:
+
+        # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+        import hashlib
+        import numpy
+
+        if key in self._render_cache:
+            return self._render_cache[key]
+        if not self._defaults['render_cache_persist'] or not self._cache_folder:
+            return None
+        render_filename = self.cache_filename(
+            hashlib.sha1(key.encode('utf-8')).hexdigest()[0:24], 'render', '.npz')
+        if not os.path.exists(render_filename):
+            return None
+        try:
+            with numpy.load(render_filename, allow_pickle=False) as render_file:
+                if str(render_file['key']) != key:
+                    return None
+                value = tuple([render_file['arr_' + str(idx)]
+                    for idx in range(len(render_file.files) - 1)])
+        except Exception as e:
+            try:
+                os.remove(render_filename)
+            except:
+                pass
+            warnings.warn('Error reading render cache file: ' + str(e))
+            return None
+        self._render_cache_put(key, value, False)
+        return value
+
+    # render cache (put, into memory and optionally cache folder)
+    def _render_cache_put(self, key:str, value:tuple, persist:bool = True):
+
+        # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+        import hashlib
+        import numpy
+
+        for arr in value:
+            arr.setflags(write=False)
+        while len(self._render_cache) >= vars.ISIC_RENDER_CACHE_SIZE:
+            self._render_cache.pop(next(iter(self._render_cache)))
+        self._render_cache[key] = value
+        if not persist or not self._defaults['render_cache_persist'] or (
+            not self._cache_folder):
+            return
+        render_filename = self.cache_filename(
+            hashlib.sha1(key.encode('utf-8')).hexdigest()[0:24], 'render', '.npz')
+        try:
+            with open(render_filename, 'wb') as render_file:
+                numpy.savez(render_file, *value, key=numpy.asarray(key))
+        except Exception as e:
+            warnings.warn('Error writing render cache file: ' + str(e))
+
     # feature legend
     def feature_legend(self,
         features:list,
@@ -1302,6 +1746,12 @@ class IsicApi(object):
                 features = [features]
             else:
                 raise ValueError('Invalid features parameter.')
+        render_key = repr(('legend', features, feature_colors, feature_alphas,
+            fsize, fcolor, bcolor, patch_size, patch_frame, align, padding,
+            columns, frame_color, frame_width, single_colors))
+        render_value = self._render_cache_get(render_key)
+        if not render_value is None:
+            return render_value[0].copy()
         features = features[:]
         if single_colors:
             fcolors = dict()
@@ -1447,6 +1897,7 @@ class IsicApi(object):
                 o_image[tfromy:ttoy,ttox-patch_frame:ttox,0] = fcolor[0]
                 o_image[tfromy:ttoy,ttox-patch_frame:ttox,1] = fcolor[1]
                 o_image[tfromy:ttoy,ttox-patch_frame:ttox,2] = fcolor[2]
+        self._render_cache_put(render_key, (o_image.copy(),))
         return o_image
 
     # set feature color
@@ -1683,6 +2134,207 @@ class IsicApi(object):
         self._current_image = image_obj
         return image_obj
 
+    # add a secondary index to the image cache
+    def image_cache_index(self, field:str, index_type:str = 'hash'):
+        """
+        Add a secondary index on a (dotted) image_cache field
+
+        Parameters
+        ----------
+        field : str
+            Field name (e.g. 'meta.clinical.benign_malignant')
+        index_type : str
+            Either 'hash' (default, for '==' and 'in' criteria) or
+            'sorted' (for numeric '==', '<', '<=', '>', '>=' criteria)
+        
+        No return value. The index is built on first use by
+        select_images, and then maintained as images are cached.
+        """
+        if not index_type in ['hash', 'sorted']:
+            raise ValueError('Invalid index_type parameter.')
+        fields = {name: f_index['type'] for (name, f_index) in
+            self._image_cache_index['fields'].items()}
+        if fields.get(field, None) == index_type:
+            return
+        fields[field] = index_type
+        self._image_cache_index = func.index_create(self.image_cache, fields)
+
+    # HSL histogram features for a selection of images (batch)
+    def image_hslhists(self,
+        images:Any = None,
+        out_file:str = None,
+        resize:int = 512,
+        bins:int = 64,
+        binsamples:int = 8,
+        mask_cradius:float = 0.875,
+        workers:int = 4,
+        flush_every:int = 100,
+        verbose:bool = True,
+        ) -> Tuple[list, Any]:
+        """
+        Compute HSL histogram features for a selection of images
+
+        Parameters
+        ----------
+        images : list, dict, Study, or Dataset
+            Image ids (or names), a selection dict (id -> details), or
+            a Study or Dataset object (default: self.image_selection)
+        out_file : str
+            Optional .npy filename, the float32 feature matrix is then
+            written (memory-mapped) incrementally, and the list of image
+            ids is stored alongside (same name, extension .ids.json.gz)
+        resize, bins, binsamples, mask_cradius
+            Passed on to imfunc.image_hslhist (all images share the same
+            mask and bin setup; mask_cradius defaults to 0.875 here, which
+            excludes the image corners, unlike image_hslhist's 1.0)
+        workers : int
+            Number of threads loading and decoding images (default: 4)
+        flush_every : int
+            Flush the feature matrix to disk every N images (default: 100)
+        verbose : bool
+            If True (default), print progress
+        
+        Returns
+        -------
+        image_ids : list
+            List of image ids (rows of the feature matrix)
+        features : ndarray
+            Image-by-feature matrix (float32) with the hue-saturation,
+            hue-lightness, and saturation-lightness histograms (flattened,
+            each binsamples-by-binsamples), NaN for failed images
+        """
+
+        # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        import numpy
+        from .imfunc import image_hslhist
+
+        image_ids = self._selection_image_ids(images)
+        if binsamples < bins:
+            num_features = 3 * binsamples * binsamples
+        else:
+            num_features = 3 * bins * bins
+        num_images = len(image_ids)
+        if out_file:
+            if not out_file.lower().endswith('.npy'):
+                out_file += '.npy'
+            try:
+                func.gzip_save_var(out_file[:-4] + '.ids.json.gz', image_ids)
+                features = numpy.lib.format.open_memmap(out_file, mode='w+',
+                    dtype=numpy.float32, shape=(num_images, num_features))
+            except:
+                raise
+        else:
+            features = numpy.zeros((num_images, num_features), dtype=numpy.float32)
+        if num_images == 0:
+            return (image_ids, features)
+        if not isinstance(workers, int) or workers < 1:
+            workers = 1
+        if not isinstance(flush_every, int) or flush_every < 1:
+            flush_every = 100
+
+        # image loading and decoding (in worker threads)
+        def load_image(image_id:str) -> Any:
+            image_obj = self.image(object_id=image_id)
+            image_data = image_obj.data
+            if image_data is None:
+                image_obj.load_image_data()
+                image_data = image_obj.data
+                image_obj.clear_data(clear_superpixels=False,
+                    clear_segmentation=False)
+            return image_data
+
+        # stream images through the pool (bounded number in flight)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            next_image = 0
+            for image_idx in range(num_images):
+                while next_image < num_images and len(pending) < 2 * workers:
+                    pending.append(executor.submit(load_image, image_ids[next_image]))
+                    next_image += 1
+                try:
+                    image_data = pending.popleft().result()
+                    if image_data is None:
+                        raise ValueError('No image data.')
+                    if image_data.ndim == 2:
+                        image_data = numpy.repeat(image_data.reshape(
+                            (image_data.shape[0], image_data.shape[1], 1)), 3, axis=2)
+                    elif image_data.shape[2] > 3:
+                        image_data = image_data[:,:,0:3]
+                    hists = image_hslhist(image_data, resize=resize, bins=bins,
+                        binsamples=binsamples, mask_cradius=mask_cradius)
+                    features[image_idx,:] = numpy.concatenate(
+                        [hist.reshape(hist.size) for hist in hists])
+                except Exception as e:
+                    warnings.warn('Error processing image {0:s}: {1:s}'.format(
+                        image_ids[image_idx], str(e)))
+                    features[image_idx,:] = numpy.nan
+                if out_file and ((image_idx + 1) % flush_every) == 0:
+                    features.flush()
+                if verbose:
+                    func.print_progress(image_idx + 1, num_images, 'HSL histograms:')
+        if out_file:
+            features.flush()
+        return (image_ids, features)
+
+    # columnar image metadata table
+    def image_table(self, rebuild:bool = False) -> Any:
+        """
+        Columnar (MetaTable) representation of the image cache
+
+        Parameters
+        ----------
+        rebuild : bool
+            If True, rebuild the table from scratch (default: False)
+        
+        Returns
+        -------
+        table : isicarchive.metatable.MetaTable
+            Table with one column per image field (including all meta
+            fields), synced with (and persisted next to) the image cache
+        """
+
+        # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+        from .metatable import MetaTable
+
+        if not self.image_cache:
+            if self._cache_folder:
+                self.cache_images()
+            else:
+                self.select_images([])
+        table_filename = None
+        if self._cache_folder:
+            table_filename = self.cache_filename('0' * 24, 'imtable', '.npz')
+        if rebuild:
+            self._image_table = None
+        elif self._image_table is None and table_filename and (
+            os.path.exists(table_filename)):
+            try:
+                self._image_table = MetaTable(from_file=table_filename)
+            except:
+                os.remove(table_filename)
+                warnings.warn('Invalid image table cache file.')
+        table = self._image_table
+        if table is None:
+            table = MetaTable()
+        num_rows = len(table)
+        new_images = [image for (image_id, image) in self.image_cache.items()
+            if not image_id in table._pos]
+        if new_images:
+            fields = ['_id', 'created', 'dataset._id', 'dataset.name', 'name']
+            fields.extend(['meta.' + k for k in func.getxkeys(
+                func.getxattr(new_images, '[].meta'))])
+            fields.extend([f for f in table.columns.keys() if not f in fields])
+            table.append(new_images, fields)
+        self._image_table = table
+        if table_filename and len(table) > num_rows:
+            try:
+                table.save(table_filename)
+            except:
+                warnings.warn('Error writing image table cache file.')
+        return table
+
     # image list (generator)
     def image_list(self, params:dict = None, as_object:bool = False) -> iter:
         """
@@ -1839,10 +2491,11 @@ class IsicApi(object):
         out_format:str = 'dict_of_lists',
         parse_vals:bool = True,
         pack_keys:bool = True,
+        dtypes:dict = None,
         ) -> Any:
         try:
             return func.read_csv(csv_filename, out_format=out_format,
-                parse_vals=parse_vals, pack_keys=pack_keys)
+                parse_vals=parse_vals, pack_keys=pack_keys, dtypes=dtypes)
         except:
             raise
 
@@ -2019,6 +2672,7 @@ class IsicApi(object):
         sub_select:Union[bool, list, dict] = False,
         add_to_selection:bool = False,
         remove_from_selection:bool = False,
+        use_table:bool = False,
         ) -> dict:
         """
         Select from all available images in the ISIC Archive
@@ -2032,6 +2686,9 @@ class IsicApi(object):
             If True, add to previously selected items
         remove_from_selection : bool (default: False)
             If True, remove found items from previously selected ones
+        use_table : bool (default: False)
+            If True, run the criteria vectorised on the image_table
+            (if all criteria fields are columns of the table)
         """
         if not self.image_cache:
             if not self._cache_folder:
@@ -2069,7 +2726,21 @@ class IsicApi(object):
             selection = func.select_from(self.image_selection, criteria)
             add_to_selection = False
         else:
-            selection = func.select_from(self.image_cache, criteria)
+            selection = None
+            if use_table:
+                table = self.image_table()
+                t_criteria = criteria
+                if t_criteria and (len(t_criteria) == 3 and
+                    isinstance(t_criteria[0], str)):
+                    t_criteria = [t_criteria]
+                if all([(len(c) == 3 and c[0] in table.columns)
+                    for c in t_criteria]):
+                    selected = table.select(t_criteria)
+                    selection = {image_id: self.image_cache[image_id] for
+                        image_id in table.keys[selected].tolist()}
+            if selection is None:
+                selection = func.select_from(self.image_cache, criteria,
+                    index=self._image_cache_index)
         if not add_to_selection and not remove_from_selection:
             self.image_selection = selection
         elif add_to_selection:
@@ -2081,9 +2752,47 @@ class IsicApi(object):
         return self.image_selection
 
     # all metadata of selected images (ready for pandas.DataFrame.from_dict)
-    def selected_metadata(self) -> dict:
+    def selected_metadata(self, as_columns:bool = False) -> dict:
+        """
+        All metadata of selected images (ready for pandas.DataFrame)
+
+        Parameters
+        ----------
+        as_columns : bool
+            If True, return numpy.ndarray columns from the image_table
+            (numeric columns are read-only views if the selection covers
+            the whole table, encoded columns are decoded in one step)
+        
+        Returns
+        -------
+        metadata : dict
+            Dict with image_id, image_name, image_created, dataset_name,
+            and all (dotted) meta fields as lists (or arrays)
+        """
         if self.image_selection is None:
             self.select_images([])
+        if as_columns:
+
+            # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+            import numpy
+
+            table = self.image_table()
+            rows = table.rows(list(self.image_selection.keys()))
+            if numpy.any(rows < 0):
+                raise ValueError('Selected images not in image table.')
+            if rows.size == len(table) and numpy.all(
+                rows == numpy.arange(rows.size)):
+                rows = None
+            od = {
+                'image_id': table.column('_id', rows, True),
+                'image_name': table.column('name', rows, True),
+                'image_created': table.column('created', rows, True),
+                'dataset_name': table.column('dataset.name', rows, True),
+            }
+            for k in sorted(table.columns.keys()):
+                if k[0:5] == 'meta.':
+                    od[k[5:]] = table.column(k, rows, True)
+            return od
         od = dict()
         sel_images = [v for v in self.image_selection.values()]
         od['image_id'] = [v['_id'] for v in sel_images]
@@ -2163,15 +2872,25 @@ class IsicApi(object):
             fsize = float(fsize)
         if isinstance(text, list):
             text = '\n'.join(text)
-        [inset_image, inset_alpha, fromys] = font_obj.set_text(text, fsize,
-            color=fcolor, bcolor=bcolor, align=align, invert=invert,
-            outsize_x=0, outsize_y=0, padding=padding)
-        mix_image = numpy.zeros(inset_image.size, dtype=numpy.uint8).reshape(
-            inset_image.shape)
-        mix_image[:,:,0] = bcolor[0]
-        mix_image[:,:,1] = bcolor[1]
-        mix_image[:,:,2] = bcolor[2]
-        mix_image = image_mix(mix_image, inset_image, inset_alpha)
+        render_key = repr(('text', font_obj.name, fsize, text, fcolor, bcolor,
+            align, invert, padding))
+        render_value = self._render_cache_get(render_key)
+        if render_value is None:
+            [inset_image, inset_alpha, fromys] = font_obj.set_text(text, fsize,
+                color=fcolor, bcolor=bcolor, align=align, invert=invert,
+                outsize_x=0, outsize_y=0, padding=padding)
+            mix_image = numpy.zeros(inset_image.size, dtype=numpy.uint8).reshape(
+                inset_image.shape)
+            mix_image[:,:,0] = bcolor[0]
+            mix_image[:,:,1] = bcolor[1]
+            mix_image[:,:,2] = bcolor[2]
+            mix_image = image_mix(mix_image, inset_image, inset_alpha)
+            self._render_cache_put(render_key,
+                (mix_image.copy(), inset_alpha.copy(), fromys.copy()))
+        else:
+            mix_image = render_value[0].copy()
+            inset_alpha = render_value[1].copy()
+            fromys = render_value[2].copy()
         if min_alpha > 0.0:
             inset_alpha = numpy.maximum(inset_alpha, min_alpha)
         inshape = inset_alpha.shape
@@ -2217,10 +2936,10 @@ class IsicApi(object):
             mix_image[:,stox-frame_width:stox,2] = frame_color[2]
             inset_alpha[:,stox-frame_width:stox] = 1.0
         if not image is None:
-            image[tfromy:ttoy, tfromx:ttox, :] = image_mix(
-                image[tfromy:ttoy, tfromx:ttox, :],
+            image_mix(image[tfromy:ttoy, tfromx:ttox, :],
                 mix_image[sfromy:stoy, sfromx:stox, :],
-                inset_alpha[sfromy:stoy, sfromx:stox])
+                inset_alpha[sfromy:stoy, sfromx:stox],
+                out=image[tfromy:ttoy, tfromx:ttox, :])
         return [tfromy, tfromx, ttoy, ttox, mix_image, inset_alpha, fromys]
     
     # show image in notebook
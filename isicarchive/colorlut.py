@@ -3,10 +3,18 @@ isicarchive.lut
 
 This module generates color look-up tables (LUTs) for coloring
 statistical results.
+
+LUTs are compiled on first request (``lut_get(name)`` or via the
+``LUTs`` mapping) into read-only (N,3) uint8 arrays, which are then
+shared by all users; additional LUTs can be registered with
+``lut_register(name, pos_lut, neg_lut)``.
 """
 
 
-from typing import Callable, Iterator, Union
+from collections.abc import Mapping
+from typing import Callable, Iterator, Tuple, Union
+
+import numpy
 
 
 # some simple variables and definitions
@@ -44,91 +52,166 @@ def lut_range(rfrom:float, rto:float, rstep:float = 1.0) -> Iterator[float]:
 
 # compile a LUT from single values, lists, or range definitions
 def lut_compile(
-    red:Union[int, list],
-    green:Union[int, list],
-    blue:Union[int, list],
-    redt:Callable[[float], float] = None,
-    greent:Callable[[float], float] = None,
-    bluet:Callable[[float], float] = None,
-    ) -> list:
-    if isinstance(red, list) and len(red) == 3:
-        red = [r for r in lut_range(red[0], red[1], red[2])]
-    if isinstance(green, list) and len(green) == 3:
-        green = [g for g in lut_range(green[0], green[1], green[2])]
-    if isinstance(blue, list) and len(blue) == 3:
-        blue = [b for b in lut_range(blue[0], blue[1], blue[2])]
-    if not isinstance(red, list):
-        if not isinstance(green, list):
-            if not isinstance(blue, list):
-                raise ValueError('at least one color must be a list.')
-            else:
-                red = [red for r in range(len(blue))]
-        else:
-            red = [red for r in range(len(green))]
-    if not isinstance(green, list):
-        green = [green for g in range(len(red))]
-    if not isinstance(blue, list):
-        blue = [blue for b in range(len(red))]
-    if len(red) != len(green) or len(green) != len(blue):
+    red:Union[float, list],
+    green:Union[float, list],
+    blue:Union[float, list],
+    redt:Callable[[numpy.ndarray], numpy.ndarray] = None,
+    greent:Callable[[numpy.ndarray], numpy.ndarray] = None,
+    bluet:Callable[[numpy.ndarray], numpy.ndarray] = None,
+    ) -> numpy.ndarray:
+    """
+    Compile a LUT from single values, lists, or range definitions
+
+    Parameters
+    ----------
+    red, green, blue : float or list
+        Either a single value, a list of values, or a 3-element
+        [from, to, step] range definition (as used in lut_range)
+    redt, greent, bluet : callable
+        Optional transforms (applied to arrays of values)
+    
+    Returns
+    -------
+    lut : ndarray
+        (N,3) uint8 array with the clamped and rounded colors
+    """
+    channels = [red, green, blue]
+    for (idx, c) in enumerate(channels):
+        if isinstance(c, list) and len(c) == 3:
+            channels[idx] = numpy.fromiter(lut_range(c[0], c[1], c[2]),
+                dtype=numpy.float64)
+        elif isinstance(c, list) or isinstance(c, numpy.ndarray):
+            channels[idx] = numpy.asarray(c, dtype=numpy.float64).reshape(-1)
+    sizes = set([c.size for c in channels if isinstance(c, numpy.ndarray)])
+    if not sizes:
+        raise ValueError('at least one color must be a list.')
+    if len(sizes) > 1:
         raise ValueError('resulting lists must be of the same length')
-    l = [None] * len(red)
-    idx = 0
-    for (r, g, b) in zip(red, green, blue):
-        if not redt is None:
-            r = redt(r)
-        if not greent is None:
-            g = greent(g)
-        if not bluet is None:
-            b = bluet(b)
-        if r > 255.0:
-            r = 255.0
-        elif r < 0.0:
-            r = 0.0
-        if g > 255.0:
-            g = 255.0
-        elif g < 0.0:
-            g = 0.0
-        if b > 255.0:
-            b = 255.0
-        elif b < 0.0:
-            b = 0.0
-        l[idx] = [int(r+0.5), int(g+0.5), int(b+0.5)]
-        idx += 1
-    return l
-
-
-# actual definitions
-LUT_COOL = [
-    lut_compile([ 0.0, 1.0,  1.0/LUT_MSIZE], [ 1.0, 0.0  , -1.0/LUT_MSIZE],              1.0           , **rgb255)]
-LUT_FULL = [
-    lut_compile(             1.0,            [ 1.0, 0.125, -1.0/44.6     ], [ 1.0, 0.0, -1.0/LUT_MSIZE], t255, nsq255, t255),
-    lut_compile([ 1.0, 0.0, -1.0/LUT_MSIZE], [ 1.0, 0.125, -1.0/44.6     ], [ 1.0, 0.0, -1.0/LUT_MSIZE], t255, nsq255, p255),
-]
-LUT_GRAY = [
-    lut_compile([ 0.5, 1.0,  0.5/LUT_MSIZE], [ 0.5, 1.0  ,  0.5/LUT_MSIZE], [ 0.5, 1.0,  0.5/LUT_MSIZE], **rgb255),
-    lut_compile([ 0.5, 0.0, -0.5/LUT_MSIZE], [ 0.5, 0.0  , -0.5/LUT_MSIZE], [ 0.5, 0.0, -0.5/LUT_MSIZE], **rgb255),
-]
-LUT_HOT = [
-    lut_compile([ 0.0, 2.5,  2.5/LUT_MSIZE], [-1.0, 1.5  ,  2.5/LUT_MSIZE], [-3.0, 1.0,  4.0/LUT_MSIZE], **rgb255),
-]
-LUT_REVERSED = [
-    lut_compile(             0.0,            [0.25, 1.0  , 0.75/LUT_MSIZE], [ 1.0,0.25,-0.75/LUT_MSIZE], **rgb255),
-    lut_compile(             1.0,            [0.25, 1.0  , 0.75/LUT_MSIZE],              0.0           , **rgb255),
-]
-LUT_STANDARD = [
-    lut_compile(             1.0,            [0.25, 1.0  , 0.75/LUT_MSIZE],              0.0           , **rgb255),
-    lut_compile(             0.0,            [0.25, 1.0  , 0.75/LUT_MSIZE], [ 1.0,0.25,-0.75/LUT_MSIZE], **rgb255),
-]
-LUT_WINTER = [
-    lut_compile(             0.0,            [ 0.0, 1.0  ,  1.0/LUT_MSIZE], [ 1.0, 0.5, -0.5/LUT_MSIZE], **rgb255),
-]
-
-LUTs = {
-    'cool': LUT_COOL,
-    'full': LUT_FULL,
-    'gray': LUT_GRAY,
-    'hot': LUT_HOT,
-    'reversed': LUT_REVERSED,
-    'standard': LUT_STANDARD,
-    'winter': LUT_WINTER,
+    num_colors = sizes.pop()
+    lut = numpy.zeros(num_colors * 3, dtype=numpy.float64).reshape((num_colors, 3,))
+    for (idx, (c, t)) in enumerate(zip(channels, [redt, greent, bluet])):
+        lut[:,idx] = c
+        if not t is None:
+            lut[:,idx] = t(lut[:,idx])
+    return numpy.trunc(0.5 + numpy.minimum(255.0, numpy.maximum(0.0, lut))).astype(
+        numpy.uint8)
+
+# get a (compiled, read-only) LUT by name
+def lut_get(name:str) -> Tuple[numpy.ndarray, ...]:
+    """
+    Get a (compiled, read-only) LUT by name
+
+    Parameters
+    ----------
+    name : str
+        Name of the LUT (see LUTs.keys())
+    
+    Returns
+    -------
+    luts : tuple
+        Tuple with the positive LUT (and the negative LUT, if defined)
+    """
+    if name in _luts:
+        return _luts[name]
+    if not name in _lut_definitions:
+        raise KeyError('Unknown LUT: ' + str(name))
+    luts = []
+    for lut_args in _lut_definitions[name]:
+        lut = lut_compile(*lut_args)
+        lut.setflags(write=False)
+        luts.append(lut)
+    _luts[name] = tuple(luts)
+    return _luts[name]
+
+# register a custom LUT
+def lut_register(
+    name:str,
+    pos_lut:Union[list, numpy.ndarray],
+    neg_lut:Union[list, numpy.ndarray] = None,
+    ):
+    """
+    Register a custom LUT (available via lut_get and LUTs)
+
+    Parameters
+    ----------
+    name : str
+        Name of the LUT (replaces an existing LUT of the same name)
+    pos_lut : list or ndarray
+        Nx3 list or array of colors for positive values
+    neg_lut : list or ndarray
+        Optional Mx3 list or array of colors for negative values
+    """
+    if not isinstance(name, str) or name == '':
+        raise ValueError('Invalid LUT name.')
+    luts = []
+    for lut in [pos_lut, neg_lut]:
+        if lut is None:
+            continue
+        try:
+            lut = numpy.asarray(lut)
+            if lut.dtype != numpy.uint8:
+                lut = numpy.trunc(0.5 + numpy.minimum(255.0,
+                    numpy.maximum(0.0, lut.astype(numpy.float64))))
+            lut = lut.astype(numpy.uint8).reshape((-1, 3,))
+        except:
+            raise ValueError('Invalid LUT (must be Nx3 colors).')
+        if lut.shape[0] < 1:
+            raise ValueError('Invalid LUT (must be Nx3 colors).')
+        lut.setflags(write=False)
+        luts.append(lut)
+    if not luts:
+        raise ValueError('Invalid LUT (must be Nx3 colors).')
+    _lut_definitions.pop(name, None)
+    _luts[name] = tuple(luts)
+
+
+# actual definitions (compiled on first use)
+_lut_definitions = {
+    'cool': [
+        ([ 0.0, 1.0,  1.0/LUT_MSIZE], [ 1.0, 0.0  , -1.0/LUT_MSIZE],              1.0           , t255, t255, t255),
+    ],
+    'full': [
+        (             1.0,            [ 1.0, 0.125, -1.0/44.6     ], [ 1.0, 0.0, -1.0/LUT_MSIZE], t255, nsq255, t255),
+        ([ 1.0, 0.0, -1.0/LUT_MSIZE], [ 1.0, 0.125, -1.0/44.6     ], [ 1.0, 0.0, -1.0/LUT_MSIZE], t255, nsq255, p255),
+    ],
+    'gray': [
+        ([ 0.5, 1.0,  0.5/LUT_MSIZE], [ 0.5, 1.0  ,  0.5/LUT_MSIZE], [ 0.5, 1.0,  0.5/LUT_MSIZE], t255, t255, t255),
+        ([ 0.5, 0.0, -0.5/LUT_MSIZE], [ 0.5, 0.0  , -0.5/LUT_MSIZE], [ 0.5, 0.0, -0.5/LUT_MSIZE], t255, t255, t255),
+    ],
+    'hot': [
+        ([ 0.0, 2.5,  2.5/LUT_MSIZE], [-1.0, 1.5  ,  2.5/LUT_MSIZE], [-3.0, 1.0,  4.0/LUT_MSIZE], t255, t255, t255),
+    ],
+    'reversed': [
+        (             0.0,            [0.25, 1.0  , 0.75/LUT_MSIZE], [ 1.0,0.25,-0.75/LUT_MSIZE], t255, t255, t255),
+        (             1.0,            [0.25, 1.0  , 0.75/LUT_MSIZE],              0.0           , t255, t255, t255),
+    ],
+    'standard': [
+        (             1.0,            [0.25, 1.0  , 0.75/LUT_MSIZE],              0.0           , t255, t255, t255),
+        (             0.0,            [0.25, 1.0  , 0.75/LUT_MSIZE], [ 1.0,0.25,-0.75/LUT_MSIZE], t255, t255, t255),
+    ],
+    'winter': [
+        (             0.0,            [ 0.0, 1.0  ,  1.0/LUT_MSIZE], [ 1.0, 0.5, -0.5/LUT_MSIZE], t255, t255, t255),
+    ],
 }
+_luts = dict()
+
+
+# mapping of all (built-in and registered) LUTs, compiled on access
+class _LUTMapping(Mapping):
+    def __getitem__(self, name:str) -> Tuple[numpy.ndarray, ...]:
+        return lut_get(name)
+    def __iter__(self):
+        return iter(list(_lut_definitions.keys()) +
+            [name for name in _luts.keys() if not name in _lut_definitions])
+    def __len__(self) -> int:
+        return len(set(_lut_definitions.keys()).union(_luts.keys()))
+    def __contains__(self, name:str) -> bool:
+        return (name in _lut_definitions) or (name in _luts)
+LUTs = _LUTMapping()
+
+# backwards compatible LUT_NAME module attributes (compiled on access,
+# or registered with lut_register), requires module __getattr__ (3.7+)
+def __getattr__(name:str):
+    if name.startswith('LUT_') and name[4:].lower() in LUTs:
+        return lut_get(name[4:].lower())
+    raise AttributeError('module ' + __name__ + ' has no attribute ' + name)
@@ -264,8 +264,9 @@ class Dataset(object):
             raise ValueError('Requires IsicApi object with cache folder set.')
         self._api.cache_images()
         dataset_id = self.id
-        self.images = [item for item in self._api.image_cache.values() if (
-            item['dataset']['_id'] == dataset_id)]
+        self.images = func.select_from(self._api.image_cache,
+            [['dataset._id', '==', dataset_id]], dict_as_values=True,
+            index=self._api._image_cache_index)
         if len(self.images) == 0:
             return
         for img_idx in range(len(self.images)):
@@ -15,7 +15,9 @@ https://github.com/neuroelf/neuroelf-matlab/
 in the image_font function of the @neuroelf class. It uses an
 image with all available extended ASCII characters, and computes
 a kerning value between all combinations of letters for the type
-setting.
+setting. The decoded image and kerning table are stored in a cache
+file next to the font file (etc/font_NAME.cache) on first use, so
+that later processes can load them with a single read.
 
 To then create an image with a set text, you can call either the
 ```font.set_line(TEXT)``` method for a one-channel uint8 image,
@@ -33,17 +35,24 @@ __version__ = '0.4.8'
 
 # imports (needed for majority of functions)
 import os
+import struct
 from typing import Tuple, Union
 
 from imageio import imread
 import numpy
 
+from .vars import ISIC_FONT_ATLAS_CACHE_SIZE
+
 
 class Font(object):
     """
     Font
     """
 
+    __atlases = {}
+    __cache_header = '<4sIQQiiiiii'
+    __cache_magic = b'IFNC'
+    __cache_version = 1
     __fonts = {}
     def __init__(self, fontname:str):
 
@@ -86,25 +95,11 @@ class Font(object):
             self._yret = f['yret']
             return
 
-        # load font file and set in object
+        # load font from cache file (with kerning) or font file
         fontfile = fontfolder + 'font_' + self.name + '.npz'
-        fontdata = numpy.load(fontfile)
-        fontdict = {k:v for (k,v) in fontdata.items()}
-        self._image = imread(fontdict['fimage'].tobytes())
-        self._letters = fontdict['letters']
-        self._num_letters = fontdict['flen']
-        self._lmap[self._letters] = numpy.asarray(range(self._num_letters))
-        self._size = fontdict['size']
-        nl = self._num_letters
-        self._xktab = numpy.zeros(nl * nl, dtype=numpy.float32).reshape((nl,nl,))
-        self._xstart = numpy.concatenate((numpy.zeros(1, dtype=numpy.int32), 
-            fontdict['xstop'][0:-1]))
-        self._xstop = fontdict['xstop']
-        self._ybase = fontdict['ybase']
-        for (d0,d1,v) in zip(fontdict['xk0'], fontdict['xk1'], fontdict['xkv']):
-            self._xktab[d0-1,d1-1] = v
-        self._yret = self._size - self._image.shape[0]
-        self._add_kerning()
+        if not self._read_cache(fontfile):
+            self._load_font(fontfile)
+            self._write_cache(fontfile)
         self.__fonts[self.name] = {
             'image': self._image,
             'kerning': self._kerning,
@@ -189,6 +184,138 @@ class Font(object):
         # store table
         self._kerning = numpy.trunc(ktab).astype(numpy.int32)
 
+    # glyph atlas (pre-scaled font image and glyph columns) for a size
+    def _glyph_atlas(self, ffact:float) -> Tuple[numpy.ndarray, numpy.ndarray]:
+
+        atlas_key = (self.name, ffact)
+        if atlas_key in self.__atlases:
+            atlas = self.__atlases.pop(atlas_key)
+            self.__atlases[atlas_key] = atlas
+            return atlas
+
+        # glyphs are spaced apart so that resampling doesn't bleed
+        gap = 4 + int(numpy.ceil(4.0 * max(1.0, 1.0 / ffact)))
+        xsims = (self._xstop - self._xstart).astype(numpy.int64)
+        xfroms = gap + numpy.concatenate((numpy.zeros(1, dtype=numpy.int64),
+            numpy.cumsum(xsims + gap)[0:-1]))
+        image = numpy.zeros(self._image.shape[0] * (xfroms[-1] + xsims[-1] + gap),
+            dtype=numpy.uint8).reshape((self._image.shape[0], -1,))
+        for (xfrom, xstart, xsim) in zip(xfroms, self._xstart, xsims):
+            image[:,xfrom:xfrom+xsim] = self._image[:,xstart:xstart+xsim]
+        if ffact != 1.0:
+
+            # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+            from .sampler import Sampler
+            sampler = Sampler()
+
+            xfact = float(int(ffact * (float(image.shape[1]) + 0.5))) / float(
+                image.shape[1])
+            image = sampler.sample_grid(image, ffact, 'resample', 'uint8')
+        else:
+            xfact = 1.0
+        image.setflags(write=False)
+
+        # glyph columns (including blurred margins) and offset of glyph start
+        margin = (gap - 1) // 2
+        xbounds = numpy.zeros(3 * xsims.size, dtype=numpy.int64).reshape((3,-1,))
+        xbounds[0,:] = numpy.round(xfact * (xfroms - margin))
+        xbounds[1,:] = numpy.minimum(image.shape[1],
+            numpy.round(xfact * (xfroms + xsims + margin)))
+        xbounds[2,:] = numpy.round(xfact * xfroms) - xbounds[0,:]
+        atlas = (image, xbounds)
+        while len(self.__atlases) >= ISIC_FONT_ATLAS_CACHE_SIZE:
+            self.__atlases.pop(next(iter(self.__atlases)))
+        self.__atlases[atlas_key] = atlas
+        return atlas
+
+    # load font file (decode image, compute kerning)
+    def _load_font(self, fontfile:str):
+        fontdata = numpy.load(fontfile)
+        fontdict = {k:v for (k,v) in fontdata.items()}
+        self._image = imread(fontdict['fimage'].tobytes())
+        self._letters = fontdict['letters']
+        self._num_letters = fontdict['flen']
+        self._lmap[self._letters] = numpy.asarray(range(self._num_letters))
+        self._size = fontdict['size']
+        nl = self._num_letters
+        self._xktab = numpy.zeros(nl * nl, dtype=numpy.float32).reshape((nl,nl,))
+        self._xstart = numpy.concatenate((numpy.zeros(1, dtype=numpy.int32), 
+            fontdict['xstop'][0:-1]))
+        self._xstop = fontdict['xstop']
+        self._ybase = fontdict['ybase']
+        for (d0,d1,v) in zip(fontdict['xk0'], fontdict['xk1'], fontdict['xkv']):
+            self._xktab[d0-1,d1-1] = v
+        self._yret = self._size - self._image.shape[0]
+        self._add_kerning()
+
+    # read cache file (decoded image, extents, and kerning)
+    def _read_cache(self, fontfile:str) -> bool:
+        try:
+            fontstat = os.stat(fontfile)
+            with open(fontfile[:-4] + '.cache', 'rb') as cache_file:
+                cache_data = cache_file.read()
+            hsize = struct.calcsize(self.__cache_header)
+            (magic, version, fsize, fmtime, ih, iw, nl, size, ybase,
+                yret) = struct.unpack(self.__cache_header, cache_data[0:hsize])
+            if (magic != self.__cache_magic or version != self.__cache_version
+                or fsize != fontstat.st_size or fmtime != fontstat.st_mtime_ns):
+                return False
+            cache_arrays = [('image', numpy.uint8, (ih, iw,)),
+                ('kerning', numpy.int32, (nl, nl,)),
+                ('letters', numpy.int32, (nl,)),
+                ('xktab', numpy.float32, (nl, nl,)),
+                ('xstart', numpy.int32, (nl,)),
+                ('xstop', numpy.int32, (nl,))]
+            cache_size = hsize + sum([numpy.dtype(d).itemsize * int(numpy.prod(sh))
+                for (_, d, sh) in cache_arrays])
+            if len(cache_data) != cache_size:
+                return False
+            offset = hsize
+            arrays = dict()
+            for (name, dtype, shape) in cache_arrays:
+                count = int(numpy.prod(shape))
+                arrays[name] = numpy.frombuffer(cache_data, dtype=dtype,
+                    count=count, offset=offset).reshape(shape)
+                offset += count * numpy.dtype(dtype).itemsize
+        except:
+            return False
+        self._image = arrays['image']
+        self._kerning = arrays['kerning']
+        self._letters = arrays['letters']
+        self._num_letters = nl
+        self._lmap[self._letters] = numpy.asarray(range(self._num_letters))
+        self._size = size
+        self._xktab = arrays['xktab']
+        self._xstart = arrays['xstart']
+        self._xstop = arrays['xstop']
+        self._ybase = ybase
+        self._yret = yret
+        return True
+
+    # write cache file (if the font folder is writable)
+    def _write_cache(self, fontfile:str):
+        cache_filename = fontfile[:-4] + '.cache'
+        try:
+            fontstat = os.stat(fontfile)
+            with open(cache_filename + '.tmp', 'wb') as cache_file:
+                cache_file.write(struct.pack(self.__cache_header,
+                    self.__cache_magic, self.__cache_version, fontstat.st_size,
+                    fontstat.st_mtime_ns, self._image.shape[0],
+                    self._image.shape[1], int(self._num_letters), int(self._size),
+                    int(self._ybase), int(self._yret)))
+                cache_file.write(self._image.astype(numpy.uint8).tobytes())
+                cache_file.write(self._kerning.astype(numpy.int32).tobytes())
+                cache_file.write(self._letters.astype(numpy.int32).tobytes())
+                cache_file.write(self._xktab.astype(numpy.float32).tobytes())
+                cache_file.write(self._xstart.astype(numpy.int32).tobytes())
+                cache_file.write(self._xstop.astype(numpy.int32).tobytes())
+            os.replace(cache_filename + '.tmp', cache_filename)
+        except:
+            try:
+                os.remove(cache_filename + '.tmp')
+            except:
+                pass
+
     # set single line into images
     def set_line(self,
         line:Union[str,list],
@@ -197,10 +324,6 @@ class Font(object):
         xkern:int = 0,
         ) -> numpy.ndarray:
 
-        # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
-        from .sampler import Sampler
-        sampler = Sampler()
-
         if isinstance(line, str):
             line = [line]
         elif not isinstance(line, list):
@@ -209,43 +332,43 @@ class Font(object):
         if fsize < 1.0:
             raise ValueError('Invalid fsize parameter.')
         ffact = fsize / numpy.float(self._size)
-        ifsize = self._image.shape
+        (atlas, xbounds) = self._glyph_atlas(ffact)
         for lc in range(len(line)):
-            letters = [ord(l) for l in line[lc]]
-            nletters = len(letters)
+            letters = numpy.asarray([ord(l) for l in line[lc]], dtype=numpy.int64)
+            nletters = letters.size
             if nletters == 0:
-                out[lc] = numpy.zeros(0, dtype=numpy.uint8).reshape((fsize,0,))
+                out[lc] = numpy.zeros(0, dtype=numpy.uint8).reshape(
+                    (atlas.shape[0],0,))
                 continue
-            let_ims = [None] * nletters
-            let_spc = numpy.zeros(nletters, dtype=numpy.int32)
-            for letc in range(nletters):
-                leti = self._lmap[letters[letc]]
-                if leti < 0:
-                    leti = self._lmap[63]
-                let_ims[letc] = self._image[:, self._xstart[leti]:self._xstop[leti]]
-                if letc < (nletters - 1):
-                    nleti = self._lmap[letters[letc+1]]
-                    if nleti < 0:
-                        nleti = self._lmap[63]
-                    if nleti == 0:
-                        let_spc[letc] = self._kerning[leti,nleti] + spkern
-                    else:
-                        let_spc[letc] = self._kerning[leti,nleti] + xkern
-            
-            # element and total size
-            xsims = numpy.asarray([l.shape[1] for l in let_ims])
+            leti = self._lmap[numpy.minimum(letters, self._lmap.size - 1)]
+            leti[letters >= self._lmap.size] = -1
+            leti[leti < 0] = self._lmap[63]
+            let_spc = numpy.zeros(nletters, dtype=numpy.int64)
+            if nletters > 1:
+                let_spc[0:-1] = self._kerning[leti[0:-1],leti[1:]] + numpy.where(
+                    leti[1:] == 0, spkern, xkern)
+
+            # positions in native size, then scaled into atlas size
+            xsims = self._xstop[leti] - self._xstart[leti]
+            lpos = numpy.concatenate((numpy.zeros(1, dtype=numpy.int64),
+                numpy.cumsum(xsims + let_spc)[0:-1]))
             xstot = numpy.sum(xsims) + numpy.sum(let_spc)
-            lineimage = numpy.zeros(ifsize[0] * xstot, dtype=numpy.uint8).reshape(
-                (ifsize[0], xstot,))
-            lii = 0
+            xsout = int(ffact * (float(xstot) + 0.5))
+            lpos = numpy.round((float(xsout) / float(xstot)) * lpos).astype(numpy.int64)
+            lineimage = numpy.zeros(atlas.shape[0] * xsout, dtype=numpy.uint8).reshape(
+                (atlas.shape[0], xsout,))
             for letc in range(nletters):
-                lineimage[:,lii:lii+xsims[letc]] = numpy.maximum(
-                    lineimage[:,lii:lii+xsims[letc]], let_ims[letc])
-                lii += xsims[letc] + let_spc[letc]
-            
-            # resize
-            if ffact != 1.0:
-                lineimage = sampler.sample_grid(lineimage, ffact, 'resample', 'uint8')
+                lfrom = xbounds[0,leti[letc]]
+                lto = xbounds[1,leti[letc]]
+                lii = lpos[letc] - xbounds[2,leti[letc]]
+                if lii < 0:
+                    lfrom -= lii
+                    lii = 0
+                lto = min(lto, lfrom + xsout - lii)
+                if lto <= lfrom:
+                    continue
+                numpy.maximum(lineimage[:,lii:lii+lto-lfrom],
+                    atlas[:,lfrom:lto], out=lineimage[:,lii:lii+lto-lfrom])
 
             # store
             out[lc] = lineimage
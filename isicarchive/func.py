@@ -6,6 +6,8 @@ imported from outside the main package functionality (IsicApi).
 
 Functions
 ---------
+compile_criteria
+    Compile selection criteria into a (cached) predicate function
 could_be_mongo_object_id
     Returns true if the input is a 24 lower-case hex character string
 delxattr
@@ -24,6 +26,12 @@ gzip_load_var
     Loads a .json.gz file into a variable
 gzip_save_var
     Saves a variable into a .json.gz file
+index_candidates
+    Return candidate keys for criteria using an index
+index_create
+    Create a (lazily built) secondary index for a dict of items
+index_update
+    Update an index to reflect items added to the dict
 letters_only
     Return only letters of string input parameter
 object_pretty
@@ -38,6 +46,8 @@ rand_hex_str
     Random hex string of specified length
 read_csv
     Somewhat extended CSV file reading
+read_csv_batches
+    Read CSV file in batches of columns (streaming, typed)
 selected
     Helper function to select from a list (select_from)
 select_from
@@ -50,6 +60,8 @@ uri_encode
     Encodes non-letter/number characters into %02x sequences
 write_csv
     Extended CSV writing of dicts
+write_csv_batches
+    Streaming CSV writing of batches
 """
 
 # specific version for file
@@ -57,11 +69,235 @@ __version__ = '0.4.8'
 
 
 # imports (needed for majority of functions)
+from collections import OrderedDict
 from collections.abc import ValuesView
 from typing import Any, Union
 
 import json
 import re
+import threading
+
+# compile a (simple) getxattr path into a getter function
+_getter_special = re.compile(r'[#\$%=~\[\]\{\}>]')
+def _compile_getter(name:str) -> Any:
+    if not isinstance(name, str) or name == '':
+        return lambda obj: obj
+    parts = name.split('.')
+    if _getter_special.search(name) or any([(p == '' or p.isdigit() or
+        (p[0] == '-' and p[1:].isdigit())) for p in parts]):
+        return lambda obj: getxattr(obj, name)
+    if len(parts) == 1:
+        def getter(obj:Any) -> Any:
+            if isinstance(obj, dict):
+                return obj.get(name)
+            elif obj is None or isinstance(obj, list) or isinstance(obj, ValuesView):
+                return None
+            return getattr(obj, name, None)
+        getter.parts = parts
+        return getter
+    def getter(obj:Any) -> Any:
+        if isinstance(obj, dict) and name in obj:
+            return obj[name]
+        for part in parts:
+            if isinstance(obj, dict):
+                obj = obj.get(part)
+            elif obj is None or isinstance(obj, list) or isinstance(obj, ValuesView):
+                return None
+            else:
+                obj = getattr(obj, part, None)
+        return obj
+    getter.parts = parts
+    return getter
+
+# compile a single criterion into a test function (cost, and expression)
+def _compile_test(c_op:str, c_test:Any) -> tuple:
+    if c_op in ['==', '!=', '<', '<=', '>', '>=']:
+        c_fun = {
+            '==': lambda val: val == c_test,
+            '!=': lambda val: val != c_test,
+            '<': lambda val: val < c_test,
+            '<=': lambda val: val <= c_test,
+            '>': lambda val: val > c_test,
+            '>=': lambda val: val >= c_test,
+        }[c_op]
+        return (c_fun, 1.0, 'v ' + c_op + ' {c}', c_test)
+    elif c_op == 'in' or c_op == 'not in':
+        try:
+            c_set = frozenset(c_test)
+        except:
+            c_set = None
+        c_expr = 'v in {c}' if c_op == 'in' else 'not v in {c}'
+        if c_set is None or isinstance(c_test, str):
+            if c_op == 'in':
+                return (lambda val: val in c_test, 2.0, c_expr, c_test)
+            return (lambda val: not val in c_test, 2.0, c_expr, c_test)
+        def in_test(val:Any) -> bool:
+            try:
+                return val in c_set
+            except TypeError:
+                return val in c_test
+        if c_op == 'in':
+            return (in_test, 1.5, c_expr, c_set)
+        return (lambda val: not in_test(val), 1.5, c_expr, c_set)
+    elif c_op == 'ni':
+        return (lambda val: c_test in val, 2.0, '{c} in v', c_test)
+    elif c_op == 'not ni':
+        return (lambda val: not c_test in val, 2.0, 'not {c} in v', c_test)
+    elif c_op == 'match' or c_op == '~':
+        rexp = re.compile(c_test).search
+        return (lambda val: not rexp(val) is None, 4.0,
+            'not {c}(v) is None', rexp)
+    elif c_op == 'not match' or c_op == '!~':
+        rexp = re.compile(c_test).search
+        return (lambda val: rexp(val) is None, 4.0, '{c}(v) is None', rexp)
+    elif c_op == 'is':
+        return (lambda val: val is c_test, 1.0, 'v is {c}', c_test)
+    elif c_op == 'not is':
+        return (lambda val: not val is c_test, 1.0, 'not v is {c}', c_test)
+    elif c_op == 'is None':
+        return (lambda val: val is None, 1.0, 'v is None', None)
+    elif c_op == 'not is None':
+        return (lambda val: not val is None, 1.0, 'not v is None', None)
+    raise ValueError('Invalid criterion.')
+
+# generate a single (fast path) predicate function from compiled tests
+def _compile_predicate(tests:list, slow:Any) -> Any:
+    names = {'slow': slow}
+    lines = [
+        'def predicate(item):',
+        '    if not item.__class__ is dict:',
+        '        return slow(item)',
+        '    try:',
+    ]
+    for (tc, t) in enumerate(tests):
+        c_name = 'c{0:d}'.format(tc)
+        names[c_name] = t[4]
+        parts = t[5]
+        if parts is None:
+            names['g{0:d}'.format(tc)] = t[0]
+            lines.append('        v = g{0:d}(item)'.format(tc))
+        elif len(parts) == 1:
+            lines.append('        v = item[{0:s}]'.format(repr(parts[0])))
+        else:
+            lines.extend([
+                '        if {0:s} in item:'.format(repr('.'.join(parts))),
+                '            v = item[{0:s}]'.format(repr('.'.join(parts))),
+                '        else:',
+                '            v = item' + ''.join(
+                    ['[' + repr(p) + ']' for p in parts]),
+            ])
+        lines.extend([
+            '        if not ({0:s}):'.format(t[3].format(c=c_name)),
+            '            return False',
+        ])
+    lines.extend([
+        '    except Exception:',
+        '        return slow(item)',
+        '    return True',
+    ])
+    exec('\n'.join(lines), names)
+    return names['predicate']
+
+# hashable cache key for (nested) criteria values (arrays by content)
+def _criteria_key(value:Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple([_criteria_key(v) for v in value]))
+    elif isinstance(value, dict):
+        return ('dict', tuple([(_criteria_key(k), _criteria_key(v))
+            for (k, v) in value.items()]))
+    elif isinstance(value, (set, frozenset)):
+        return (type(value).__name__, frozenset([_criteria_key(v) for v in value]))
+    elif hasattr(value, 'tobytes') and hasattr(value, 'dtype'):
+        return ('ndarray', str(value.dtype), getattr(value, 'shape', None),
+            value.tobytes())
+    hash(value)
+    return (type(value).__name__, value)
+
+# compile criteria into a predicate function (cached)
+_compiled_criteria = dict()
+_compiled_criteria_max = 256
+def compile_criteria(criteria:list) -> Any:
+    """
+    Compile selection criteria into a predicate function (cached).
+
+    Parameters
+    ----------
+    criteria : list
+        List of criteria (see selected), or a single 3-element criterion
+    
+    Returns
+    -------
+    predicate : function
+        Function taking one item, returning True if the item matches
+        all criteria (and False if any error occurs); the function has
+        an attribute, order, which can be called with a list of sample
+        items to (re-)order tests by estimated selectivity (returning
+        the re-compiled predicate)
+    
+    Field names are split only once, regular expressions are compiled
+    once, and operators are bound in advance. For dict items, simple
+    (dotted) field names are resolved inline by a generated function,
+    falling back to the generic (getxattr) lookup on any exception.
+    Compiled criteria are cached (keyed by their values), such that
+    repeated selections re-use the compiled predicate (and test order).
+    """
+    if criteria is None:
+        criteria = []
+    if (len(criteria) == 3 and isinstance(criteria[0], str)):
+        criteria = [criteria]
+    try:
+        key = _criteria_key(criteria)
+        if any([(len(c) == 3 and c[1] in ['is', 'not is']) for c in criteria]):
+            key = None
+    except:
+        key = None
+    if not key is None and key in _compiled_criteria:
+        return _compiled_criteria[key]
+    tests = []
+    for c in criteria:
+        if len(c) != 3:
+            raise ValueError('Invalid criterion.')
+        (test, cost, expr, const) = _compile_test(c[1], c[2])
+        getter = _compile_getter(c[0])
+        parts = getattr(getter, 'parts', None)
+        tests.append([getter, test, cost, expr, const, parts])
+    def slow(item:Any) -> bool:
+        try:
+            for t in tests:
+                if not t[1](t[0](item)):
+                    return False
+        except:
+            return False
+        return True
+    def finalize(ordered:bool) -> Any:
+        predicate = _compile_predicate(tests, slow)
+        predicate.order = order
+        predicate.ordered = ordered
+        if not key is None:
+            if key in _compiled_criteria or (
+                len(_compiled_criteria) < _compiled_criteria_max):
+                _compiled_criteria[key] = predicate
+            else:
+                _compiled_criteria.pop(next(iter(_compiled_criteria)))
+                _compiled_criteria[key] = predicate
+        return predicate
+    def order(sample:list) -> Any:
+        if len(tests) < 2 or len(sample) == 0:
+            return finalize(True)
+        rank = dict()
+        for t in tests:
+            passed = 0
+            for item in sample:
+                try:
+                    if t[1](t[0](item)):
+                        passed += 1
+                except:
+                    pass
+            rate = min(0.999, float(passed) / float(len(sample)))
+            rank[id(t)] = t[2] / (1.0 - rate)
+        tests.sort(key=lambda t: rank[id(t)])
+        return finalize(True)
+    return finalize(len(tests) < 2)
 
 # helper function that returns True for valid looking mongo ObjectId strings
 def could_be_mongo_object_id(test_id:str = "") -> bool:
@@ -163,105 +399,187 @@ def getxattr(obj:object, name:str = None, default:Any = None) -> Any:
       returns a list with elements: getxattr(obj[IDX], 'author.name')
     """
 
-    # if anything happens, the value is the default
-    val = default
-    if obj is None:
-        return val
     if name is None or (name == ''):
-        return obj
-    
-    # for simple expressions (without . separator)
-    if not '.' in name:
-        try:
-
-            # depending on type of object
+        return default if obj is None else obj
+    accessor = _getxattr_accessors.get(name, None)
+    if accessor is None:
+        accessor = _getxattr_accessor(name)
+    else:
+        with _getxattr_accessors_lock:
+            if name in _getxattr_accessors:
+                _getxattr_accessors.move_to_end(name)
+    return accessor(obj, default)
+
+# compile a single (non-.-separated) getxattr step (raising on errors)
+def _getxattr_step(name:str) -> Any:
+    if name == '':
+        return lambda obj: obj
+    is_index = name.isdigit() or (name[0] == '-' and name[1:].isdigit())
+    if is_index:
+        index = int(name)
+        def step(obj:Any) -> Any:
+            if isinstance(obj, dict):
+                return obj.get(name)
+            return obj[index]
+        return step
+    if name in ['#', '$', '%', '%%']:
+        def step(obj:Any) -> Any:
             if isinstance(obj, dict):
                 if name == '#':
-                    val = len(obj)
+                    return len(obj)
                 elif name == '$':
-                    val = obj.values()
+                    return obj.values()
                 elif name == '%':
-                    val = list(obj.keys())
-                elif name == '%%':
-                    val = ' '.join(list(obj.keys()))
-                else:
-                    val = obj.get(name)
-            elif name.isdigit() or (name[0] == '-' and name[1:].isdigit()):
-                val = obj[int(name)]
-            elif not isinstance(obj, list) and not isinstance(obj, ValuesView):
-                val = getattr(obj, name)
-            elif name == '#':
-                val = len(obj)
-
-            # item/value-based obj[key]==name-part lookup
-            elif '=' in name:
-                name_parts = name.split('=')
-                name = '.'.join(name_parts[0].split('>'))
-                cont = name_parts[-1]
-                if len(name_parts) == 3 and (name_parts[1] == '#'):
-                    cont = int(cont)
-                for subobj in obj:
-                    if isinstance(subobj, dict) and (
-                        getxattr(subobj, name) == cont):
-                        val = subobj
-                        break
-            # item/value-based obj[key]-regexp-name-part lookup
-            elif '~' in name:
-                name_parts = name.split('~')
-                name = '.'.join(name_parts[0].split('>'))
-                cont = '~'.join(name_parts[1:])
-                rexp = re.compile(cont)
-                for subobj in obj:
-                    if isinstance(subobj, dict) and (
-                        rexp.search(getxattr(subobj, name))):
-                        val = subobj
-                        break
-            else:
-                val = getattr(obj, name)
-        except:
-            pass
-        return val
+                    return list(obj.keys())
+                return ' '.join(list(obj.keys()))
+            elif name == '#' and (isinstance(obj, list) or
+                isinstance(obj, ValuesView)):
+                return len(obj)
+            return getattr(obj, name)
+        return step
+    if not '=' in name and not '~' in name:
+        def step(obj:Any) -> Any:
+            if isinstance(obj, dict):
+                return obj.get(name)
+            return getattr(obj, name)
+        return step
+
+    # item/value-based obj[key]==name-part or regexp lookup
+    if '=' in name:
+        name_parts = name.split('=')
+        sub_name = '.'.join(name_parts[0].split('>'))
+        cont = name_parts[-1]
+        if len(name_parts) == 3 and (name_parts[1] == '#'):
+            cont = int(cont)
+        test = lambda val: val == cont
+    else:
+        name_parts = name.split('~')
+        sub_name = '.'.join(name_parts[0].split('>'))
+        test = re.compile('~'.join(name_parts[1:])).search
+    def step(obj:Any) -> Any:
+        if isinstance(obj, dict):
+            return obj.get(name)
+        elif not isinstance(obj, list) and not isinstance(obj, ValuesView):
+            return getattr(obj, name)
+        for subobj in obj:
+            if isinstance(subobj, dict) and test(getxattr(subobj, sub_name)):
+                return subobj
+        raise KeyError(name)
+    return step
+
+# compile a getxattr name expression into an accessor (LRU cached, the
+# lock guards updates, as getxattr is also called from worker threads)
+_getxattr_accessors = OrderedDict()
+_getxattr_accessors_lock = threading.Lock()
+_getxattr_accessors_max = 1024
+def _getxattr_accessor(name:str) -> Any:
+
+    # for simple expressions (without . separator)
+    if not '.' in name:
+        step = _getxattr_step(name)
+        def accessor(obj:Any, default:Any) -> Any:
+            if obj is None:
+                return default
+            try:
+                return step(obj)
+            except:
+                return default
 
-    # still allow name1.name2.name3 IF ACTUALLY in dict object!
-    elif isinstance(obj, dict) and name in obj:
-        return obj[name]
-    
     # special case: pass on name to each list item, return list
-    if isinstance(obj, list) and (len(name) > 3) and (name[0:3] == '[].'):
-        val = [None] * len(obj)
-        name = name[3:]
-        for idx in range(len(obj)):
-            val[idx] = getxattr(obj[idx], name, default)
-        return val
-    
+    elif (len(name) > 3) and (name[0:3] == '[].'):
+        sub_name = name[3:]
+        def accessor(obj:Any, default:Any) -> Any:
+            if obj is None:
+                return default
+            elif isinstance(obj, dict) and name in obj:
+                return obj[name]
+            elif isinstance(obj, list):
+                sub_accessor = _getxattr_accessors.get(sub_name, None)
+                if sub_accessor is None:
+                    sub_accessor = _getxattr_accessor(sub_name)
+                return [sub_accessor(item, default) for item in obj]
+            return path_accessor(obj, default)
+        path_accessor = _getxattr_path(name)
+
     # from here: complex (.-separator-containing) expression
+    else:
+        path_accessor = _getxattr_path(name)
+        def accessor(obj:Any, default:Any) -> Any:
+            if obj is None:
+                return default
+            elif isinstance(obj, dict) and name in obj:
+                return obj[name]
+            return path_accessor(obj, default)
+    with _getxattr_accessors_lock:
+        if not name in _getxattr_accessors and (
+            len(_getxattr_accessors) >= _getxattr_accessors_max):
+            _getxattr_accessors.popitem(last=False)
+        _getxattr_accessors[name] = accessor
+    return accessor
+
+# compile a .-separated path (steps pre-resolved)
+_getxattr_special = re.compile(r'[=~\[\]\{\}]')
+def _getxattr_path(name:str) -> Any:
     name_lst = name.split('.')
-    name_lst.reverse()
-    try:
 
-        # process each expression repeatedly on resulting object
-        while len(name_lst) > 1:
-            obj = getxattr(obj, name_lst.pop())
-            if obj is None:
-                return val
-        
-        # special cases for last item in the name expression
-        if isinstance(obj, list) and (name_lst[0] == '[]'):
-            val = '[' + ', '.join([repr(x) for x in obj]) + ']'
-        elif isinstance(obj, dict) and (name_lst[0] == '{keys}'):
-            val = '{' + ', '.join([repr(x) for x in obj.keys()]) + '}'
-        elif isinstance(obj, dict) and (name_lst[0] == '{}'):
-            val = '{' + ', '.join(
-                [repr(k) + ': ' + repr(v) for k,v in obj.items()]) + '}'
-
-        # otherwise, one last time
-        else:
-            val = getxattr(obj, name_lst[0])
-    
-    # ignore all errors
-    except:
-        pass
-    return val
+    # plain field names: tight loop over pre-split parts
+    if not any([(part == '' or _getxattr_special.search(part) or
+        part.isdigit() or (part[0] == '-' and part[1:].isdigit()) or
+        part in ['#', '$', '%', '%%']) for part in name_lst]):
+        parts = name_lst[:-1]
+        last_name = name_lst[-1]
+        def path_accessor(obj:Any, default:Any) -> Any:
+            for part in parts:
+                if isinstance(obj, dict):
+                    obj = obj.get(part)
+                else:
+                    try:
+                        obj = getattr(obj, part)
+                    except:
+                        return default
+                if obj is None:
+                    return default
+            if isinstance(obj, dict):
+                return obj.get(last_name)
+            try:
+                return getattr(obj, last_name)
+            except:
+                return None
+        return path_accessor
+    steps = [_getxattr_step(part) for part in name_lst[:-1]]
+    last_name = name_lst[-1]
+    last_step = _getxattr_step(last_name)
+    def path_accessor(obj:Any, default:Any) -> Any:
+        try:
+
+            # process each expression repeatedly on resulting object
+            for step in steps:
+                try:
+                    obj = step(obj)
+                except:
+                    return default
+                if obj is None:
+                    return default
+
+            # special cases for last item in the name expression
+            if isinstance(obj, list) and (last_name == '[]'):
+                return '[' + ', '.join([repr(x) for x in obj]) + ']'
+            elif isinstance(obj, dict) and (last_name == '{keys}'):
+                return '{' + ', '.join([repr(x) for x in obj.keys()]) + '}'
+            elif isinstance(obj, dict) and (last_name == '{}'):
+                return '{' + ', '.join(
+                    [repr(k) + ': ' + repr(v) for k,v in obj.items()]) + '}'
+
+            # otherwise, one last time
+            try:
+                return last_step(obj)
+            except:
+                return None
+
+        # ignore all errors
+        except:
+            return default
+    return path_accessor
 
 # get attrib list
 def getxattrs(obj:Any, names:list) -> list:
@@ -282,10 +600,7 @@ def getxattrs(obj:Any, names:list) -> list:
     """
     if not isinstance(names, list):
         raise ValueError('Parameter names must be a list.')
-    vs = [None] * len(names)
-    for (idx, name) in enumerate(names):
-        vs[idx] = getxattr(obj, name)
-    return vs
+    return [getxattr(obj, name) for name in names]
 
 # get dicts keys *and* sub-keys, etc
 def getxkeys(obj:dict, sk:str = '', sanitize:bool = True) -> list:
@@ -477,6 +792,257 @@ def gzip_save_var(gzip_file:str, save_var:Any) -> bool:
         raise
     return True
 
+# index: candidate keys for criteria (or None if no index applies)
+def index_candidates(index:dict, criteria:list) -> tuple:
+    """
+    Return candidate keys (in items order) for criteria using an index.
+
+    Parameters
+    ----------
+    index : dict
+        Index object (see index_create), in sync with its items
+    criteria : list
+        List of criteria (see selected)
+    
+    Returns
+    -------
+    candidates : list or None
+        List of keys for which the indexed criteria *may* hold (a
+        superset of the selection), or None if no index applies
+    residual : list
+        List of criteria that still must be tested for the candidates
+        (all criteria not fully resolved by an index)
+    
+    Hash indexes support the '==' and 'in' operators, sorted indexes
+    support the '==', '<', '<=', '>', and '>=' operators (with numeric
+    comparison values; None, NaN, str, list, and dict values never
+    match those). A criterion is only fully resolved if no item holds
+    a value in the field that cannot be indexed (e.g. a list).
+    """
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import bisect
+
+    if criteria is None:
+        criteria = []
+    if (len(criteria) == 3 and isinstance(criteria[0], str)):
+        criteria = [criteria]
+    if index is None:
+        return (None, criteria)
+    candidates = []
+    residual = []
+    fields = index['fields']
+    for c in criteria:
+        if len(c) != 3 or not c[0] in fields:
+            residual.append(c)
+            continue
+        (c_name, c_op, c_test) = c
+        f_index = fields[c_name]
+        if f_index['type'] == 'hash':
+            if c_op == '==':
+                c_test = [c_test]
+            elif c_op != 'in' or isinstance(c_test, str):
+                residual.append(c)
+                continue
+            try:
+                c_test = list(c_test)
+                [hash(v) for v in c_test]
+            except:
+                residual.append(c)
+                continue
+            if f_index['hash'] is None or f_index['pending']:
+                _index_build(index, c_name)
+            c_keys = [f_index['hash'].get(v, []) for v in c_test]
+        else:
+            if not c_op in ['==', '<', '<=', '>', '>='] or (
+                not type(c_test) in [int, float]) or c_test != c_test:
+                residual.append(c)
+                continue
+            if f_index['values'] is None or f_index['pending']:
+                _index_build(index, c_name)
+            values = f_index['values']
+            if c_op == '==':
+                f_range = (bisect.bisect_left(values, c_test),
+                    bisect.bisect_right(values, c_test))
+            elif c_op == '<':
+                f_range = (0, bisect.bisect_left(values, c_test))
+            elif c_op == '<=':
+                f_range = (0, bisect.bisect_right(values, c_test))
+            elif c_op == '>':
+                f_range = (bisect.bisect_right(values, c_test), len(values))
+            else:
+                f_range = (bisect.bisect_left(values, c_test), len(values))
+            c_keys = [None, f_index['keys'][f_range[0]:f_range[1]]]
+        if f_index['other']:
+            c_keys.append(f_index['other'])
+            residual.append(c)
+        candidates.append(c_keys)
+    if not candidates:
+        return (None, residual)
+    
+    # single (hash) list in items order
+    if len(candidates) == 1 and len(candidates[0]) == 1:
+        return (list(candidates[0][0]), residual)
+    c_sets = []
+    for c_keys in candidates:
+        c_set = set()
+        for keys in c_keys:
+            if keys:
+                c_set.update(keys)
+        c_sets.append(c_set)
+    c_sets.sort(key=len)
+    c_set = c_sets[0].intersection(*c_sets[1:])
+    if len(c_set) > (index['count'] // 8):
+        return ([k for k in index['items'].keys() if k in c_set], residual)
+    return (sorted(c_set, key=index['pos'].__getitem__), residual)
+
+# build (or complete) a single field index
+def _index_build(index:dict, name:str):
+    f_index = index['fields'][name]
+    getter = _compile_getter(name)
+    if f_index['type'] == 'hash':
+        if f_index['hash'] is None:
+            f_index['hash'] = dict()
+            f_index['other'] = []
+            items = index['items'].items()
+        else:
+            items = f_index['pending']
+        f_hash = f_index['hash']
+        f_other = f_index['other']
+        for (key, item) in items:
+            try:
+                val = getter(item)
+                if val in f_hash:
+                    f_hash[val].append(key)
+                else:
+                    f_hash[val] = [key]
+            except TypeError:
+                f_other.append(key)
+    else:
+        if f_index['values'] is None:
+            f_index['values'] = []
+            f_index['keys'] = []
+            f_index['other'] = []
+            items = index['items'].items()
+        else:
+            items = f_index['pending']
+        pairs = list(zip(f_index['values'], f_index['keys']))
+        for (key, item) in items:
+            try:
+                val = getter(item)
+            except:
+                val = None
+            if type(val) in [int, float] and val == val:
+                pairs.append((val, key))
+            elif not (val is None or val != val or
+                isinstance(val, (dict, list, str))):
+                f_index['other'].append(key)
+        pairs.sort(key=lambda p: p[0])
+        f_index['values'] = [p[0] for p in pairs]
+        f_index['keys'] = [p[1] for p in pairs]
+    f_index['pending'] = []
+
+# index: create (lazy) field indexes for a dict of items
+def index_create(items:dict, fields:dict) -> dict:
+    """
+    Create a (lazily built) secondary index object for a dict of items.
+
+    Parameters
+    ----------
+    items : dict
+        Dictionary with items (e.g. IsicApi.image_cache)
+    fields : dict
+        Dictionary mapping (dotted) field names to index types, which
+        can be either 'hash' (for equality) or 'sorted' (for numeric)
+    
+    Returns
+    -------
+    index : dict
+        Index object, to be passed into index_update, index_candidates,
+        and select_from(..., index=index)
+    
+    The per-field indexes are only built when first used in a query,
+    and items added to the dict later on are added incrementally once
+    index_update is called (or select_from is called with the index).
+    """
+    index = {
+        'count': 0,
+        'fields': dict(),
+        'items': items,
+        'last': None,
+        'pos': dict(),
+    }
+    for (name, index_type) in fields.items():
+        if not index_type in ['hash', 'sorted']:
+            raise ValueError('Invalid index type for field ' + name + '.')
+        index['fields'][name] = {
+            'hash': None,
+            'keys': None,
+            'other': None,
+            'pending': [],
+            'type': index_type,
+            'values': None,
+        }
+    index_update(index, items)
+    return index
+
+# index: update (sync) index with (added) items
+def index_update(index:dict, items:dict = None):
+    """
+    Update an index object to reflect items added to the dict.
+
+    Parameters
+    ----------
+    index : dict
+        Index object (see index_create)
+    items : dict
+        Dictionary with items (if not the same dict object as the one
+        the index was created for, the index is reset and rebuilt)
+    
+    No return value.
+
+    The index is also rebuilt if items were removed or replaced, which
+    is detected by the last indexed key no longer being at its position
+    in the dict or no longer holding the same (identical) item.
+    """
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import itertools
+
+    if items is None:
+        items = index['items']
+    count = index['count']
+    stale = (not items is index['items'] or len(items) < count)
+    if not stale and count > 0:
+        try:
+            (key, item) = next(
+                itertools.islice(items.items(), count - 1, None))
+            stale = (key != index['last'][0] or not item is index['last'][1])
+        except:
+            stale = True
+    if stale:
+        index['count'] = 0
+        index['items'] = items
+        index['last'] = None
+        index['pos'] = dict()
+        for f_index in index['fields'].values():
+            f_index['hash'] = None
+            f_index['keys'] = None
+            f_index['other'] = None
+            f_index['pending'] = []
+            f_index['values'] = None
+    count = index['count']
+    if len(items) == count:
+        return
+    pos = index['pos']
+    added = list(itertools.islice(items.items(), count, None))
+    for (key, _) in added:
+        pos[key] = count
+        count += 1
+    index['count'] = count
+    index['last'] = added[-1]
+    for f_index in index['fields'].values():
+        if not f_index['hash'] is None or not f_index['values'] is None:
+            f_index['pending'].extend(added)
+
 # letters only
 def letters_only(word:str, lower_case:bool = True):
     """
@@ -732,6 +1298,199 @@ def rand_hex_str(str_len:int = 2) -> str:
     s += ('{0:0' + str(str_len) + 'x}').format(random.randrange(16 ** str_len))
     return s
 
+# CSV value parsing (per value, shared by all column types)
+_csv_bools = {'true': True, 'false': False}
+def _csv_parse_value(v:Any) -> Any:
+    if isinstance(v, str) and v:
+        vl = v.lower()
+        if vl in _csv_bools:
+            return _csv_bools[vl]
+        try:
+            nv = float(v)
+            if nv == float(int(nv)):
+                nv = int(nv)
+            return nv
+        except:
+            pass
+        if v[0] == '[' and v[-1] == ']':
+            # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+            import ast
+            try:
+                nv = ast.literal_eval(v)
+                if isinstance(nv, list):
+                    return nv
+            except:
+                pass
+    return v
+
+# CSV number parsing (whole numbers returned as int)
+def _csv_parse_number(v:str) -> Union[float, int]:
+    nv = float(v)
+    if nv == float(int(nv)):
+        return int(nv)
+    return nv
+
+# CSV list parsing
+def _csv_parse_list(v:str) -> list:
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import ast
+    nv = ast.literal_eval(v)
+    if not isinstance(nv, list):
+        raise ValueError('Not a list.')
+    return nv
+
+# infer CSV column type from a sample of (string) values
+def _csv_infer_type(values:list) -> str:
+    values = [v for v in values if v]
+    if not values:
+        return 'auto'
+    vtypes = set()
+    for v in values:
+        if v.lower() in _csv_bools:
+            vtypes.add('bool')
+            continue
+        try:
+            nv = float(v)
+            if nv != nv or nv in [float('inf'), float('-inf')]:
+                return 'auto'
+            vtypes.add('number')
+            continue
+        except:
+            pass
+        if v[0] == '[' and v[-1] == ']':
+            vtypes.add('list')
+        else:
+
+            # strings in the sample do not rule out later (parsed) values
+            return 'auto'
+    if len(vtypes) == 1:
+        return vtypes.pop()
+    return 'auto'
+
+# convert a CSV column (each distinct value once)
+def _csv_map_column(column:list, conv:Any, empty:Any = '') -> list:
+    if empty == '':
+        memo = {v: (conv(v) if v else v) for v in set(column)}
+    else:
+        memo = {v: (conv(v) if v else empty) for v in set(column)}
+    column = [memo[v] for v in column]
+
+    # lists must not be shared between rows
+    lists = [v for v in memo.values() if isinstance(v, list)]
+    if lists:
+        if any([isinstance(lv, (dict, list)) for v in lists for lv in v]):
+
+            # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+            import copy
+
+            column = [copy.deepcopy(v) if isinstance(v, list) else v
+                for v in column]
+        else:
+            column = [v.copy() if v.__class__ is list else v for v in column]
+    return column
+
+# convert a CSV column (whole column at once, falling back to per value)
+def _csv_convert_column(column:list, ctype:Any) -> Any:
+    if ctype == 'str' or ctype is str:
+        return column
+    elif ctype == 'auto':
+        return _csv_map_column(column, _csv_parse_value)
+    elif ctype in ['bool', 'number', 'list']:
+        try:
+            if ctype == 'bool':
+                return _csv_map_column(column, lambda v: _csv_bools[v.lower()])
+            elif ctype == 'number':
+                return _csv_map_column(column, _csv_parse_number)
+            return _csv_map_column(column, _csv_parse_list)
+        except:
+            return _csv_map_column(column, _csv_parse_value)
+    elif ctype is bool:
+        return _csv_map_column(column, lambda v: _csv_bools[v.lower()], None)
+    elif ctype in [int, float]:
+        return _csv_map_column(column, ctype, None)
+    elif ctype is list:
+        return _csv_map_column(column, _csv_parse_list, None)
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import numpy
+    ctype = numpy.dtype(ctype)
+    if ctype.kind in 'fc':
+        return numpy.asarray([numpy.nan if not v else v for v in column],
+            dtype=ctype)
+    return numpy.asarray(column).astype(ctype)
+
+# pack (hierarchical, dotted) keys of dicts into sub-dicts
+def _csv_pack_keys(headers:list, columns:list) -> tuple:
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import copy
+
+    hd = dict()
+    for h in headers:
+        if not '.' in h:
+            hd[h] = dict()
+        else:
+            hks = h.split('.')
+            td = hd
+            while hks[0] in td:
+                td = td[hks[0]]
+                hks.pop(0)
+            while len(hks) > 0:
+                td[hks[0]] = dict()
+                td = td[hks[0]]
+                hks.pop(0)
+    num_lines = len(columns[0]) if columns else 0
+    od = [None] * num_lines
+    paths = [h.split('.') for h in headers]
+    clean = not any([(h in headers) for h in
+        ['.'.join(p[:k]) for p in paths for k in range(1, len(p))]])
+    clean = clean and not any([(_getxattr_special.search(h) or
+        any([(part == '' or part.isdigit() or part[0] == '-' or
+        part in ['#', '$', '%', '%%']) for part in p]))
+        for (h, p) in zip(headers, paths)])
+
+    # fast path: (fresh) dicts created from a plan in header order
+    if clean:
+        leaf_cols = {tuple(p): cidx for (cidx, p) in enumerate(paths)}
+        parents = []
+        plan = []
+        def plan_node(node:dict, pidx:int, prefix:tuple):
+            for (key, sub) in node.items():
+                path = prefix + (key,)
+                if path in leaf_cols:
+                    plan.append((pidx, key, leaf_cols[path]))
+                else:
+                    parents.append(path)
+                    plan.append((pidx, key, -1))
+                    plan_node(sub, len(parents) - 1, path)
+        plan_node(hd, -1, tuple())
+        for idx in range(num_lines):
+            ov = dict()
+            nodes = []
+            for (pidx, key, cidx) in plan:
+                target = ov if pidx < 0 else nodes[pidx]
+                if cidx < 0:
+                    node = dict()
+                    target[key] = node
+                    nodes.append(node)
+                    continue
+                v = columns[cidx][idx]
+                if v is None or (isinstance(v, str) and v == ''):
+                    continue
+                target[key] = v
+            od[idx] = ov
+        return (od, list(hd.keys()))
+    for idx in range(num_lines):
+        ov = copy.deepcopy(hd)
+        for (h, column) in zip(headers, columns):
+            v = column[idx]
+            if v is None or (isinstance(v, str) and v == ''):
+                delxattr(ov, h)
+            else:
+                setxattr(ov, h, v)
+        od[idx] = ov
+    return (od, list(hd.keys()))
+
 # read CSV (cheap!!)
 def read_csv(
     csv_filename:str,
@@ -740,6 +1499,8 @@ def read_csv(
     out_format:str = 'dict_of_lists',
     parse_vals:bool = True,
     pack_keys:bool = False,
+    dtypes:dict = None,
+    sample_size:int = 1000,
     ) -> dict:
     """
     Somewhat extended CSV file reading
@@ -761,6 +1522,10 @@ def read_csv(
         If True, re-convert complex values (lists, etc.) into python
     pack_keys : bool
         If True (default: False!), pack hierarchical keys into sub-dicts
+    dtypes : dict
+        Optional per-column types (see read_csv_batches)
+    sample_size : int
+        Number of rows used to infer column types (see read_csv_batches)
     
     Returns
     -------
@@ -768,92 +1533,38 @@ def read_csv(
         List or Dict with read records from CSV
     """
 
-    # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
-    import ast
-    import copy
-    import csv
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import numpy
 
-    if not isinstance(headers, list) and not isinstance(headers, bool):
-        raise ValueError('Parameter headers must either be a list or boolean.')
-    if not isinstance(sep, str) or len(sep) != 1 or sep == '\n' or sep == '\r' or sep == '"':
-        sep = ','
+    od = None
     try:
-        with open(csv_filename, 'r', newline='') as csv_file:
-            csv_reader = csv.reader(csv_file, delimiter=sep)
-            row = next(csv_reader)
-            num_fields = len(row)
-            d = []
-            if headers is False:
-                headers = ['column_{0:d}'.format(k+1) for k in range(num_fields)]
-                d.append({hk:dv for (hk,dv) in zip(headers, row)})
-            elif headers is True:
-                headers = row
-            else:
-                num_fields = len(headers)
-                if num_fields > len(row):
-                    row.extend([None] * (num_fields - len(row)))
-                    warnings.warn('CSV file does not contain as many fields.')
-                d.append({hk:dv for (hk,dv) in zip(headers, row)})
-            for row in csv_reader:
-                if num_fields > len(row):
-                    row.extend([None] * (num_fields - len(row)))
-                d.append({hk:dv for (hk,dv) in zip(headers, row)})
-        num_lines = len(d)
+        for batch in read_csv_batches(csv_filename, sep=sep, headers=headers,
+            parse_vals=parse_vals, dtypes=dtypes, sample_size=sample_size):
+            if od is None:
+                od = {h: [] for h in batch.keys()}
+            for (h, column) in batch.items():
+                od[h].append(column)
     except:
         raise
-    if parse_vals:
-        for item in d:
-            for h in headers:
-                v = item[h]
-                if isinstance(v, str) and v:
-                    if v.lower() == 'true':
-                        item[h] = True
-                        continue
-                    elif v.lower() == 'false':
-                        item[h] = False
-                        continue
-                    try:
-                        nv = float(v)
-                        if nv == float(int(nv)):
-                            nv = int(nv)
-                        item[h] = nv
-                    except:
-                        pass
-                    if v[0] == '[' and v[-1] == ']':
-                        try:
-                            nv = ast.literal_eval(v)
-                            if isinstance(nv, list):
-                                item[h] = nv
-                        except:
-                            pass
+    if od is None:
+        return [] if out_format == 'list_of_dicts' else dict()
+    for (h, columns) in od.items():
+        if isinstance(columns[0], numpy.ndarray):
+            od[h] = numpy.concatenate(columns)
+        elif len(columns) == 1:
+            od[h] = columns[0]
+        else:
+            od[h] = [v for column in columns for v in column]
+    headers = list(od.keys())
+    columns = [od[h] for h in headers]
+    num_lines = len(columns[0]) if columns else 0
+    if out_format == 'dict_of_lists':
+        return od
     if ((pack_keys and '_dicts' in out_format) or
         (isinstance(pack_keys, str) and pack_keys == 'force')):
-        hd = dict()
-        for h in headers:
-            if not '.' in h:
-                hd[h] = dict()
-            else:
-                hks = h.split('.')
-                td = hd
-                while hks[0] in td:
-                    td = td[hks[0]]
-                    hks.pop(0)
-                while len(hks) > 0:
-                    td[hks[0]] = dict()
-                    td = td[hks[0]]
-                    hks.pop(0)
-        od = []
-        for idx in range(num_lines):
-            ov = copy.deepcopy(hd)
-            for h in headers:
-                v = d[idx][h]
-                if v is None or (isinstance(v, str) and v == ''):
-                    delxattr(ov, h)
-                else:
-                    setxattr(ov, h, v)
-            od.append(ov)
-        d = od
-        headers = list(hd.keys())
+        (d, headers) = _csv_pack_keys(headers, columns)
+    else:
+        d = [dict(zip(headers, values)) for values in zip(*columns)]
     if out_format == 'list_of_dicts':
         return d
     elif out_format == 'dict_of_dicts':
@@ -861,9 +1572,9 @@ def read_csv(
             idk = '_id'
         else:
             idk = None
-            for h in headers:
+            for (h, column) in od.items():
                 try:
-                    ts = set(od[h])
+                    ts = set(column)
                     if len(ts) == num_lines:
                         idk = h
                         break
@@ -871,17 +1582,113 @@ def read_csv(
                     pass
             if idk is None:
                 raise RuntimeError('No suitable key column in data.')
-        od = dict()
-        for idx in range(num_lines):
-            od[d[idx][idk]] = d[idx]
-        d = od
-    elif out_format == 'dict_of_lists':
-        od = dict()
-        for h in headers:
-            od[h] = [v[h] for v in d]
-        d = od
+        d = {k: item for (k, item) in zip(od[idk], d)}
     return d
 
+# read CSV in batches (streaming, typed)
+def read_csv_batches(
+    csv_filename:str,
+    sep:str = ',',
+    headers:Union[bool,list] = True,
+    parse_vals:bool = True,
+    dtypes:dict = None,
+    sample_size:int = 1000,
+    batch_size:int = 0,
+    ) -> iter:
+    """
+    Read CSV file in batches of columns (streaming, typed)
+
+    Parameters
+    ----------
+    csv_filename : str
+        Filename to read from
+    sep : str
+        Separator string (length MUST be 1!)
+    headers : bool or list
+        Read headers (if True) or use passed in headers
+    parse_vals : bool
+        If True, convert values (bools, numbers, lists) into python
+    dtypes : dict
+        Optional mapping of column names to types, either of python
+        types bool, int, float, str, or list (empty values as None),
+        or any numpy dtype (column returned as numpy.ndarray, empty
+        values as NaN for floating point types)
+    sample_size : int
+        Number of rows used to infer the column types of columns not
+        in dtypes (default: 1000; 0 parses every value separately);
+        columns with (non-list) strings in the sample are parsed per
+        value, and columns of other types fall back to that on errors
+    batch_size : int
+        Number of rows per batch (default: 0, all rows in one batch)
+    
+    Yields
+    ------
+    batch : dict
+        Dict with one list (or array) of values per column (header)
+    """
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import csv
+    import itertools
+
+    if not isinstance(headers, list) and not isinstance(headers, bool):
+        raise ValueError('Parameter headers must either be a list or boolean.')
+    if not isinstance(sep, str) or len(sep) != 1 or sep == '\n' or sep == '\r' or sep == '"':
+        sep = ','
+    if dtypes is None:
+        dtypes = dict()
+    if batch_size is None or batch_size <= 0:
+        batch_size = None
+    with open(csv_filename, 'r', newline='') as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=sep)
+        try:
+            row = next(csv_reader)
+        except StopIteration:
+            return
+        num_fields = len(row)
+        first_rows = []
+        if headers is False:
+            headers = ['column_{0:d}'.format(k+1) for k in range(num_fields)]
+            first_rows.append(row)
+        elif headers is True:
+            headers = row
+        else:
+            num_fields = len(headers)
+            if num_fields > len(row):
+                warnings.warn('CSV file does not contain as many fields.')
+            first_rows.append(row)
+        num_fields = len(headers)
+        ctypes = None
+        rows = itertools.chain(first_rows, csv_reader)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                if ctypes is None:
+                    yield {h: [] for h in headers}
+                break
+            for (ridx, row) in enumerate(batch):
+                if len(row) != num_fields:
+                    if len(row) < num_fields:
+                        batch[ridx] = row + [None] * (num_fields - len(row))
+                    else:
+                        batch[ridx] = row[:num_fields]
+            columns = [list(column) for column in zip(*batch)]
+            if ctypes is None:
+                ctypes = []
+                for (h, column) in zip(headers, columns):
+                    if h in dtypes:
+                        ctypes.append(dtypes[h])
+                    elif not parse_vals:
+                        ctypes.append('str')
+                    elif sample_size is None or sample_size <= 0:
+                        ctypes.append('auto')
+                    else:
+                        ctypes.append(_csv_infer_type(column[:sample_size]))
+            yield {h: _csv_convert_column(column, ctype)
+                for (h, column, ctype) in zip(headers, columns, ctypes)}
+            if batch_size is None:
+                break
+
 # select from list
 def selected(item:object, criteria:list) -> bool:
     """
@@ -912,55 +1719,10 @@ def selected(item:object, criteria:list) -> bool:
         {'name': 'Peter', 'age': 72},
         ['age', '>=', 65])
     """
-    is_selected = True
-    if (len(criteria) == 3 and isinstance(criteria[0], str)):
-        criteria = [criteria]
     try:
-        for c in criteria:
-            if not is_selected:
-                break
-            if len(c) != 3:
-                raise ValueError('Invalid criterion.')
-            c_op = c[1]
-            c_test = c[2]
-            val = getxattr(item, c[0], None)
-            if c_op == '==':
-                is_selected = (val == c_test)
-            elif c_op == '!=':
-                is_selected = (val != c_test)
-            elif c_op == '<':
-                is_selected = (val < c_test)
-            elif c_op == '<=':
-                is_selected = (val <= c_test)
-            elif c_op == '>':
-                is_selected = (val > c_test)
-            elif c_op == '>=':
-                is_selected = (val >= c_test)
-            elif c_op == 'in':
-                is_selected = (val in c_test)
-            elif c_op == 'not in':
-                is_selected = (not val in c_test)
-            elif c_op == 'ni':
-                is_selected = (c_test in val)
-            elif c_op == 'not ni':
-                is_selected = (not c_test in val)
-            elif c_op == 'match' or c_op == '~':
-                is_selected = (not re.search(c_test, val) is None)
-            elif c_op == 'not match' or c_op == '!~':
-                is_selected = (re.search(c_test, val) is None)
-            elif c_op == 'is':
-                is_selected = (val is c_test)
-            elif c_op == 'not is':
-                is_selected = (not val is c_test)
-            elif c_op == 'is None':
-                is_selected = (val is None)
-            elif c_op == 'not is None':
-                is_selected = (not val is None)
-            else:
-                raise ValueError('Invalid criterion.')
+        return compile_criteria(criteria)(item)
     except:
-        is_selected = False
-    return is_selected
+        return False
 
 # select from a list (or dict) of items
 def select_from(
@@ -968,6 +1730,7 @@ def select_from(
     criteria:list,
     dict_as_keys:bool=False,
     dict_as_values:bool=False,
+    index:dict=None,
     ) -> Union[list, dict]:
     """
     Sub-select from a list (or dict) of items using criteria.
@@ -982,6 +1745,9 @@ def select_from(
         Flag, if set to true, return a list of dict keys of matches
     dict_as_values : bool
         Flag, if set to true, return a list of dict values of matches
+    index : dict
+        Optional index object (see index_create) for a dict of items,
+        used to restrict the items to test to index candidates
     
     Returns
     -------
@@ -993,21 +1759,37 @@ def select_from(
     sub_selection = select_from(big_list,
         ['diagnosis', '==', 'melanoma'])
     """
+    try:
+        predicate = compile_criteria(criteria)
+    except:
+        raise
+    if not index is None and isinstance(items, dict):
+        index_update(index, items)
+        (candidates, residual) = index_candidates(index, criteria)
+        if not candidates is None:
+            items = {k: items[k] for k in candidates}
+            if not residual:
+                if dict_as_keys:
+                    return list(items.keys())
+                elif dict_as_values:
+                    return list(items.values())
+                return items
+            predicate = compile_criteria(residual)
+    if not predicate.ordered and hasattr(items, '__len__') and len(items) >= 1024:
+        if isinstance(items, dict):
+            sample = list(items.values())
+        else:
+            sample = list(items)
+        predicate = predicate.order(sample[::len(sample) // 256])
     if isinstance(items, dict):
-        try:
-            if dict_as_keys:
-                return [k for (k,v) in items.items() if selected(v, criteria)]
-            elif dict_as_values:
-                return [v for v in items.values() if selected(v, criteria)]
-            else:
-                return {k: v for (k,v) in items.items() if selected(v, criteria)}
-        except:
-            raise
+        if dict_as_keys:
+            return [k for (k,v) in items.items() if predicate(v)]
+        elif dict_as_values:
+            return [v for v in items.values() if predicate(v)]
+        else:
+            return {k: v for (k,v) in items.items() if predicate(v)}
     else:
-        try:
-            return [item for item in items if selected(item, criteria)]
-        except:
-            raise
+        return [item for item in items if predicate(item)]
 
 # set extended attribute
 def setxattr(obj:Any, name:str, value:Any, force:bool = False):
@@ -1207,3 +1989,68 @@ def write_csv(
                 raise ValueError('List only supported with all dict fields.')
     except:
         raise
+
+# write a CSV file from batches (streaming)
+def write_csv_batches(
+    csv_filename:str,
+    batches:iter,
+    sep:str = ',',
+    headers:bool = True,
+    ) -> int:
+    """
+    Streaming CSV writing of batches (see read_csv_batches)
+
+    Parameters
+    ----------
+    csv_filename : str
+        Filename of CSV to write
+    batches : iterable
+        Iterable (e.g. generator) of batches, each either a dict with
+        one list (or numpy.ndarray) per column, or a list of dicts
+        (whereas fields are determined from the first batch)
+    sep : str
+        Separator string (len must be 1!)
+    headers : bool
+        If True (default), write keys as first row
+    
+    Returns
+    -------
+    num_rows : int
+        Number of rows written (excluding headers)
+    """
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import csv
+
+    if not isinstance(sep, str) or len(sep) != 1 or sep == '\n' or sep == '\r' or sep == '"':
+        sep = ','
+    fields = None
+    num_rows = 0
+    try:
+        with open(csv_filename, 'w', newline='') as csv_file:
+            cw = csv.writer(csv_file, delimiter=sep)
+            for batch in batches:
+                if isinstance(batch, list):
+                    if not batch:
+                        continue
+                    if fields is None:
+                        fields = getxkeys(batch)
+                    columns = [getxattr(batch, '[].' + k) for k in fields]
+                elif isinstance(batch, dict):
+                    if fields is None:
+                        fields = list(batch.keys())
+                    columns = [batch[k] for k in fields]
+                    columns = [c.tolist() if hasattr(c, 'tolist') else c
+                        for c in columns]
+                else:
+                    raise ValueError('Invalid batch in batches.')
+                if num_rows == 0 and headers:
+                    cw.writerow(fields)
+                rows = list(zip(*columns))
+                cw.writerows(rows)
+                num_rows += len(rows)
+            if fields is None:
+                csv_file.write('\n')
+    except:
+        raise
+    return num_rows
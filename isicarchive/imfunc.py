@@ -38,12 +38,16 @@ image_read_border
     Read encoded image border
 image_register
     Perform rigid-body alignment of images based on gradient
+image_register_many
+    Register many images to one template (worker pool)
 image_resample
-    Cheap (!) resampling of an image
+    Resampling of an image (antialiased, with cached weights)
 image_rotate
     Rotate an image (ndarray)
 lut_lookup
     Color lookup from a table (LUT)
+lut_map
+    Map values to colors and alpha through LUTs (single pass)
 segmentation_outline
     Extract outline from a segmentation mask image
 superpixel_dice
@@ -52,6 +56,8 @@ superpixel_neighbors
     Generate neighbors lists for each superpixel in an image
 superpixel_outlines
     Extract superpixel (outline) shapes from superpixel map
+superpixel_patches
+    Extract fixed-size (resampled) patches for a list of superpixels
 superpixel_values
     Return the values of a superpixel
 write_image
@@ -93,7 +99,8 @@ def color_superpixels(
     spmap : numpy.ndarray
         Mapping array from func.superpixels_map(...)
     color : either a list or numpy.ndarray
-        RGB Color code or list of codes to use to color superpixels
+        RGB Color code or list of codes to use to color superpixels,
+        if a (numsp, 3) numpy.ndarray, all superpixels are painted at once
     alpha : either float or numpy.float value or None
         Alpha (opacity) value between 0.0 and 1.0, if None, set to 1.0
     spval : optional numpy.ndarray
@@ -167,7 +174,34 @@ def color_superpixels(
             raise ValueError('alpha list must match number of superpixels')
     sp_skip = 6.0 * numpy.trunc(0.75 + 0.25 * numpy.sqrt([
         im_shape[0] * im_shape[1] / spmap.shape[0]]))[0]
-    
+
+    # one color per superpixel (array), all superpixels at once
+    if (isinstance(color, numpy.ndarray) and color.ndim == 2 and
+        color.shape[0] == numsp and numpy.asarray(alpha).ndim <= 1):
+        splst = numpy.asarray(splst, dtype=numpy.int64).reshape(numsp)
+        spnum = spmap[splst, -1]
+        spsel = numpy.arange(spmap.shape[1] - 1).reshape((1, -1)) < spnum.reshape((-1, 1))
+        sppidx = spmap[splst, 0:-1][spsel]
+        sprep = numpy.repeat(numpy.arange(numsp), spnum)
+        spalpha = numpy.asarray(alpha, dtype=numpy.float64) * numpy.asarray(
+            spval, dtype=numpy.float64)
+        spalpha = (spalpha * numpy.ones(numsp, dtype=numpy.float64))[sprep]
+        spinv_alpha = 1.0 - spalpha
+        spcol = color.astype(numpy.float64)[sprep,:]
+        for p in range(planes):
+            image[sppidx, p] = numpy.round(
+                spalpha * spcol[:,p] + spinv_alpha * image[sppidx, p])
+        if has_alpha:
+            image[sppidx, 3] = numpy.round(255.0 * 1.0 -
+                (1.0 - 255.0 * image[sppidx, 3]) *
+                (1.0 - 255.0 * spalpha))
+        elif has_almap:
+            almap[sppidx] = 1.0 - (1.0 - almap[sppidx]) * spinv_alpha
+        image.shape = im_shape
+        if has_almap:
+            almap.shape = am_shape
+        return image
+
     # for each superpixel (index)
     for idx in range(numsp):
 
@@ -557,20 +591,20 @@ def image_compose(
             continue
         if len(ii_shape) == 2:
             if sfrom_x == 0 and sfrom_y == 0 and sto_x == ii_shape[1] and sto_y == ii_shape[0]:
-                out[tfrom_y:tto_y, tfrom_x:tto_x, :] = image_mix(
-                    out[tfrom_y:tto_y, tfrom_x:tto_x, :], ii_image, ii_alpha)
+                image_mix(out[tfrom_y:tto_y, tfrom_x:tto_x, :], ii_image, ii_alpha,
+                    out=out[tfrom_y:tto_y, tfrom_x:tto_x, :])
             else:
-                out[tfrom_y:tto_y, tfrom_x:tto_x, :] = image_mix(
-                    out[tfrom_y:tto_y, tfrom_x:tto_x, :],
-                    ii_image[sfrom_y:sto_y, sfrom_x:sto_x], ii_alpha)
+                image_mix(out[tfrom_y:tto_y, tfrom_x:tto_x, :],
+                    ii_image[sfrom_y:sto_y, sfrom_x:sto_x], ii_alpha,
+                    out=out[tfrom_y:tto_y, tfrom_x:tto_x, :])
         else:
             if sfrom_x == 0 and sfrom_y == 0 and sto_x == ii_shape[1] and sto_y == ii_shape[0]:
-                out[tfrom_y:tto_y, tfrom_x:tto_x, :] = image_mix(
-                    out[tfrom_y:tto_y, tfrom_x:tto_x, :], ii_image, ii_alpha)
+                image_mix(out[tfrom_y:tto_y, tfrom_x:tto_x, :], ii_image, ii_alpha,
+                    out=out[tfrom_y:tto_y, tfrom_x:tto_x, :])
             else:
-                out[tfrom_y:tto_y, tfrom_x:tto_x, :] = image_mix(
-                    out[tfrom_y:tto_y, tfrom_x:tto_x, :],
-                    ii_image[sfrom_y:sto_y, sfrom_x:sto_x, :], ii_alpha)
+                image_mix(out[tfrom_y:tto_y, tfrom_x:tto_x, :],
+                    ii_image[sfrom_y:sto_y, sfrom_x:sto_x, :], ii_alpha,
+                    out=out[tfrom_y:tto_y, tfrom_x:tto_x, :])
     return out
 
 # image correlation (pixel values)
@@ -956,6 +990,64 @@ def image_gray(
             (im_shape[0], im_shape[1], 1,)).repeat(3, axis=2)
     return p.astype(image.dtype)
 
+# HSL based histograms: setup (mask, ranges, sampling; cached)
+_hslhist_setup_cache = dict()
+def _hslhist_setup(
+    shape:tuple,
+    bins:int,
+    binsamples:int,
+    ranges:tuple,
+    mask_cradius:float,
+    ) -> dict:
+    """
+    Compute (and cache) the setup shared by image_hslhist calls
+
+    Parameters
+    ----------
+    shape : tuple
+        Image shape (height, width) the mask is computed for
+    bins : int
+        Number of histogram bins (per dimension)
+    binsamples : int
+        Number of (smoothed) samples taken from the bins
+    ranges : tuple
+        Flat (hmin, hmax, smin, smax, lmin, lmax) tuple
+    mask_cradius : float
+        Radius of the circular (elliptical) mask, relative to the size
+    
+    Returns
+    -------
+    setup : dict
+        Fields 'bins', 'mask' (flattened), 'ranges' (ndarray),
+        'sc' (sampling coordinates or None), and 'smooth' (kernel size)
+    """
+    key = (shape, bins, binsamples, ranges, mask_cradius)
+    if key in _hslhist_setup_cache:
+        return _hslhist_setup_cache[key]
+    if binsamples > bins or binsamples < 2:
+        raise ValueError('Invalid bin sampling.')
+    cx = 0.5 * float(shape[0] - 1)
+    cy = 0.5 * float(shape[1] - 1)
+    masky, maskx = numpy.meshgrid(numpy.arange(-cy, cy + 0.5, 1.0) / cy,
+        numpy.arange(-cx, cx + 0.5, 1.0) / cx)
+    mask = ((maskx * maskx + masky * masky) <= (mask_cradius * mask_cradius))
+    if binsamples < bins:
+        ssize = float(bins) / float(binsamples)
+        sc = numpy.round(numpy.arange(0.5 * ssize, float(bins), ssize)).astype(numpy.int32)
+    else:
+        sc = None
+    setup = {
+        'bins': bins,
+        'mask': mask.reshape(mask.size),
+        'ranges': numpy.asarray(ranges, dtype=numpy.float64),
+        'sc': sc,
+        'smooth': float(bins) / float(binsamples),
+    }
+    if len(_hslhist_setup_cache) >= 16:
+        _hslhist_setup_cache.pop(next(iter(_hslhist_setup_cache)))
+    _hslhist_setup_cache[key] = setup
+    return setup
+
 # HSL based histograms
 def image_hslhist(
     image:numpy.ndarray,
@@ -969,45 +1061,61 @@ def image_hslhist(
     lmin:float = 0.0,
     lmax:float = 1.0,
     mask:numpy.ndarray = None,
-    mask_cradius:float = 0.875,
+    mask_cradius:float = 1.0,
     ) -> tuple:
+    """
+    Compute joint (hue-saturation, hue-lightness, saturation-lightness)
+    histograms of an RGB image
+
+    Parameters
+    ----------
+    image : ndarray
+        RGB image (uint8 or float in the range of 0 to 1)
+    resize : int
+        Resample image to resize-by-resize pixels first (default: 512)
+    bins : int
+        Number of histogram bins (per dimension, default: 64)
+    binsamples : int
+        Number of (smoothed) bins to return (per dimension, default: 8)
+    hmin, hmax, smin, smax, lmin, lmax : float
+        Histogram ranges (default: 0.0 to 1.0)
+    mask : ndarray
+        Optional boolean mask (must match the resampled image)
+    mask_cradius : float
+        Radius of circular mask (relative to image size, default: 1.0),
+        used if no mask is given
+    
+    Returns
+    -------
+    (hs, hl, sl) : tuple
+        Histogram arrays (binsamples-by-binsamples)
+    """
 
     # IMPORT DONE HERE TO SAVE TIME DURING IMPORT
-    from .sampler import Sampler
-    s = Sampler()
+    from .jitfunc import hsl_histograms
 
     if len(image.shape) != 3 or image.shape[2] != 3:
         raise ValueError('Invalid image. Must be RGB.')
-    if binsamples > bins or binsamples < 2:
-        raise ValueError('Invalid bin sampling.')
-    if image.dtype == numpy.uint8:
-        image = (1.0 / 255.0) * image.astype(numpy.float64)
     if not resize is None and resize > 0:
-        image = s.sample_grid(image, [resize, resize])
-    hslimage = rgb2hslv(image[:,:,0], image[:,:,1], image[:,:,2])
+        if image.dtype != numpy.uint8:
+            image = image.astype(numpy.float32)
+        image = image_resample(image, (resize, resize), 'linear')
+    setup = _hslhist_setup(image.shape[0:2], bins, binsamples,
+        (hmin, hmax, smin, smax, lmin, lmax), mask_cradius)
     if mask is None or len(mask.shape) != 2 or mask.shape != image.shape[:2]:
-        cx = 0.5 * float(image.shape[0] - 1)
-        cy = 0.5 * float(image.shape[1] - 1)
-        maskx, masky = numpy.meshgrid(numpy.arange(-1.0, 1.0+0.5/cx, 1.0/cx),
-            numpy.arange(-1.0, 1.0+0.5/cy, 1.0/cy))
-        mask = (maskx * maskx + masky * masky) <= 1.0
-    hs = numpy.histogram2d(hslimage[0][mask], hslimage[1][mask], bins=bins,
-        range=[[hmin, hmax], [smin, smax]])
-    hl = numpy.histogram2d(hslimage[0][mask], hslimage[2][mask], bins=bins,
-        range=[[hmin, hmax], [lmin, lmax]])
-    sl = numpy.histogram2d(hslimage[1][mask], hslimage[2][mask], bins=bins,
-        range=[[smin, smax], [lmin, lmax]])
-    if binsamples < bins:
-        ssize = float(bins) / float(binsamples)
-        sc = numpy.round(numpy.arange(0.5 * ssize, float(bins), ssize)).astype(numpy.int32)
-        hs = image_smooth_fft(hs[0], 1.0 / float(binsamples))[:,sc][sc,:]
-        hl = image_smooth_fft(hl[0], 1.0 / float(binsamples))[:,sc][sc,:]
-        sl = image_smooth_fft(sl[0], 1.0 / float(binsamples))[:,sc][sc,:]
+        mask = setup['mask']
     else:
-        hs = hs[0]
-        hl = hl[0]
-        sl = sl[0]
-    return (hs, hl, sl)
+        mask = (mask > 0).reshape(mask.size)
+    (h, s, l) = rgb2hslv(image, channels=['h', 'sl', 'l'])
+    hists = hsl_histograms(h.reshape(h.size), s.reshape(s.size),
+        l.reshape(l.size), mask, setup['ranges'], bins,
+        max(1, min(64, h.size // 16384)))
+    sc = setup['sc']
+    if not sc is None:
+        hists = image_smooth_fft(hists.transpose((1, 2, 0)), setup['smooth'])
+        return (hists[:,:,0][:,sc][sc,:], hists[:,:,1][:,sc][sc,:],
+            hists[:,:,2][:,sc][sc,:])
+    return (hists[0], hists[1], hists[2])
 
 # mark border of an image with "content"
 def image_mark_border(
@@ -1464,10 +1572,8 @@ def image_match(
             std_corr = target_std / source_std
             source_image = source_mean + std_corr * (source_image - source_mean)
     if not source_is_gray and not target_is_gray and (match_hue or match_saturation):
-        source_hslv = rgb2hslv(source_image[:,:,0],
-            source_image[:,:,1], source_image[:,:,2])
-        target_hslv = rgb2hslv(target_image[:,:,0],
-            target_image[:,:,1], target_image[:,:,2])
+        source_hslv = rgb2hslv(source_image, channels=['h', 'sl'])
+        target_hslv = rgb2hslv(target_image, channels=['h', 'sl'])
         source_hue = source_hslv[0]
         source_sat = source_hslv[1]
         target_hue = target_hslv[0]
@@ -1484,11 +1590,27 @@ def image_match(
         source_image[source_image > 255] = 255
     return source_image.astype(source_type)
 
+# image as 3D (height, width, planes) view
+def _image_hwc(image:numpy.ndarray) -> numpy.ndarray:
+    if image.ndim == 1:
+        image = image.reshape((image.size, 1, 1,))
+    elif image.ndim == 2:
+        if image.shape[1] == 3:
+            image = image.reshape((image.shape[0], 1, 3,))
+        else:
+            image = image.reshape((image.shape[0], image.shape[1], 1,))
+    elif image.ndim != 3:
+        raise ValueError('Invalid image.')
+    if image.shape[2] == 2:
+        raise ValueError('Invalid image.')
+    return image
+
 # image mixing (python portion)
 def image_mix(
     image_1:numpy.ndarray,
     image_2:numpy.ndarray,
     alpha_2:Union[float, numpy.ndarray, None] = 0.5,
+    out:numpy.ndarray = None,
     ) -> numpy.ndarray:
     """
     Mix two (RGB and/or grayscale) image with either max or blending
@@ -1496,15 +1618,19 @@ def image_mix(
     Parameters
     ----------
     image_1 : ndarray
-        First image (2D: gray, 3D: color)
+        First image (2D: gray, 3D: color, RGBA images are supported)
     image_2 : ndarray
-        Second image
+        Second image (if RGBA, the alpha plane is used as opacity and
+        multiplied with alpha_2)
     alpha_2 : alpha value(s), either float, ndarray, or None
         Blending selection - for a single value, this is the opacity
         of the second image (default = 0.5, i.e. equal mixing); for
-        an array, it must match the size, and be a single plane; if
-        None, each image component is set to the maximum across the
-        two arrays
+        an array (float or uint8, i.e. 0...255), it must match the
+        size, and be a single plane; if None, each image component is
+        set to the maximum across the two arrays
+    out : ndarray
+        Optional output array (uint8, same size as image_1, can be
+        image_1 itself or a view into a larger image)
     
     Returns
     -------
@@ -1512,125 +1638,70 @@ def image_mix(
         Mixed image
     """
     # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
-    from .jitfunc import image_mix as image_mix_jit
+    from .jitfunc import image_blend
 
-    # get original shapes and perform necessary checks and reshaping
+    # get 3D (height, width, planes) views of the images
     im1shape = image_1.shape
-    im1reshape = True
-    im2shape = image_2.shape
-    im2reshape = True
-    if image_1.shape[0] != image_2.shape[0]:
+    try:
+        image_1 = _image_hwc(image_1)
+        image_2 = _image_hwc(image_2)
+    except:
         raise ValueError('Invalid input images.')
-    if not alpha_2 is None and isinstance(alpha_2, numpy.ndarray):
-        a2shape = alpha_2.shape
-        if not alpha_2.dtype is numpy.float32:
+    im1hw = image_1.shape[0:2]
+    im1pix = im1hw[0] * im1hw[1]
+    if image_2.shape[0:2] != im1hw:
+        if image_2.shape[0] * image_2.shape[1] != im1pix:
+            raise ValueError('Invalid input images.')
+        image_2 = image_2.reshape((im1hw[0], im1hw[1], image_2.shape[2],))
+    if image_1.dtype != numpy.uint8 or image_2.dtype != numpy.uint8:
+        raise ValueError('Invalid input images.')
+
+    # alpha (no value: max, 1x1: single value, or HxW)
+    a2scale = 1.0
+    if alpha_2 is None:
+        alpha_2 = numpy.zeros(0, dtype=numpy.float32).reshape((0,0,))
+    elif isinstance(alpha_2, float) or isinstance(alpha_2, int):
+        alpha_2 = numpy.float32(alpha_2) * numpy.ones(1,
+            dtype=numpy.float32).reshape((1,1,))
+    elif isinstance(alpha_2, numpy.ndarray):
+        if not alpha_2.dtype in [numpy.float32, numpy.float64, numpy.uint8]:
             alpha_2 = alpha_2.astype(numpy.float32)
-    im1pix = im1shape[0]
-    im1planes = 1
-    if len(im1shape) > 1:
-        if im1shape[1] == 3 and len(im1shape) == 2:
-            im1planes = 3
-        else:
-            im1pix *= im1shape[1]
-            if len(im1shape) > 2:
-                im1planes = im1shape[2]
-    if not im1planes in [1, 3]:
-        if im1planes > 3:
-            if len(im1shape) == 3:
-                image_1 = image_1[:,:,0:3]
-            else:
-                image_1 = image_1[:,0:3]
-            im1planes = 3
-            im1reshape = False
-        else:
-            raise ValueError('Invalid input image_1.')
-    im2pix = im2shape[0]
-    im2planes = 1
-    if len(im2shape) > 1:
-        if im2shape[1] == 3 and len(im2shape) == 2:
-            im2planes = 3
+        if alpha_2.dtype == numpy.uint8:
+            a2scale = 1.0 / 255.0
+        if alpha_2.size == 1:
+            alpha_2 = alpha_2.reshape((1,1,))
+        elif alpha_2.size == im1pix:
+            alpha_2 = alpha_2.reshape(im1hw)
         else:
-            im2pix *= im2shape[1]
-            if len(im2shape) > 2:
-                im2planes = im2shape[2]
-    if not im2planes in [1, 3]:
-        if im2planes > 3:
-            if len(im2shape) == 3:
-                image_2 = image_2[:,:,0:3]
-            else:
-                image_2 = image_2[:,0:3]
-            im2planes = 3
-            im2reshape = False
+            raise ValueError('Invalid Alpha size.')
+    else:
+        raise ValueError('Invalid alpha_2 parameter.')
+
+    # output
+    if out is None:
+        if image_1.shape[2] < 3:
+            out_planes = 1
         else:
-            raise ValueError('Invalid input image_1.')
-        raise ValueError('Invalid input image_2.')
-    if im1pix != im2pix:
-        raise ValueError('Invalid input images.')
-    if isinstance(alpha_2, numpy.ndarray) and alpha_2.size not in [1, im1pix]:
-        raise ValueError('Invalid Alpha size.')
-    try:
-        image_1.shape = (im1pix, im1planes)
-    except:
-        try:
-            image_1 = image_1.reshape((im1pix, im1planes))
-        except:
-            raise ValueError('Unabled to format image_1.')
-    try:
-        image_2.shape = (im1pix, im2planes)
-    except:
+            out_planes = 3
+        immix = numpy.zeros(im1pix * out_planes, dtype=numpy.uint8).reshape(
+            (im1hw[0], im1hw[1], out_planes,))
+    else:
+        if not isinstance(out, numpy.ndarray) or out.dtype != numpy.uint8:
+            raise ValueError('Invalid out parameter.')
         try:
-            image_2 = image_2.reshape((im1pix, im2planes))
+            immix = _image_hwc(out)
         except:
-            if im1reshape:
-                image_1.shape = im1shape
-            raise ValueError('Unabled to format image_2.')
-    if not alpha_2 is None:
-        if isinstance(alpha_2, float):
-            alpha_2 = numpy.float32(alpha_2) * numpy.ones(im1pix,
-                dtype=numpy.float32)
-            a2shape = alpha_2.shape
-        else:
-            if alpha_2.size == 1:
-                alpha_2 = alpha_2 * numpy.ones(im1pix, dtype=numpy.float32)
-                a2shape = alpha_2.shape
-            else:
-                try:
-                    alpha_2.shape = (im1pix)
-                except:
-                    try:
-                        alpha_2 = alpha_2.reshape(im1pix)
-                    except:
-                        if im1reshape:
-                            image_1.shape = im1shape
-                        if im2reshape:
-                            image_2.shape = im2shape
-                        raise ValueError('Unable to format alpha_2.')
-    
-    # attempt to use JIT function
-    try:
-        immix = image_mix_jit(image_1, image_2, alpha_2)
-    
-    # and return original inputs to their previous state in any case!
-    except:
-        if im1reshape:
-            image_1.shape = im1shape
-        if im2reshape:
-            image_2.shape = im2shape
-        if isinstance(alpha_2, numpy.ndarray):
-            alpha_2.shape = a2shape
-        raise
-    if im1reshape:
-        image_1.shape = im1shape
-    if im2reshape:
-        image_2.shape = im2shape
-    if not alpha_2 is None:
-        alpha_2.shape = a2shape
-    if im1shape[-1] in [1, 3]:
-        immix.shape = im1shape
-    else:
-        if len(im1shape) == 3:
-            immix.shape = (im1shape[0], im1shape[1], immix.shape[-1])
-    return immix
+            raise ValueError('Invalid out parameter.')
+        if immix.shape[0:2] != im1hw or not immix.shape[2] in [1, 3, 4]:
+            raise ValueError('Invalid out parameter.')
+    image_blend(image_1, image_2, alpha_2, numpy.float32(a2scale), immix)
+    if not out is None:
+        return out
+    if len(im1shape) == 3:
+        return immix
+    elif len(im1shape) == 2 and immix.shape[2] == 1:
+        return immix.reshape(im1shape)
+    return immix.reshape((im1pix, immix.shape[2],))
 
 # overlay image
 def image_overlay(
@@ -1689,23 +1760,15 @@ def image_overlay(
         elif alpha == 0:
             return im.copy()
         if alpha < 0.0:
-            alpha_map = heatmap.copy()
-            alpha_map[alpha_map < min_thresh] = min_thresh
-            alpha_map -= min_thresh
-            alpha_map /= (max_thresh - min_thresh)
-            alpha_map[alpha_map > 1.0] = 1.0
-            alpha = -alpha * alpha_map
-            alpha[alpha > 1.0] = 1.0
+            alpha_map = numpy.minimum(1.0, numpy.maximum(0.0,
+                heatmap - min_thresh) / (max_thresh - min_thresh))
+            alpha = numpy.minimum(1.0, -alpha * alpha_map)
         else:
-            alpha_map = heatmap >= min_thresh
-            alpha_map = alpha_map.astype(numpy.float32)
-            alpha = alpha * alpha_map
+            alpha = alpha * (heatmap >= min_thresh).astype(numpy.float32)
         if alpha.shape[0] != imsh[0] or alpha.shape[1] != imsh[1]:
             alpha = s.sample_grid(alpha,list(imsh[0:2]), 'linear')
-    if alpha_max < 1.0 and isinstance(alpha, numpy.ndarray):
-        alpha[alpha > alpha_max] = alpha_max
-    heatmap = heatmap - min_thresh
-    heatmap /= (max_thresh - min_thresh)
+    if alpha_max < 1.0:
+        alpha = numpy.minimum(alpha, alpha_max)
     if hplsh[0] < 40:
         lsfac = (hplsh[0] - 1) / 255.0
         heatposlut = s.sample_grid(heatposlut,
@@ -1713,9 +1776,11 @@ def image_overlay(
     if hnlsh[0] < 40:
         lsfac = (hnlsh[0] - 1) / 255.0
         heatneglut = s.sample_grid(heatneglut,
-            [numpy.arange(0.0,float(hplsh[0])-1.0+0.5*lsfac,lsfac),3], 'linear')
-    heatrgb = lut_lookup(heatmap.flatten(), heatposlut, heatneglut).reshape(
-        (hmsh[0],hmsh[1],3))
+            [numpy.arange(0.0,float(hnlsh[0])-1.0+0.5*lsfac,lsfac),3], 'linear')
+
+    # colors (compiled lookup, see lut_map)
+    heatrgb = lut_lookup((heatmap - min_thresh) / (max_thresh - min_thresh),
+        heatposlut, heatneglut).reshape((hmsh[0],hmsh[1],3))
     if hmsh[0] != imsh[0] or hmsh[1] != imsh[1]:
         heatrgb = s.sample_grid(heatrgb, list(imsh[0:2]), 'linear').astype(numpy.uint8)
     return image_mix(im, heatrgb, alpha)
@@ -2161,6 +2226,350 @@ def image_read_border(
         out = out.decode('utf-8')
     return out
 
+# image registration: reference image (pyramid, sampling points, Jacobian)
+def _register_reference(
+    i1:numpy.ndarray,
+    imask:numpy.ndarray,
+    mode:str,
+    origin:numpy.ndarray,
+    pars:list,
+    maxpts:int,
+    smooth:list,
+    levels:int,
+    ) -> dict:
+    """
+    Precompute reference image data for image_register
+
+    Parameters
+    ----------
+    i1 : ndarray
+        Reference (fixed) image
+    imask : ndarray
+        Reference image mask (or None)
+    mode : str
+        Conversion of RGB images into gray-scale (see image_gray)
+    origin : ndarray
+        Origin of transformation (None: image center)
+    pars : list
+        List of (name, index, neutral value) tuples of estimated parameters
+    maxpts : int
+        Maximum number of sampling points (per pyramid level)
+    smooth : list
+        Smoothing (FWHM) applied to the images prior to registration
+    levels : int
+        Number of (Gaussian) pyramid levels
+    
+    Returns
+    -------
+    reference : dict
+        Precomputed data (per level sampling points, values, Jacobian)
+    """
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    from . import sampler
+
+    if not isinstance(i1, numpy.ndarray) or i1.ndim < 2 or i1.ndim > 3:
+        raise ValueError('Invalid reference image.')
+    ishape = i1.shape
+    if not imask is None:
+        if not isinstance(imask, numpy.ndarray):
+            raise ValueError('Invalid imask parameter.')
+        elif imask.ndim != 2:
+            raise ValueError('Invalid imask.ndim value.')
+        elif imask.shape[0] != ishape[0] or imask.shape[1] != ishape[1]:
+            raise ValueError('Invalid imask.shape.')
+        imask = (imask > 0)
+    if len(pars) == 0:
+        raise ValueError('No parameters to estimate.')
+    if not isinstance(levels, int) or levels < 1:
+        levels = 1
+    if not mode in ['average', 'desaturate', 'luma']:
+        mode = 'luma'
+    if i1.ndim > 2:
+        i1 = image_gray(i1, rgb_format=False, conv_type=mode)
+    if isinstance(smooth, list) and len(smooth) > 0:
+        try:
+            i1 = image_smooth_fft(i1, smooth[0])
+        except:
+            raise
+    i1 = i1.astype(numpy.float64)
+    if origin is None:
+        origin = 0.5 * numpy.asarray(ishape[0:2], numpy.float64)
+    origin = numpy.asarray(origin, numpy.float64)
+
+    # Gaussian pyramid (index 0 = full resolution)
+    pyramid = [(i1, imask)]
+    while len(pyramid) < levels and min(pyramid[-1][0].shape) >= 64:
+        (p1, pm) = pyramid[-1]
+        p1 = image_smooth_fft(p1, 2.0)[::2,::2]
+        if not pm is None:
+            pm = pm[::2,::2]
+        pyramid.append((p1, pm))
+
+    # sampling points, values, gradients, and Jacobian for each level
+    eye = numpy.eye(3, dtype=numpy.float64)
+    npar = len(pars)
+    rlevels = []
+    for (level, (p1, pm)) in enumerate(pyramid):
+        pshape = p1.shape
+        lf = float(2 ** level)
+        lo = origin / lf
+        lmoi = sampler.trans_matrix({'trans': lo})
+        lmo = sampler.trans_matrix({'trans': -lo}) #pylint: disable=invalid-unary-operand-type
+        sf = max(1, int(numpy.ceil(numpy.sqrt(
+            float(pshape[0] * pshape[1]) / float(maxpts)))))
+        if pm is None:
+            pm = (p1 >= 0.5)
+        smask = pm[::sf,::sf]
+        (c1, c0) = numpy.meshgrid(
+            numpy.arange(0, pshape[1], sf), numpy.arange(0, pshape[0], sf))
+        c0 = c0[smask]
+        c1 = c1[smask]
+        if c0.size < 32:
+            raise RuntimeError('Too few sampling points!')
+        ref = p1[c0, c1]
+        (g0, g1) = numpy.gradient(p1)
+        g0 = g0[c0, c1]
+        g1 = g1[c0, c1]
+        c0 = c0.astype(numpy.float64)
+        c1 = c1.astype(numpy.float64)
+        jac = numpy.zeros((c0.size, npar), dtype=numpy.float64)
+        for (pc, (pname, pidx, pval)) in enumerate(pars):
+            dm = {
+                'trans': numpy.zeros(2, numpy.float64),
+                'rotate': numpy.zeros(1, numpy.float64),
+                'scale': numpy.ones(1, numpy.float64),
+                'shear': numpy.zeros(1, numpy.float64),
+            }
+            dm[pname][pidx] = pval + 1.0e-6
+            dw = 1.0e6 * (numpy.matmul(lmoi, numpy.matmul(
+                numpy.linalg.inv(sampler.trans_matrix(dm)), lmo)) - eye)
+            jac[:,pc] = -(g0 * (dw[0,0] * c0 + dw[0,1] * c1 + dw[0,2]) +
+                g1 * (dw[1,0] * c0 + dw[1,1] * c1 + dw[1,2]))
+        rlevels.append({
+            'c0': c0,
+            'c1': c1,
+            'jac': jac,
+            'lmo': lmo,
+            'lmoi': lmoi,
+            'ref': ref,
+            'shape': pshape,
+        })
+    return {
+        'levels': rlevels,
+        'mode': mode,
+        'origin': origin,
+        'pars': pars,
+        'shape': ishape,
+        'smooth': smooth,
+    }
+
+# image registration: moving image (coarse-to-fine Gauss-Newton)
+def _register_moving(
+    reference:dict,
+    i2:numpy.ndarray,
+    imethod:str,
+    maxiter:int,
+    min_delta:float,
+    init_m:dict,
+    ) -> Tuple[numpy.ndarray, float, int]:
+    """
+    Register a moving image to precomputed reference data
+
+    Parameters
+    ----------
+    reference : dict
+        Output of _register_reference
+    i2 : ndarray
+        Moving image
+    imethod : str
+        Interpolation method (kernel) for moving image
+    maxiter : int
+        Maximum number of iterations (per pyramid level)
+    min_delta : float
+        Early exit threshold (maximum corner displacement in pixels)
+    init_m : dict
+        Initial transformation parameters (or None)
+    
+    Returns
+    -------
+    tm : ndarray
+        3-by-3 transformation matrix (reference to moving image)
+    residual : float
+        Mean squared residual (at full resolution)
+    iterations : int
+        Total number of iterations (across all levels)
+    """
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    from . import sampler
+    from .jitfunc import image_register_products
+    s = sampler.Sampler()
+
+    if not imethod in s._kernels:
+        raise ValueError('Invalid interpolation method (kernel function).')
+    sk = s._kernels[imethod]
+    if not isinstance(i2, numpy.ndarray) or i2.ndim < 2 or i2.ndim > 3:
+        raise ValueError('Invalid moving image.')
+    ishape = reference['shape']
+    if ishape[0] != i2.shape[0] or ishape[1] != i2.shape[1]:
+        raise ValueError('Dimension mismatch.')
+    if not isinstance(min_delta, float) or min_delta < 0.0:
+        min_delta = 0.0
+    if i2.ndim > 2:
+        i2 = image_gray(i2, rgb_format=False, conv_type=reference['mode'])
+    smooth = reference['smooth']
+    if isinstance(smooth, list) and len(smooth) > 0:
+        try:
+            i2 = image_smooth_fft(i2, smooth[0])
+        except:
+            raise
+    i2 = i2.astype(numpy.float64)
+    rlevels = reference['levels']
+    pyramid = [i2]
+    while len(pyramid) < len(rlevels):
+        pyramid.append(image_smooth_fft(pyramid[-1], 2.0)[::2,::2])
+
+    # initial transformation
+    if not isinstance(init_m, dict):
+        init_m = dict()
+    m = {
+        'trans': numpy.asarray(init_m.get('trans',
+            numpy.zeros(2, numpy.float64)), numpy.float64),
+        'rotate': numpy.asarray(init_m.get('rotate',
+            numpy.zeros(1, numpy.float64)), numpy.float64),
+        'scale': numpy.asarray(init_m.get('scale',
+            numpy.ones(1, numpy.float64)), numpy.float64),
+        'shear': numpy.asarray(init_m.get('shear',
+            numpy.zeros(1, numpy.float64)), numpy.float64),
+    }
+    origin = reference['origin']
+    try:
+        moi = sampler.trans_matrix({'trans': origin})
+        mo = sampler.trans_matrix({'trans': -origin}) #pylint: disable=invalid-unary-operand-type
+        tm = numpy.matmul(moi, numpy.matmul(sampler.trans_matrix(m), mo))
+    except:
+        raise
+    pars = reference['pars']
+    npar = len(pars)
+    po = npar * npar + 2 * npar
+
+    # coarse-to-fine
+    best_ss = numpy.inf
+    iterations = 0
+    for level in range(len(rlevels)-1, -1, -1):
+        rl = rlevels[level]
+        p2 = pyramid[level]
+        pshape = rl['shape']
+        c0 = rl['c0']
+        lf = float(2 ** level)
+        ls = numpy.diag([1.0 / lf, 1.0 / lf, 1.0])
+        lsi = numpy.diag([lf, lf, 1.0])
+        t = numpy.matmul(ls, numpy.matmul(tm, lsi))
+        p2m = (p2 >= 0.5).astype(numpy.uint8)
+        nchunks = max(1, min(256, c0.size // 2048))
+        corners = numpy.asarray([[0.0, 0.0, float(pshape[0]-1), float(pshape[0]-1)],
+            [0.0, float(pshape[1]-1), 0.0, float(pshape[1]-1)],
+            [1.0, 1.0, 1.0, 1.0]], numpy.float64)
+
+        # Gauss-Newton iterations
+        best_t = t
+        best_ss = numpy.inf
+        pss = numpy.inf
+        stable = 0
+        for _ in range(maxiter):
+            iterations += 1
+            prods = image_register_products(p2, p2m, c0, rl['c1'], rl['ref'],
+                rl['jac'], t, sk[0], sk[1], nchunks)
+            if prods[po] < 32.0:
+                raise RuntimeError('Too little image overlap!')
+            sc = prods[po+1] / prods[po+2]
+            ss = (prods[po+3] - 2.0 * sc * prods[po+4] +
+                sc * sc * prods[po+5]) / prods[po]
+            if ss < best_ss:
+                best_ss = ss
+                best_t = t
+            jtj = prods[0:npar*npar].reshape((npar, npar))
+            jtr = prods[npar*npar:npar*npar+npar] - sc * prods[
+                npar*npar+npar:npar*npar+2*npar]
+            sol = numpy.linalg.lstsq(jtj, jtr, rcond=None)[0]
+            dm = {
+                'trans': numpy.zeros(2, numpy.float64),
+                'rotate': numpy.zeros(1, numpy.float64),
+                'scale': numpy.ones(1, numpy.float64),
+                'shear': numpy.zeros(1, numpy.float64),
+            }
+            for (pc, (pname, pidx, pval)) in enumerate(pars):
+                dm[pname][pidx] = pval + sol[pc]
+            dw = numpy.matmul(rl['lmoi'], numpy.matmul(
+                sampler.trans_matrix(dm), rl['lmo']))
+            t = numpy.matmul(t, dw)
+            if numpy.amax(numpy.abs(numpy.matmul(dw, corners) - corners)) < min_delta:
+                best_t = t
+                break
+            if not numpy.isinf(pss) and ((pss - ss) / pss) < 1.0e-6:
+                stable += 1
+                if stable > 2:
+                    break
+            else:
+                stable = 0
+            pss = ss
+        tm = numpy.matmul(lsi, numpy.matmul(best_t, ls))
+    return (tm, best_ss, iterations)
+
+# image registration: transformation matrix into parameters
+def _register_params(
+    reference:dict,
+    tm:numpy.ndarray,
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Decompose a registration transformation matrix into parameters
+
+    Parameters
+    ----------
+    reference : dict
+        Reference data (see _register_reference, origin and pars used)
+    tm : ndarray
+        Transformation matrix (as returned by _register_moving)
+    
+    Returns
+    -------
+    trans, rotate, scale, shear : ndarray
+        Parameters (relative to the origin), with parameters that were
+        not estimated set to their neutral values
+    """
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    from . import sampler
+
+    origin = reference['origin']
+    moi = sampler.trans_matrix({'trans': origin})
+    mo = sampler.trans_matrix({'trans': -origin}) #pylint: disable=invalid-unary-operand-type
+    ti = list(sampler.trans_matrix_inv(numpy.matmul(mo, numpy.matmul(tm, moi))))
+    pnames = [p[0] for p in reference['pars']]
+    if not 'trans' in pnames:
+        ti[0] = numpy.zeros(2, numpy.float64)
+    if not 'rotate' in pnames:
+        ti[1] = numpy.zeros(1, numpy.float64)
+    if not 'scale' in pnames:
+        ti[2] = numpy.ones(2, numpy.float64)
+    if not 'shear' in pnames:
+        ti[3] = numpy.zeros(1, numpy.float64)
+    return tuple(ti)
+
+# image registration: list of estimated parameters
+def _register_pars(trans:bool, rotate:bool, scale:bool, shear:bool) -> list:
+    pars = []
+    if trans:
+        pars.extend([('trans', 0, 0.0), ('trans', 1, 0.0)])
+    if rotate:
+        pars.append(('rotate', 0, 0.0))
+    if scale:
+        pars.append(('scale', 0, 1.0))
+    if shear:
+        pars.append(('shear', 0, 0.0))
+    return pars
+
 # image registration (experimental!)
 def image_register(
     i1:numpy.ndarray,
@@ -2177,263 +2586,359 @@ def image_register(
     maxiter:int = 100,
     smooth:list = [0.005],
     init_m:dict = None,
+    levels:int = 3,
+    min_delta:float = 0.01,
     ) -> numpy.ndarray:
+    """
+    Perform rigid-body (affine) alignment of two images
 
-    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
-    from . import sampler
-    s = sampler.Sampler()
+    Parameters
+    ----------
+    i1 : ndarray
+        Reference (fixed) image
+    i2 : ndarray
+        Moving image (must match i1 in first two dimensions)
+    imask : ndarray
+        Optional mask for reference image (default: i1 >= 0.5)
+    mode : str
+        Conversion of RGB images into gray-scale (see image_gray)
+    origin : ndarray
+        Origin of transformation (default: image center)
+    trans, rotate, scale, shear : bool
+        Flags, which parameters to estimate (default: trans, rotate)
+    imethod : str
+        Interpolation method (kernel) for moving image, default 'linear'
+    maxpts : int
+        Maximum number of sampling points (per pyramid level)
+    maxiter : int
+        Maximum number of iterations (per pyramid level)
+    smooth : list
+        Smoothing (FWHM) applied to the images prior to registration
+    init_m : dict
+        Initial transformation parameters (trans, rotate, scale, shear)
+    levels : int
+        Number of (Gaussian) pyramid levels, coarse-to-fine (default: 3)
+    min_delta : float
+        Early exit if the parameter update moves no image corner by more
+        than this many pixels (at the current level), default 0.01
     
-    if not imethod in s._kernels:
-        raise ValueError('Invalid interpolation method (kernel function).')
-    sk = s._kernels[imethod]
-    zsk = s._kernels['lanczos3']
+    Returns
+    -------
+    trans, rotate, scale, shear : ndarray
+        Estimated transformation parameters
+    """
     if not isinstance(i1, numpy.ndarray) or not isinstance(i2, numpy.ndarray):
         raise ValueError('Invalid types.')
     if i1.ndim < 2 or i1.ndim > 3 or i2.ndim < 2 or i2.ndim > 3:
         raise ValueError('Invalid dimensions.')
-    ishape = i1.shape
-    if ishape[0] != i2.shape[0] or ishape[1] != i2.shape[1]:
+    if i1.shape[0] != i2.shape[0] or i1.shape[1] != i2.shape[1]:
         raise ValueError('Dimension mismatch.')
-    if not imask is None:
-        if not isinstance(imask, numpy.ndarray):
-            raise ValueError('Invalid imask parameter.')
-        elif imask.ndim != 2:
-            raise ValueError('Invalid imask.ndim value.')
-        elif imask.shape[0] != ishape[0] or imask.shape[1] != ishape[1]:
-            raise ValueError('Invalid imask.shape.')
-        if imask.dtype != numpy.bool:
-            imask = (imask > 0).astype(numpy.uint8)
+    if origin is None and isinstance(init_m, dict) and 'origin' in init_m:
+        origin = init_m['origin']
+    try:
+        reference = _register_reference(i1, imask, mode, origin,
+            _register_pars(trans, rotate, scale, shear), maxpts, smooth, levels)
+        (tm, _, _) = _register_moving(reference, i2, imethod, maxiter,
+            min_delta, init_m)
+    except:
+        raise
+    return _register_params(reference, tm)
+
+# image registration (many images): worker process
+_register_many_min_images = 4
+_register_many_state = dict()
+def _register_many_init(reference:dict, options:dict):
+    _register_many_state['reference'] = reference
+    _register_many_state['options'] = options
+def _register_many_one(image_idx:int, image:Union[str, numpy.ndarray]) -> dict:
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import os
+    from .sampler import Sampler
+
+    reference = _register_many_state['reference']
+    options = _register_many_state['options']
+    if isinstance(image, str):
+        image_name = image
+        image = read_image(image)
+    else:
+        image_name = str(image_idx)
+    result = {
+        'image': image_name,
+        'trans0': numpy.nan,
+        'trans1': numpy.nan,
+        'rotate': numpy.nan,
+        'scale0': numpy.nan,
+        'scale1': numpy.nan,
+        'shear': numpy.nan,
+        'residual': numpy.nan,
+        'iterations': 0,
+        'filename': '',
+    }
+    try:
+        (tm, residual, iterations) = _register_moving(reference, image,
+            options['imethod'], options['maxiter'], options['min_delta'],
+            options['init_m'])
+    except Exception as e:
+        warnings.warn('Error registering image {0:s}: {1:s}'.format(
+            image_name, str(e)))
+        return result
+    (trans, rotate, scale, shear) = _register_params(reference, tm)
+    result['trans0'] = float(trans[0])
+    result['trans1'] = float(trans[1])
+    result['rotate'] = float(rotate[0])
+    result['scale0'] = float(scale[0])
+    result['scale1'] = float(scale[1])
+    result['shear'] = float(shear[0])
+    result['residual'] = float(residual)
+    result['iterations'] = iterations
+    out_folder = options['out_folder']
+    if out_folder:
+        ishape = reference['shape']
+        grid = [numpy.arange(0.0, float(ishape[0]), 1.0),
+            numpy.arange(0.0, float(ishape[1]), 1.0)]
+        if image.dtype == numpy.uint8:
+            out_type = 'uint8'
         else:
-            imask = imask.astype(numpy.uint8)
-    i1o = i1
-    i2o = i2
-    if isinstance(smooth, list) and len(smooth) > 0:
+            out_type = 'float32'
+        rs_image = Sampler().sample_grid(image, grid, options['imethod'],
+            out_type, m=tm)
+        if image_name == str(image_idx):
+            out_name = 'image_{0:05d}'.format(image_idx)
+        else:
+            out_name = os.path.splitext(os.path.basename(image_name))[0]
+        out_file = os.path.join(out_folder, out_name)
         try:
-            i1 = image_smooth_fft(i1o, smooth[0])
-            i2 = image_smooth_fft(i2o, smooth[0])
-        except:
-            raise
-    if isinstance(init_m, dict):
-        if origin is None:
-            if 'origin' in init_m:
-                origin = init_m['origin']
+            if out_type == 'uint8':
+                out_file += options['out_ext']
+                write_image(rs_image, out_file)
             else:
-                origin = 0.5 * numpy.asarray(ishape, numpy.float64)
-        if 'trans' in init_m:
-            transp = init_m['trans']
-        else:
-            transp = numpy.zeros(2, numpy.float64)
-        if 'rotate' in init_m:
-            rotatep = init_m['rotate']
-        else:
-            rotatep = numpy.zeros(1, numpy.float64)
-        if 'scale' in init_m:
-            scalep = init_m['scale']
-        else:
-            scalep = numpy.ones(1, numpy.float64)
-        if 'shear' in init_m:
-            shearp = init_m['shear']
-        else:
-            shearp = numpy.zeros(1, numpy.float64)
-    else:
-        if origin is None:
-            origin = 0.5 * numpy.asarray(ishape, numpy.float64)
-        transp = numpy.zeros(2, numpy.float64)
-        rotatep = numpy.zeros(1, numpy.float64)
-        scalep = numpy.ones(1, numpy.float64)
-        shearp = numpy.zeros(1, numpy.float64)
-    m = {
-        'trans': transp,
-        'rotate': rotatep,
-        'scale': scalep,
-        'shear': shearp,
-    }
+                out_file += '.npy'
+                numpy.save(out_file, rs_image)
+            result['filename'] = out_file
+        except Exception as e:
+            warnings.warn('Error writing image {0:s}: {1:s}'.format(
+                out_file, str(e)))
+    return result
+
+# image registration (many images to one template)
+def image_register_many(
+    template:numpy.ndarray,
+    images:list,
+    imask:numpy.ndarray = None,
+    mode:str = 'luma',
+    origin:numpy.ndarray = None,
+    trans:bool = True,
+    rotate:bool = True,
+    scale:bool = False,
+    shear:bool = False,
+    imethod:str = 'linear',
+    maxpts:int = 250000,
+    maxiter:int = 100,
+    smooth:list = [0.005],
+    init_m:dict = None,
+    levels:int = 3,
+    min_delta:float = 0.01,
+    workers:int = 0,
+    out_folder:str = None,
+    out_ext:str = '.png',
+    verbose:bool = False,
+    ) -> dict:
+    """
+    Register many (moving) images to one template (reference) image
+
+    Parameters
+    ----------
+    template : ndarray
+        Template (reference, fixed) image
+    images : list
+        List of moving images (ndarray or image filenames)
+    imask ... min_delta
+        See image_register (template data is computed only once)
+    workers : int
+        Number of worker processes (default: 0, number of CPUs; 1 runs
+        all registrations in the current process); each worker receives
+        at least 4 images (smaller batches run in the current process);
+        worker processes are started with the 'spawn' method (forking a
+        process after the parallel compiled functions were loaded is not
+        safe), so scripts must guard their main code with
+        if __name__ == '__main__':
+    out_folder : str
+        If given, write resampled (aligned) images into this folder
+    out_ext : str
+        Image file extension for uint8 images (default: '.png'),
+        other images are stored as .npy files
+    verbose : bool
+        If True, print progress
+    
+    Returns
+    -------
+    table : dict
+        Dict of lists with fields image, trans0, trans1, rotate, scale0,
+        scale1, shear, residual, iterations, and filename (one entry
+        per image, NaN values for failed registrations)
+    """
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import os
+    from .func import print_progress
+
+    if not isinstance(template, numpy.ndarray):
+        raise ValueError('Invalid template.')
+    if not isinstance(images, list):
+        images = [images]
+    if out_folder and not os.path.isdir(out_folder):
+        raise ValueError('Invalid out_folder parameter.')
+    if not isinstance(out_ext, str) or out_ext == '':
+        out_ext = '.png'
+    elif out_ext[0] != '.':
+        out_ext = '.' + out_ext
+    if not isinstance(workers, int) or workers < 1:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(1, len(images) // _register_many_min_images))
+    if origin is None and isinstance(init_m, dict) and 'origin' in init_m:
+        origin = init_m['origin']
     try:
-        moi = sampler.trans_matrix({'trans': origin})
-        mo = sampler.trans_matrix({'trans': -origin}) #pylint: disable=invalid-unary-operand-type
-        t = numpy.linalg.inv(sampler.trans_matrix(m))
+        reference = _register_reference(template, imask, mode, origin,
+            _register_pars(trans, rotate, scale, shear), maxpts, smooth, levels)
     except:
         raise
-    s0 = numpy.arange(0.0, float(ishape[0]), 1.0).astype(numpy.float64)
-    s1 = numpy.arange(0.0, float(ishape[1]), 1.0).astype(numpy.float64)
-    (c1, c0) = numpy.meshgrid(s1, s0)
-    c0.shape = (c0.size,1,)
-    c1.shape = (c1.size,1,)
-    c01 = numpy.concatenate((c0,c1), axis=1)
-    step = (1.0 / 512.0)
-    dg0 = sampler._sample_grid_coords(
-        i1, c01 + step * numpy.asarray([1.0,1.0]), zsk[0], zsk[1])
-    dg1 = dg0.copy()
-    cxy = sampler._sample_grid_coords(
-        i1, c01 + step * numpy.asarray([1.0,-1.0]), zsk[0], zsk[1])
-    dg0 += cxy
-    dg1 -= cxy
-    cxy = sampler._sample_grid_coords(
-        i1, c01 + step * numpy.asarray([-1.0,1.0]), zsk[0], zsk[1])
-    dg0 -= cxy
-    dg1 += cxy
-    cxy = sampler._sample_grid_coords(
-        i1, c01 + step * numpy.asarray([-1.0,-1.0]), zsk[0], zsk[1])
-    dg0 -= cxy
-    dg1 -= cxy
-    dg0 *= 128.0
-    dg1 *= 128.0
-    sf = max([1.0, numpy.sqrt(float(ishape[0] * ishape[1]) / float(maxpts))])
-    s0 = numpy.arange(-0.25, float(ishape[0]), sf).astype(numpy.float64)
-    s1 = numpy.arange(-0.25, float(ishape[1]), sf).astype(numpy.float64)
-    (c1, c0) = numpy.meshgrid(s1, s0)
-    c0.shape = (c0.size,1,)
-    c1.shape = (c1.size,1,)
-    dg0.shape = ishape
-    dg1.shape = ishape
-    lsk = s._kernels['linear']
-    c01 = numpy.concatenate((c0,c1), axis=1)
-    if not imask is None:
-        cmask = sampler._sample_grid_coords(imask.astype(numpy.uint8),
-            c01, lsk[0], lsk[1]) >= 0.5
-        c0 = c0[cmask]
-        c1 = c1[cmask]
+    options = {
+        'imethod': imethod,
+        'init_m': init_m,
+        'maxiter': maxiter,
+        'min_delta': min_delta,
+        'out_ext': out_ext,
+        'out_folder': out_folder,
+    }
+    fields = ['image', 'trans0', 'trans1', 'rotate', 'scale0', 'scale1',
+        'shear', 'residual', 'iterations', 'filename']
+    table = {f: [None] * len(images) for f in fields}
+    num_images = len(images)
+    def store_result(image_idx:int, result:dict):
+        for f in fields:
+            table[f][image_idx] = result[f]
+    if workers == 1:
+        _register_many_init(reference, options)
+        for (image_idx, image) in enumerate(images):
+            store_result(image_idx, _register_many_one(image_idx, image))
+            if verbose:
+                print_progress(image_idx + 1, num_images, 'Registering:')
+        return table
+
+    # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import multiprocessing
+
+    with ProcessPoolExecutor(max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_register_many_init,
+        initargs=(reference, options)) as executor:
+        futures = {executor.submit(_register_many_one, image_idx, image):
+            image_idx for (image_idx, image) in enumerate(images)}
+        for (done_count, future) in enumerate(as_completed(futures)):
+            store_result(futures[future], future.result())
+            if verbose:
+                print_progress(done_count + 1, num_images, 'Registering:')
+    return table
+
+# resampling weights (per axis, cached)
+_resample_weights_cache = dict()
+_resample_weights_cache_max = 64
+def _resample_weights(
+    src_size:int,
+    dst_size:int,
+    kernel:str = 'box',
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Compute (and cache) separable resampling weights for one axis
+
+    Parameters
+    ----------
+    src_size : int
+        Number of source samples along the axis
+    dst_size : int
+        Number of target samples along the axis
+    kernel : str
+        Kernel, one of 'box', 'linear', or 'lanczos2' ... 'lanczos9'
+    
+    Returns
+    -------
+    idx : ndarray
+        dst_size-by-K array of source indices (int32)
+    wgt : ndarray
+        dst_size-by-K array of normalized weights (float32)
+    """
+    key = (src_size, dst_size, kernel)
+    if key in _resample_weights_cache:
+        return _resample_weights_cache[key]
+    scale = float(src_size) / float(dst_size)
+    kscale = max(1.0, scale)
+    if kernel == 'box':
+        radius = 0.5
+    elif kernel == 'linear':
+        radius = 1.0
+    elif len(kernel) == 8 and kernel[0:7] == 'lanczos' and kernel[7] in '23456789':
+        radius = float(kernel[7])
     else:
-        cmask = sampler._sample_grid_coords((i1 >= 0.5).astype(numpy.uint8),
-            c01, lsk[0], lsk[1]) >= 0.5
-        c0 = c0[cmask]
-        c1 = c1[cmask]
-    c01 = numpy.concatenate((c0,c1), axis=1)
-    d = sampler._sample_grid_coords(i1, c01, sk[0], sk[1])
-    dg0 = sampler._sample_grid_coords(dg0, c01, sk[0], sk[1])
-    dg1 = sampler._sample_grid_coords(dg1, c01, sk[0], sk[1])
-    dg0.shape = (dg0.size,1,)
-    dg1.shape = (dg1.size,1,)
-    dg01 = numpy.concatenate((dg0, dg1), axis=1)
-    nc = 0
-    if trans:
-        nc += 2
-    if rotate:
-        nc += 1
-    if scale:
-        nc += 1
-    if shear:
-        nc += 1
-    i1r = numpy.zeros(c0.size * nc, dtype=numpy.float64).reshape((c0.size, nc,))
-    nc = 0
-    if trans:
-        transp[0] = 1.0e-6
-        t = numpy.matmul(moi, numpy.matmul(
-            numpy.linalg.inv(sampler.trans_matrix(m)), mo))
-        tc01 = numpy.concatenate(
-            (t[0,0]*c0+t[0,1]*c1+t[0,2], t[1,0]*c0+t[1,1]*c1+t[1,2]), axis=1)
-        i1r[:,nc] = -1.0e6 * numpy.sum((tc01 - c01) * dg01, axis=1)
-        nc += 1
-        transp[0] = 0.0
-        transp[1] = 1.0e-6
-        t = numpy.matmul(moi, numpy.matmul(
-            numpy.linalg.inv(sampler.trans_matrix(m)), mo))
-        tc01 = numpy.concatenate(
-            (t[0,0]*c0+t[0,1]*c1+t[0,2], t[1,0]*c0+t[1,1]*c1+t[1,2]), axis=1)
-        i1r[:,nc] = -1.0e6 * numpy.sum((tc01 - c01) * dg01, axis=1)
-        nc += 1
-        transp[1] = 0.0
-    if rotate:
-        rotatep[0] = 1.0e-6
-        t = numpy.matmul(moi, numpy.matmul(
-            numpy.linalg.inv(sampler.trans_matrix(m)), mo))
-        tc01 = numpy.concatenate(
-            (t[0,0]*c0+t[0,1]*c1+t[0,2], t[1,0]*c0+t[1,1]*c1+t[1,2]), axis=1)
-        i1r[:,nc] = -1.0e6 * numpy.sum((tc01 - c01) * dg01, axis=1)
-        nc += 1
-        rotatep[0] = 0.0
-    if scale:
-        scalep[0] = 1.000001
-        t = numpy.matmul(moi, numpy.matmul(
-            numpy.linalg.inv(sampler.trans_matrix(m)), mo))
-        tc01 = numpy.concatenate(
-            (t[0,0]*c0+t[0,1]*c1+t[0,2], t[1,0]*c0+t[1,1]*c1+t[1,2]), axis=1)
-        i1r[:,nc] = -1.0e6 * numpy.sum((tc01 - c01) * dg01, axis=1)
-        nc += 1
-        scalep[0] = 1.0
-    if shear:
-        shearp[0] = 1.0e-6
-        t = numpy.matmul(moi, numpy.matmul(
-            numpy.linalg.inv(sampler.trans_matrix(m)), mo))
-        tc01 = numpy.concatenate(
-            (t[0,0]*c0+t[0,1]*c1+t[0,2], t[1,0]*c0+t[1,1]*c1+t[1,2]), axis=1)
-        i1r[:,nc] = -1.0e6 * numpy.sum((tc01 - c01) * dg01, axis=1)
-        nc += 1
-        shearp[0] = 0.0
-    ss = numpy.inf * numpy.ones(maxiter+1, dtype=numpy.float64)
-    pss = ss[0]
-    stable = 0
-    if isinstance(init_m, dict):
-        t = numpy.matmul(numpy.linalg.inv(sampler.trans_matrix(m)), mo)
-        tm = numpy.repeat(t.reshape((t.shape[0], t.shape[1], 1,)),
-            maxiter+1, axis=2)
+        raise ValueError('Invalid resampling kernel.')
+    support = radius * kscale
+    center = (numpy.arange(dst_size, dtype=numpy.float64) + 0.5) * scale - 0.5
+    first = numpy.floor(center - support).astype(numpy.int64) + 1
+    ntaps = int(numpy.ceil(2.0 * support)) + 1
+    idx = first.reshape((dst_size, 1)) + numpy.arange(ntaps).reshape((1, ntaps))
+    dist = (idx.astype(numpy.float64) - center.reshape((dst_size, 1))) / kscale
+    if kernel == 'box':
+
+        # box weights as overlap of source pixel with target footprint
+        wgt = numpy.minimum(dist + 0.5 / kscale, 0.5) - numpy.maximum(
+            dist - 0.5 / kscale, -0.5)
+        wgt = numpy.maximum(wgt, 0.0)
+    elif kernel == 'linear':
+        wgt = numpy.maximum(1.0 - numpy.abs(dist), 0.0)
     else:
-        tm = numpy.repeat(mo.reshape((mo.shape[0], mo.shape[1], 1,)),
-            maxiter+1, axis=2)
-    i2msk = (i2 >= 0.5).astype(numpy.uint8)
-    while maxiter > 0:
-        t = numpy.matmul(numpy.linalg.inv(tm[:,:,maxiter]), mo)
-        tc01 = numpy.concatenate(
-            (t[0,0]*c0+t[0,1]*c1+t[0,2], t[1,0]*c0+t[1,1]*c1+t[1,2]), axis=1)
-        msk = (sampler._sample_grid_coords(i2msk, tc01, lsk[0], lsk[1]) >= 0.5)
-        if numpy.sum(msk) < 32:
-            raise RuntimeError('Too little image overlap!')
-        f = sampler._sample_grid_coords(i2, tc01[msk,:], sk[0], sk[1])
-        cm = i1r[msk,:]
-        dm = d[msk]
-        sc = numpy.sum(dm) / numpy.sum(f)
-        dm = dm - sc * f
-        sol = numpy.linalg.lstsq(
-            numpy.matmul(cm.T, cm), numpy.matmul(cm.T, dm), rcond=None)[0]
-        nc = 0
-        if trans:
-            transp[0] = sol[nc]
-            nc += 1
-            transp[1] = sol[nc]
-            nc += 1
-        if rotate:
-            rotatep[0] = sol[nc]
-            nc += 1
-        if scale:
-            scalep[0] = sol[nc]
-            nc += 1
-        if shear:
-            shearp[0] = sol[nc]
-            nc += 1
-        maxiter -= 1
-        tm[:,:,maxiter] = numpy.matmul(numpy.linalg.inv(sampler.trans_matrix(m)),
-            tm[:,:,maxiter+1])
-        ss[maxiter] = numpy.sum(dm * dm) / float(dm.size)
-        if not numpy.isinf(pss) and ((pss - ss[maxiter]) / pss) < 1.0e-6:
-            stable += 1
-            if stable > 2:
-                break
-        else:
-            stable = 0
-        pss = ss[maxiter]
-    t = numpy.matmul(tm[:,:,numpy.argmin(ss)], moi)
-    ti = list(sampler.trans_matrix_inv(numpy.linalg.inv(t)))
-    if not trans:
-        ti[0] = numpy.zeros(2, numpy.float64)
-    if not rotate:
-        ti[1] = numpy.zeros(1, numpy.float64)
-    if not scale:
-        ti[2] = numpy.ones(2, numpy.float64)
-    if not shear:
-        ti[3] = numpy.zeros(1, numpy.float64)
-    return tuple(ti)
-
-# image resampling (cheap!)
-def image_resample(image:numpy.ndarray, new_shape:tuple) -> numpy.ndarray:
+        wgt = numpy.sinc(dist) * numpy.sinc(dist / radius)
+        wgt[numpy.abs(dist) >= radius] = 0.0
+    idx = numpy.minimum(numpy.maximum(idx, 0), src_size - 1)
+    wsum = numpy.sum(wgt, axis=1)
+    wsum[wsum == 0.0] = 1.0
+    wgt = wgt / wsum.reshape((dst_size, 1))
+
+    # trim trailing all-zero taps
+    nz = numpy.any(wgt != 0.0, axis=0)
+    if numpy.any(nz):
+        ntaps = numpy.where(nz)[0][-1] + 1
+        idx = idx[:, 0:ntaps]
+        wgt = wgt[:, 0:ntaps]
+    idx = numpy.ascontiguousarray(idx.astype(numpy.int32))
+    wgt = numpy.ascontiguousarray(wgt.astype(numpy.float32))
+    if len(_resample_weights_cache) >= _resample_weights_cache_max:
+        _resample_weights_cache.pop(next(iter(_resample_weights_cache)))
+    _resample_weights_cache[key] = (idx, wgt)
+    return (idx, wgt)
+
+# image resampling
+def image_resample(
+    image:numpy.ndarray,
+    new_shape:tuple,
+    kernel:str = 'box',
+    out:numpy.ndarray = None,
+    ) -> numpy.ndarray:
     """
-    Cheap (!) image resampling
+    Resample an image (antialiased, separable, parallel)
 
     Parameters
     ----------
     image : ndarray
-        Image to be resampled
+        Image to be resampled (uint8 or float, 2D or 3D)
     new_shape : tuple
-        Shape of resampled image
+        Shape of resampled image (int: maximum size, float: factor)
+    kernel : str
+        Resampling kernel, one of 'box' (default), 'linear',
+        'lanczos2' ... 'lanczos9', or 'cheap' (truncated box average)
+    out : ndarray
+        Optional pre-allocated output array (must match in shape and
+        dtype: uint8 for uint8 input, float32 otherwise)
     
     Returns
     -------
@@ -2450,29 +2955,58 @@ def image_resample(image:numpy.ndarray, new_shape:tuple) -> numpy.ndarray:
     elif isinstance(new_shape, float) and new_shape > 0.0 and new_shape <= 8.0:
         new_shape = (int(new_shape * float(im_shape[0])),
             int(new_shape * float(im_shape[1])))
+    if isinstance(new_shape, list):
+        new_shape = tuple(new_shape)
     if not isinstance(new_shape, tuple) or len(new_shape) != 2:
         raise ValueError('Invalid new_shape parameter')
     if not isinstance(new_shape[0], int) or new_shape[0] < 1:
         raise ValueError('Invalid new_shape[0] value')
     if not isinstance(new_shape[1], int) or new_shape[1] < 1:
         raise ValueError('Invalid new_shape[1] value')
+    if not isinstance(kernel, str) or kernel == '':
+        kernel = 'box'
+    kernel = kernel.lower()
 
     # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
     from .jitfunc import image_resample_u1, image_resample_f4
+    from .jitfunc import image_resample_wu1, image_resample_wf4
 
     if len(im_shape) < 3:
-        re_shape = (im_shape[0], im_shape[1], 1)
-        try:
-            image.shape = re_shape
-        except:
-            raise RuntimeError('Error setting necessary planes in shape.')
-    if image.dtype == numpy.uint8:
-        rs_image = image_resample_u1(image, new_shape[0], new_shape[1])
+        image = image.reshape((im_shape[0], im_shape[1], 1))
+    if image.dtype != numpy.uint8 and image.dtype != numpy.float32:
+        image = image.astype(numpy.float32)
+    if kernel == 'cheap':
+        if image.dtype == numpy.uint8:
+            rs_image = image_resample_u1(image, new_shape[0], new_shape[1])
+        else:
+            rs_image = image_resample_f4(numpy.copy(image),
+                new_shape[0], new_shape[1])
+        if not out is None:
+            try:
+                out[...] = rs_image.reshape(out.shape)
+            except:
+                raise ValueError('Invalid out array.')
+            return out
     else:
-        rs_image = image_resample_f4(image, new_shape[0], new_shape[1])
+        rs_shape = (new_shape[0], new_shape[1], image.shape[2])
+        if out is None:
+            rs_image = numpy.zeros(rs_shape, dtype=image.dtype)
+        else:
+            if out.dtype != image.dtype or out.size != image.shape[2] * (
+                new_shape[0] * new_shape[1]) or not out.flags['C_CONTIGUOUS']:
+                raise ValueError('Invalid out array.')
+            rs_image = out.reshape(rs_shape)
+        (idx0, wgt0) = _resample_weights(im_shape[0], new_shape[0], kernel)
+        (idx1, wgt1) = _resample_weights(im_shape[1], new_shape[1], kernel)
+        if image.dtype == numpy.uint8:
+            image_resample_wu1(image, idx0, wgt0, idx1, wgt1, rs_image)
+        else:
+            image_resample_wf4(image, idx0, wgt0, idx1, wgt1, rs_image)
+        if not out is None:
+            return out
     rs_shape = rs_image.shape
     if rs_shape[2] == 1:
-        rs_image.shape = (rs_shape[0], rs_shape[1])
+        rs_image = rs_image.reshape((rs_shape[0], rs_shape[1]))
     return rs_image
 
 # rotate image (90 degrees left, right; or 180 degrees)
@@ -2752,7 +3286,7 @@ def lut_lookup(
     elif len(default) != 3:
         default = [0, 0, 0]
     else:
-        default = [].extend(default)
+        default = list(default)
         if not isinstance(default[0], int) or default[0] < 0:
             default[0] = 0
         elif default[0] > 255:
@@ -2785,6 +3319,11 @@ def lut_lookup(
             below_neg_col[1] < 0 or below_neg_col[1] > 255 or
             below_neg_col[2] < 0 or below_neg_col[2] > 255):
             raise ValueError('Invalid below_neg_col parameter')
+    if (above_pos_col is None and below_neg_col is None and trans_fac > 0.0
+        and default == [0, 0, 0] and (neg_lut is None or trans_off >= 0.0)):
+        min_thresh = trans_off / trans_fac
+        return lut_map(values, pos_lut, neg_lut, min_thresh,
+            min_thresh + 1.0 / trans_fac)[0]
     zero = numpy.zeros(1, dtype=values.dtype)
     if trans_fac != 1.0:
         values = trans_fac * values
@@ -2814,7 +3353,7 @@ def lut_lookup(
         colors[ispos, 2] = pos_lut[values[ispos], 2]
     else:
         above = (values >= num_cols)
-        below = ispos and (not above)
+        below = numpy.logical_and(ispos, numpy.logical_not(above))
         colors[below, 0] = pos_lut[values[below], 0]
         colors[below, 1] = pos_lut[values[below], 1]
         colors[below, 2] = pos_lut[values[below], 2]
@@ -2830,15 +3369,106 @@ def lut_lookup(
             colors[isneg, 2] = neg_lut[values[isneg], 2]
         else:
             above = (values >= num_cols)
-            below = isneg and (not above)
-            colors[below, 0] = pos_lut[values[below], 0]
-            colors[below, 1] = pos_lut[values[below], 1]
-            colors[below, 2] = pos_lut[values[below], 2]
+            below = numpy.logical_and(isneg, numpy.logical_not(above))
+            colors[below, 0] = neg_lut[values[below], 0]
+            colors[below, 1] = neg_lut[values[below], 1]
+            colors[below, 2] = neg_lut[values[below], 2]
             colors[above, 0] = below_neg_col[0]
             colors[above, 1] = below_neg_col[1]
             colors[above, 2] = below_neg_col[2]
     return colors
 
+# color LUT mapping (colors and alpha in one pass)
+def lut_map(
+    values:numpy.ndarray,
+    pos_lut:numpy.ndarray,
+    neg_lut:numpy.ndarray = None,
+    min_thresh:float = 0.0,
+    max_thresh:float = 1.0,
+    min_alpha:float = 0.0,
+    max_alpha:float = 1.0,
+    alpha_cap:float = 1.0,
+    out:Tuple[numpy.ndarray, numpy.ndarray] = None,
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Map values to colors and alpha through LUTs (single pass)
+
+    Parameters
+    ----------
+    values : ndarray
+        Numeric values (any shape) to map
+    pos_lut : ndarray
+        Cx3 color lookup table (for positive values)
+    neg_lut : ndarray
+        Cx3 color lookup table (for negative values, default None)
+    min_thresh : float
+        Values (or negative values' magnitude) must exceed this (0.0)
+    max_thresh : float
+        Value mapped to the last color of the LUT (default: 1.0)
+    min_alpha, max_alpha : float
+        Alpha ramp from min_thresh to max_thresh (default: 0.0, 1.0)
+    alpha_cap : float
+        Maximum alpha value (default: 1.0)
+    out : tuple
+        Optional (colors, alpha) pre-allocated output arrays, colors
+        must be uint8 of shape values.shape + (3,), alpha float32 of
+        shape values.shape (either can be None)
+    
+    Returns
+    -------
+    colors : ndarray
+        RGB colors (values.shape + (3,)), 0 for values not mapped
+    alpha : ndarray
+        Alpha values (values.shape), 0 for values not mapped
+    """
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    from .jitfunc import lut_map as lut_map_jit
+
+    if not isinstance(values, numpy.ndarray):
+        values = numpy.asarray(values)
+    if not values.dtype in [numpy.float32, numpy.float64]:
+        values = values.astype(numpy.float64)
+    vshape = values.shape
+    num_vals = values.size
+    luts = []
+    for lut in [pos_lut, neg_lut]:
+        if lut is None:
+            lut = numpy.zeros(0, dtype=numpy.uint8).reshape((0, 3,))
+        elif not isinstance(lut, numpy.ndarray):
+            lut = numpy.asarray(lut)
+        if lut.ndim != 2 or lut.shape[1] != 3:
+            raise ValueError('Invalid LUT')
+        if lut.dtype != numpy.uint8:
+            lut = lut.astype(numpy.uint8)
+        elif not lut.flags.writeable:
+            lut = lut.copy()
+        luts.append(lut)
+    if luts[0].shape[0] == 0:
+        raise ValueError('Invalid LUT')
+    if max_thresh <= min_thresh:
+        max_thresh = min_thresh + 0.000001
+    if out is None:
+        out = (None, None)
+    elif not isinstance(out, tuple) or len(out) != 2:
+        raise ValueError('Invalid out parameter.')
+    (colors, alpha) = out
+    if colors is None:
+        colors = numpy.zeros(num_vals * 3, dtype=numpy.uint8).reshape(
+            vshape + (3,))
+    elif (colors.dtype != numpy.uint8 or colors.size != (3 * num_vals) or
+        not colors.flags.c_contiguous):
+        raise ValueError('Invalid colors output array.')
+    if alpha is None:
+        alpha = numpy.zeros(num_vals, dtype=numpy.float32).reshape(vshape)
+    elif (alpha.dtype != numpy.float32 or alpha.size != num_vals or
+        not alpha.flags.c_contiguous):
+        raise ValueError('Invalid alpha output array.')
+    lut_map_jit(values.reshape(-1), luts[0], luts[1], float(min_thresh),
+        float(max_thresh), float(min_alpha), float(max_alpha),
+        float(alpha_cap), colors.reshape((num_vals, 3,)), alpha.reshape(-1))
+    return (colors, alpha)
+
 # radial sampling (TODO!)
 
 # read image
@@ -2853,70 +3483,78 @@ def read_image(image_file:str) -> numpy.ndarray:
         raise
 
 # rgb -> hue, saturation, lightness, value
-def rgb2hslv(r:numpy.ndarray, g:numpy.ndarray, b:numpy.ndarray):
+_rgb2hslv_channels = {'h': 0, 'sl': 1, 'l': 2, 'sv': 3, 'v': 4}
+def rgb2hslv(
+    r:numpy.ndarray,
+    g:numpy.ndarray = None,
+    b:numpy.ndarray = None,
+    channels:Union[str, list] = None,
+    out_type:str = 'float64',
+    ) -> tuple:
     """
     Convert RGB to HSLV values
 
     Parameters
     ----------
     r, g, b : ndarray
-        Arrays with red, green, blue channel values (any dims, must match!)
+        Arrays with red, green, blue channel values (any dims, must match!),
+        alternatively r can be an RGB image (last dim of size 3), with
+        g and b set to None
+    channels : str or list
+        Subset of channels to compute, from 'h', 'sl', 'l', 'sv', 'v'
+        (default: all five)
+    out_type : str
+        Either 'float32' or 'float64' (default)
     
     Returns
     -------
     (h, sl, l, sv, v) : tuple
-        Hue, saturation, lightness, and value arrays
+        Hue, saturation, lightness, and value arrays (or requested subset,
+        in the order given by channels)
     """
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    from .jitfunc import rgb2hslv as rgb2hslv_jit
+
     if isinstance(r, list):
         r = numpy.asarray(r)
-    if isinstance(g, list):
-        g = numpy.asarray(g)
-    if isinstance(b, list):
-        b = numpy.asarray(b)
-    if r.shape != g.shape or r.shape != b.shape:
-        raise ValueError('Invalid shape/dims.')
-    if r.dtype != g.dtype or r.dtype != b.dtype:
-        raise ValueError('Invalid datatype combination.')
-    rm = numpy.logical_and(r >= g, r >= b)
-    gm = numpy.logical_and(g > r, g >= b)
-    bm = numpy.logical_and(b > r, b > g)
-    if r.dtype != numpy.float32 and r.dtype != numpy.float64:
-        f = (1.0 / 255.0)
-        r = f * r.astype(numpy.float64)
-        g = f * g.astype(numpy.float64)
-        b = f * b.astype(numpy.float64)
-    rr = r[rm]
-    rg = r[gm]
-    rb = r[bm]
-    gr = g[rm]
-    gg = g[gm]
-    gb = g[bm]
-    br = b[rm]
-    bg = b[gm]
-    bb = b[bm]
-    h = numpy.zeros(r.size).reshape(r.shape)
-    mx = h.copy()
-    mn = h.copy()
-    mx[rm] = rr
-    mx[gm] = gg
-    mx[bm] = bb
-    mn[rm] = numpy.minimum(gr, br)
-    mn[gm] = numpy.minimum(rg, bg)
-    mn[bm] = numpy.minimum(rb, gb)
-    mxmn = (mx == mn)
-    h[rm] = numpy.divide(gr - br, numpy.maximum(0.0001, rr - mn[rm]))
-    h[gm] = 2.0 + numpy.divide(bg - rg, numpy.maximum(0.0001, gg - mn[gm]))
-    h[bm] = 4.0 + numpy.divide(rb - gb, numpy.maximum(0.0001, bb - mn[bm]))
-    h[mxmn] = 0.0
-    h[h<0.0] = h[h<0.0] + 6.0
-    h /= 6.0
-    l = 0.5 * (mx + mn)
-    sl = numpy.divide(mx - mn, numpy.maximum(0.0001, 1.0 - numpy.abs(2.0 * l - 1.0)))
-    sl[mx==0] = 0.0
-    sl[mn==1] = 0.0
-    sv = numpy.divide(mx - mn, numpy.maximum(0.0001, mx))
-    sv[mx==0] = 0.0
-    return (h, sl, l, sv, mx)
+    if g is None and b is None:
+        if not isinstance(r, numpy.ndarray) or r.ndim < 2 or r.shape[-1] != 3:
+            raise ValueError('Invalid RGB image.')
+        out_shape = r.shape[:-1]
+        rgb = r.reshape((-1, 3))
+    else:
+        if isinstance(g, list):
+            g = numpy.asarray(g)
+        if isinstance(b, list):
+            b = numpy.asarray(b)
+        if r.shape != g.shape or r.shape != b.shape:
+            raise ValueError('Invalid shape/dims.')
+        if r.dtype != g.dtype or r.dtype != b.dtype:
+            raise ValueError('Invalid datatype combination.')
+        out_shape = r.shape
+        rgb = numpy.stack((r.reshape(-1), g.reshape(-1), b.reshape(-1)), axis=1)
+    if rgb.dtype == numpy.float32 or rgb.dtype == numpy.float64:
+        scale = 1.0
+    else:
+        scale = 1.0 / 255.0
+        if rgb.dtype != numpy.uint8:
+            rgb = rgb.astype(numpy.float64)
+    if channels is None:
+        channels = ['h', 'sl', 'l', 'sv', 'v']
+    elif isinstance(channels, str):
+        channels = [channels]
+    chidx = -numpy.ones(5, dtype=numpy.int32)
+    for (cidx, channel) in enumerate(channels):
+        if not channel in _rgb2hslv_channels:
+            raise ValueError('Invalid channel: ' + str(channel))
+        chidx[_rgb2hslv_channels[channel]] = cidx
+    if out_type == 'float32':
+        out = numpy.zeros((len(channels), rgb.shape[0]), dtype=numpy.float32)
+    else:
+        out = numpy.zeros((len(channels), rgb.shape[0]), dtype=numpy.float64)
+    rgb2hslv_jit(rgb, scale, chidx, out)
+    return tuple([out[cidx,:].reshape(out_shape) for cidx in range(len(channels))])
 
 # segmentation outline (coordinates, image, or SVG/path)
 def segmentation_outline(
@@ -3306,6 +3944,137 @@ def superpixel_outlines(
             rowlen, image_shape[0], '\n    '.join(pix_shapes.values()))
     return pix_shapes
 
+# superpixel patches (batch of fixed-size, resampled crops)
+def superpixel_patches(
+    image:numpy.ndarray,
+    spmap:numpy.ndarray,
+    superpixels:Union[list, numpy.ndarray],
+    patch_size:Union[int, tuple] = 64,
+    padding:int = 0,
+    square:bool = True,
+    kernel:str = 'box',
+    spnei:list = None,
+    bboxes:numpy.ndarray = None,
+    out:numpy.ndarray = None,
+    ) -> numpy.ndarray:
+    """
+    Extract fixed-size (resampled) patches for a list of superpixels
+
+    Parameters
+    ----------
+    image : ndarray
+        Image (2D or 3D, uint8) array
+    spmap : ndarray
+        Superpixel mapping array (see jitfunc.superpixel_map)
+    superpixels : list or ndarray
+        Superpixel indices (one patch per index)
+    patch_size : int or tuple
+        Size of the output patches (default: 64, i.e. 64 x 64)
+    padding : int
+        Additional padding around each superpixel in pixels
+    square : bool
+        If True (default), the cropping region is extended to a square
+        (as far as the image allows), such that patches keep the aspect
+    kernel : str
+        Resampling kernel (see image_resample, default: 'box')
+    spnei : list
+        Optional per-superpixel neighbors lists (one degree of the
+        output of superpixel_neighbors) to include in the cropping
+    bboxes : ndarray
+        Pre-computed bounding boxes (see jitfunc.superpixel_bboxes)
+    out : ndarray
+        Optional pre-allocated (or memory-mapped) output array, must
+        be uint8 and of shape (N, patch_size[0], patch_size[1], planes)
+
+    Returns
+    -------
+    patches : ndarray
+        N-by-patch_size[0]-by-patch_size[1]-by-planes array
+    """
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    from .jitfunc import superpixel_bboxes
+
+    im_shape = image.shape
+    if len(im_shape) < 2 or len(im_shape) > 3 or image.dtype != numpy.uint8:
+        raise ValueError('Invalid image array.')
+    if len(im_shape) == 2:
+        image = image.reshape((im_shape[0], im_shape[1], 1,))
+    if isinstance(patch_size, int):
+        patch_size = (patch_size, patch_size)
+    elif isinstance(patch_size, list):
+        patch_size = tuple(patch_size)
+    if not isinstance(patch_size, tuple) or len(patch_size) != 2:
+        raise ValueError('Invalid patch_size parameter.')
+    if not isinstance(padding, int) or padding < 0:
+        padding = 0
+    superpixels = numpy.asarray(superpixels, dtype=numpy.int64).reshape(-1)
+    num_patches = superpixels.size
+    if bboxes is None:
+        bboxes = superpixel_bboxes(spmap, numpy.int32(im_shape[1]))
+    if num_patches > 0 and (numpy.amin(superpixels) < 0 or
+        numpy.amax(superpixels) >= bboxes.shape[0]):
+        raise ValueError('Invalid superpixel index.')
+    out_shape = (num_patches, patch_size[0], patch_size[1], image.shape[2])
+    if out is None:
+        out = numpy.zeros(num_patches * patch_size[0] * patch_size[1] *
+            image.shape[2], dtype=numpy.uint8).reshape(out_shape)
+    elif out.shape != out_shape or out.dtype != numpy.uint8:
+        raise ValueError('Invalid out array.')
+
+    # cropping regions (with neighbors, padding, and squared)
+    boxes = bboxes[superpixels,:].astype(numpy.int64)
+    if not spnei is None:
+        for (idx, sp) in enumerate(superpixels):
+            nei = numpy.asarray(spnei[sp], dtype=numpy.int64).reshape(-1)
+            if nei.size == 0:
+                continue
+            nboxes = bboxes[nei,:]
+            nboxes = nboxes[nboxes[:,2] > nboxes[:,0],:]
+            if nboxes.shape[0] == 0:
+                continue
+            boxes[idx,0:2] = numpy.minimum(boxes[idx,0:2],
+                numpy.amin(nboxes[:,0:2], axis=0))
+            boxes[idx,2:4] = numpy.maximum(boxes[idx,2:4],
+                numpy.amax(nboxes[:,2:4], axis=0))
+    empty = (boxes[:,2] <= boxes[:,0])
+    boxes[:,0:2] -= padding
+    boxes[:,2:4] += padding
+    if square:
+        ysize = boxes[:,2] - boxes[:,0]
+        xsize = boxes[:,3] - boxes[:,1]
+        ygrow = numpy.maximum(0, xsize - ysize)
+        xgrow = numpy.maximum(0, ysize - xsize)
+        boxes[:,0] -= ygrow // 2
+        boxes[:,2] += ygrow - ygrow // 2
+        boxes[:,1] -= xgrow // 2
+        boxes[:,3] += xgrow - xgrow // 2
+        yshift = (numpy.maximum(0, -boxes[:,0]) -
+            numpy.maximum(0, boxes[:,2] - im_shape[0]))
+        xshift = (numpy.maximum(0, -boxes[:,1]) -
+            numpy.maximum(0, boxes[:,3] - im_shape[1]))
+        boxes[:,0] += yshift
+        boxes[:,2] += yshift
+        boxes[:,1] += xshift
+        boxes[:,3] += xshift
+    boxes[:,0:2] = numpy.maximum(boxes[:,0:2], 0)
+    boxes[:,2] = numpy.minimum(boxes[:,2], im_shape[0])
+    boxes[:,3] = numpy.minimum(boxes[:,3], im_shape[1])
+
+    # resample each cropped region into its patch
+    for idx in range(num_patches):
+        (y0, x0, y1, x1) = boxes[idx,:]
+        if empty[idx] or y1 <= y0 or x1 <= x0:
+            out[idx,...] = 0
+            continue
+        crop = image[y0:y1,x0:x1,:]
+        if out[idx].flags['C_CONTIGUOUS']:
+            image_resample(crop, patch_size, kernel, out=out[idx])
+        else:
+            out[idx,...] = image_resample(crop, patch_size, kernel).reshape(
+                out_shape[1:])
+    return out
+
 # superpixel value extraction
 def superpixel_values(
     im:numpy.ndarray,
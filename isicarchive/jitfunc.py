@@ -8,12 +8,30 @@ Functions
 ---------
 conv_kernel
     Generate convolution smoothing kernel
+hsl_histograms
+    Compute joint HSL histograms in a single pass
+image_blend
+    Blend (or max-mix) gray/RGB/RGBA images (single parallel pass)
+image_composite
+    Blend an underlay and several RGBA layers (single pass)
 image_mix
     Mix two images (RGB and/or gray scale, alpha parameter supported)
+image_register_products
+    Compute Gauss-Newton products for one registration iteration
 image_resample_u1
     Cheap (!) image resampling for uint8 images
 image_resample_f4
     Cheap (!) image resampling for float32 images
+image_resample_wf4
+    Weighted (separable) image resampling for float32 images
+image_resample_wu1
+    Weighted (separable) image resampling for uint8 images
+lut_map
+    Map values to colors and alpha through LUTs (single pass)
+rgb2hslv
+    Convert RGB to HSLV values (single pass, selected channels only)
+superpixel_bboxes
+    Compute bounding boxes for all superpixels (from map)
 superpixel_contour
     Extract superpixel contour
 superpixel_decode
@@ -40,7 +58,7 @@ from numba import jit, prange
 import numpy
 
 # convolution (smoothing) kernel
-@jit('f4[:](f4)', nopython=True)
+@jit('f4[:](f4)', nopython=True, cache=True)
 def conv_kernel(fwhm:numpy.float32 = 2.0) -> numpy.ndarray:
     """
     Generate convolution smoothing kernel
@@ -67,7 +85,7 @@ def conv_kernel(fwhm:numpy.float32 = 2.0) -> numpy.ndarray:
     return (k / numpy.sum(k)).astype(numpy.float32)
 
 # image convolution (cheap!)
-@jit('f4[:,:](f4[:,:],f4[:])', nopython=True)
+@jit('f4[:,:](f4[:,:],f4[:])', nopython=True, cache=True)
 def image_conv_float(
     data:numpy.ndarray,
     kernel:numpy.ndarray,
@@ -128,8 +146,218 @@ def image_conv_float(
         tempv[c] = colv
     return numpy.true_divide(out, tempv.reshape((1,ds1,)))
 
+# joint HSL histograms (hue-sat, hue-light, sat-light, single pass)
+@jit('f8[:,:,:](f8[:],f8[:],f8[:],b1[:],f8[:],i8,i8)', nopython=True, cache=True, parallel=True)
+def hsl_histograms(
+    h:numpy.ndarray,
+    s:numpy.ndarray,
+    l:numpy.ndarray,
+    mask:numpy.ndarray,
+    ranges:numpy.ndarray,
+    bins:numpy.int64,
+    nchunks:numpy.int64,
+    ) -> numpy.ndarray:
+    """
+    Compute joint HSL histograms in a single pass
+
+    Parameters
+    ----------
+    h, s, l : ndarray
+        Hue, saturation, and lightness values (1D, float64)
+    mask : ndarray
+        Boolean mask (same size, or empty for all values)
+    ranges : ndarray
+        6-element array with hmin, hmax, smin, smax, lmin, lmax
+    bins : int
+        Number of bins (per dimension)
+    nchunks : int
+        Number of chunks (parallel partial histograms)
+    
+    Returns
+    -------
+    hists : ndarray
+        3-by-bins-by-bins array (hue-sat, hue-light, sat-light), with
+        the same binning rules as numpy.histogram2d
+    """
+    nv = h.size
+    use_mask = (mask.size == nv)
+    hmin = ranges[0]
+    smin = ranges[2]
+    lmin = ranges[4]
+    hf = numpy.float64(bins) / (ranges[1] - hmin)
+    sf = numpy.float64(bins) / (ranges[3] - smin)
+    lf = numpy.float64(bins) / (ranges[5] - lmin)
+    csize = (nv + nchunks - 1) // nchunks
+    part = numpy.zeros((nchunks, 3, bins, bins), dtype=numpy.float64)
+    for chunk in prange(nchunks): #pylint: disable=not-an-iterable
+        for i in range(chunk * csize, min(nv, (chunk + 1) * csize)):
+            if use_mask and not mask[i]:
+                continue
+            hb = numpy.int64(numpy.floor((h[i] - hmin) * hf))
+            sb = numpy.int64(numpy.floor((s[i] - smin) * sf))
+            lb = numpy.int64(numpy.floor((l[i] - lmin) * lf))
+            if hb == bins and h[i] == ranges[1]:
+                hb = bins - 1
+            if sb == bins and s[i] == ranges[3]:
+                sb = bins - 1
+            if lb == bins and l[i] == ranges[5]:
+                lb = bins - 1
+            hv = (hb >= 0 and hb < bins)
+            sv = (sb >= 0 and sb < bins)
+            lv = (lb >= 0 and lb < bins)
+            if hv and sv:
+                part[chunk,0,hb,sb] += 1.0
+            if hv and lv:
+                part[chunk,1,hb,lb] += 1.0
+            if sv and lv:
+                part[chunk,2,sb,lb] += 1.0
+    out = numpy.zeros((3, bins, bins), dtype=numpy.float64)
+    for chunk in range(nchunks):
+        out += part[chunk]
+    return out
+
+# image blending (gray/RGB/RGBA, scalar or per-pixel alpha, single pass)
+@jit([
+    'void(u1[:,:,:],u1[:,:,:],f4[:,:],f4,u1[:,:,:])', #(i1, i2, alpha, scale, out)
+    'void(u1[:,:,:],u1[:,:,:],f8[:,:],f4,u1[:,:,:])',
+    'void(u1[:,:,:],u1[:,:,:],u1[:,:],f4,u1[:,:,:])',
+    ], nopython=True, cache=True, parallel=True)
+def image_blend(
+    i1:numpy.ndarray,
+    i2:numpy.ndarray,
+    a2:numpy.ndarray,
+    a2scale:numpy.float32,
+    out:numpy.ndarray,
+    ):
+    """
+    Blend (or max-mix) gray/RGB/RGBA images (single parallel pass)
+
+    Parameters
+    ----------
+    i1, i2 : ndarray
+        HxWxC images (C = 1 for gray, 3 for RGB, 4 for RGBA); the
+        alpha plane of an RGBA second image multiplies a2
+    a2 : ndarray
+        HxW opacity of the second image, 1x1 for a single value, or
+        0x0 to set each component to the maximum across both images
+    a2scale : float
+        Scaling of a2 values (1.0 for float, 1.0/255.0 for uint8)
+    out : ndarray
+        HxWxC output image (C = 1, or at least 3 planes, of which the
+        first 3 are written), can be the same array as i1
+    """
+    ny = i1.shape[0]
+    nx = i1.shape[1]
+    gray1 = (i1.shape[2] < 3)
+    gray2 = (i2.shape[2] < 3)
+    grayo = (out.shape[2] < 3)
+    rgba2 = (i2.shape[2] > 3)
+    use_max = (a2.size == 0) and not rgba2
+    single_a = (a2.size == 1)
+    o = numpy.float32(1.0)
+    th = numpy.float32(1.0) / numpy.float32(3)
+    s255 = numpy.float32(1.0) / numpy.float32(255.0)
+    for y in prange(ny): #pylint: disable=not-an-iterable
+        for x in range(nx):
+            if gray1:
+                r1 = numpy.float32(i1[y,x,0])
+                g1 = r1
+                b1 = r1
+            else:
+                r1 = numpy.float32(i1[y,x,0])
+                g1 = numpy.float32(i1[y,x,1])
+                b1 = numpy.float32(i1[y,x,2])
+            if gray2:
+                r2 = numpy.float32(i2[y,x,0])
+                g2 = r2
+                b2 = r2
+            else:
+                r2 = numpy.float32(i2[y,x,0])
+                g2 = numpy.float32(i2[y,x,1])
+                b2 = numpy.float32(i2[y,x,2])
+            if use_max:
+                if grayo:
+                    if gray2:
+                        out[y,x,0] = max(i1[y,x,0], i2[y,x,0])
+                    else:
+                        out[y,x,0] = max(r1, round(th * (r2 + g2 + b2)))
+                else:
+                    out[y,x,0] = max(r1, r2)
+                    out[y,x,1] = max(g1, g2)
+                    out[y,x,2] = max(b1, b2)
+                continue
+            if a2.size == 0:
+                a = o
+            elif single_a:
+                a = numpy.float32(a2[0,0]) * a2scale
+            else:
+                a = numpy.float32(a2[y,x]) * a2scale
+            if rgba2:
+                a = a * (numpy.float32(i2[y,x,3]) * s255)
+            ia = o - a
+            if grayo:
+                if gray2:
+                    out[y,x,0] = round(ia * r1 + a * r2)
+                else:
+                    out[y,x,0] = round(ia * r1 + a * (th * (r2 + g2 + b2)))
+            elif gray2:
+                i2ap = a * r2
+                out[y,x,0] = round(ia * r1 + i2ap)
+                out[y,x,1] = round(ia * g1 + i2ap)
+                out[y,x,2] = round(ia * b1 + i2ap)
+            else:
+                out[y,x,0] = round(ia * r1 + a * r2)
+                out[y,x,1] = round(ia * g1 + a * g2)
+                out[y,x,2] = round(ia * b1 + a * b2)
+
+# image compositing (underlay and layers, single pass)
+@jit('void(u1[:,:],u1[:,:,:],f4[:,:],u1[:,:])', nopython=True, cache=True, parallel=True)
+def image_composite(
+    underlay:numpy.ndarray,
+    layers_rgb:numpy.ndarray,
+    layers_alpha:numpy.ndarray,
+    out:numpy.ndarray,
+    ):
+    """
+    Blend an underlay and several RGBA layers (single pass)
+
+    Parameters
+    ----------
+    underlay : ndarray
+        PxC underlay image vectors (C = 1 for gray, 3 for RGB)
+    layers_rgb : ndarray
+        LxPx3 layer colors (blended in order, first layer at bottom)
+    layers_alpha : ndarray
+        LxP layer alpha (opacity) values
+    out : ndarray
+        Px3 output image vectors (can be the underlay, if RGB)
+    """
+    num_pix = underlay.shape[0]
+    num_layers = layers_rgb.shape[0]
+    gray = (underlay.shape[1] == 1)
+    for p in prange(num_pix): #pylint: disable=not-an-iterable
+        if gray:
+            r = numpy.float32(underlay[p,0])
+            g = r
+            b = r
+        else:
+            r = numpy.float32(underlay[p,0])
+            g = numpy.float32(underlay[p,1])
+            b = numpy.float32(underlay[p,2])
+        for l in range(num_layers):
+            a = layers_alpha[l,p]
+            if a <= 0.0:
+                continue
+            ia = numpy.float32(1.0) - a
+            r = ia * r + a * numpy.float32(layers_rgb[l,p,0])
+            g = ia * g + a * numpy.float32(layers_rgb[l,p,1])
+            b = ia * b + a * numpy.float32(layers_rgb[l,p,2])
+        out[p,0] = round(r)
+        out[p,1] = round(g)
+        out[p,2] = round(b)
+
 # image mixing
-@jit('u1[:,:](u1[:,:],u1[:,:],optional(f4[:]))', nopython=True)
+@jit('u1[:,:](u1[:,:],u1[:,:],optional(f4[:]))', nopython=True, cache=True)
 def image_mix(
     i1:numpy.ndarray,
     i2:numpy.ndarray,
@@ -234,8 +462,138 @@ def image_mix(
                         a * numpy.float32(i2[p,2]))
     return oi
 
+# image registration (fused residual and Jacobian products)
+@jit('f8[:](f8[:,:],u1[:,:],f8[:],f8[:],f8[:],f8[:,:],f8[:,:],f8[:],i8,i8)',
+    nopython=True, cache=True, parallel=True)
+def image_register_products(
+    image:numpy.ndarray,
+    mask:numpy.ndarray,
+    c0:numpy.ndarray,
+    c1:numpy.ndarray,
+    ref:numpy.ndarray,
+    jac:numpy.ndarray,
+    t:numpy.ndarray,
+    k:numpy.ndarray,
+    ks:numpy.int64,
+    nchunks:numpy.int64,
+    ) -> numpy.ndarray:
+    """
+    Compute Gauss-Newton products for one registration iteration
+
+    Parameters
+    ----------
+    image : ndarray
+        Moving image (2D, float64)
+    mask : ndarray
+        Moving image mask (2D, uint8, 1 for valid pixels)
+    c0, c1 : ndarray
+        Reference image sampling coordinates (first and second dimension)
+    ref : ndarray
+        Reference image values at the sampling coordinates
+    jac : ndarray
+        Jacobian (number of coordinates by number of parameters)
+    t : ndarray
+        Current 3-by-3 transformation matrix (reference to moving)
+    k : ndarray
+        Interpolation kernel (from Sampler._kernels)
+    ks : int
+        Kernel table sampling (from Sampler._kernels)
+    nchunks : int
+        Number of chunks (parallel partial sums)
+    
+    Returns
+    -------
+    products : ndarray
+        Vector with J'J (np*np), J'ref (np), J'mov (np), followed by
+        number of valid coordinates, sum(ref), sum(mov), sum(ref*ref),
+        sum(ref*mov), and sum(mov*mov)
+    """
+    nk = k.size - 1
+    ikl = nk // (2 * ks)
+    mks = ikl * ks
+    fks = numpy.float64(ks)
+    as0 = image.shape[0]
+    as1 = image.shape[1]
+    mx0 = numpy.float64(as0 - 1)
+    mx1 = numpy.float64(as1 - 1)
+    nc = c0.size
+    npar = jac.shape[1]
+    nprod = npar * npar + 2 * npar + 6
+    csize = (nc + nchunks - 1) // nchunks
+    part = numpy.zeros((nchunks, nprod), dtype=numpy.float64)
+    for chunk in prange(nchunks): #pylint: disable=not-an-iterable
+        pc = part[chunk,:]
+        for i in range(chunk * csize, min(nc, (chunk + 1) * csize)):
+            tc0 = t[0,0] * c0[i] + t[0,1] * c1[i] + t[0,2]
+            tc1 = t[1,0] * c0[i] + t[1,1] * c1[i] + t[1,2]
+            if tc0 < 0.0 or tc0 > mx0 or tc1 < 0.0 or tc1 > mx1:
+                continue
+
+            # mask (bilinear)
+            m0 = min(numpy.int64(tc0), as0 - 2)
+            m1 = min(numpy.int64(tc1), as1 - 2)
+            if m0 < 0:
+                m0 = 0
+            if m1 < 0:
+                m1 = 0
+            w0 = tc0 - numpy.float64(m0)
+            w1 = tc1 - numpy.float64(m1)
+            mv = ((1.0 - w0) * ((1.0 - w1) * numpy.float64(mask[m0,m1]) +
+                w1 * numpy.float64(mask[m0,m1+1])) + w0 * (
+                (1.0 - w1) * numpy.float64(mask[m0+1,m1]) +
+                w1 * numpy.float64(mask[m0+1,m1+1])))
+            if mv < 0.5:
+                continue
+
+            # moving image value (kernel)
+            c0b = numpy.int64(tc0 + 0.5)
+            c0o = tc0 - numpy.float64(c0b)
+            c1b = numpy.int64(tc1 + 0.5)
+            c1o = tc1 - numpy.float64(c1b)
+            val = 0.0
+            vw = 0.0
+            for ri in range(c0b-ikl, c0b+ikl+1):
+                if ri < 0 or ri >= as0:
+                    continue
+                wi = mks + (ri-c0b) * ks - numpy.int64(c0o * fks)
+                if wi < 0 or wi >= nk:
+                    continue
+                kwi0 = k[wi]
+                for ci in range(c1b-ikl, c1b+ikl+1):
+                    if ci < 0 or ci >= as1:
+                        continue
+                    cwi = mks + (ci-c1b) * ks - numpy.int64(c1o * fks)
+                    if cwi < 0 or cwi >= nk:
+                        continue
+                    kwi = kwi0 * k[cwi]
+                    val += kwi * image[ri,ci]
+                    vw += kwi
+            if vw == 0.0:
+                continue
+            f = val / vw
+            d = ref[i]
+
+            # accumulate products
+            for p0 in range(npar):
+                jp0 = jac[i,p0]
+                for p1 in range(npar):
+                    pc[p0 * npar + p1] += jp0 * jac[i,p1]
+                pc[npar * npar + p0] += jp0 * d
+                pc[npar * npar + npar + p0] += jp0 * f
+            po = npar * npar + 2 * npar
+            pc[po] += 1.0
+            pc[po+1] += d
+            pc[po+2] += f
+            pc[po+3] += d * d
+            pc[po+4] += d * f
+            pc[po+5] += f * f
+    out = numpy.zeros(nprod, dtype=numpy.float64)
+    for chunk in range(nchunks):
+        out += part[chunk,:]
+    return out
+
 # image resampling (cheap!)
-@jit('u1[:,:,:](u1[:,:,:],i4,i4)', nopython=True)
+@jit('u1[:,:,:](u1[:,:,:],i4,i4)', nopython=True, cache=True)
 def image_resample_u1(image:numpy.ndarray, d0:numpy.int, d1:numpy.int) -> numpy.ndarray:
     """
     Cheap (!) image resampling for uint8 images
@@ -284,7 +642,7 @@ def image_resample_u1(image:numpy.ndarray, d0:numpy.int, d1:numpy.int) -> numpy.
                 tcol += temp[t, :, :]
             out[c, :, :] = tcol // (1 + ito - ifrom)
     return out
-@jit('f4[:,:,:](f4[:,:,:],i4,i4)', nopython=True)
+@jit('f4[:,:,:](f4[:,:,:],i4,i4)', nopython=True, cache=True)
 def image_resample_f4(image:numpy.ndarray, d0:numpy.int, d1:numpy.int) -> numpy.ndarray:
     """
     Cheap (!) image resampling for float32 images
@@ -334,8 +692,295 @@ def image_resample_f4(image:numpy.ndarray, d0:numpy.int, d1:numpy.int) -> numpy.
             out[c, :, :] = tcol / numpy.float(1 + ito - ifrom)
     return out
 
+# image resampling (weighted, separable, parallel)
+@jit('void(u1[:,:,:],i4[:,:],f4[:,:],i4[:,:],f4[:,:],u1[:,:,:])',
+    nopython=True, cache=True, parallel=True)
+def image_resample_wu1(
+    image:numpy.ndarray,
+    idx0:numpy.ndarray,
+    wgt0:numpy.ndarray,
+    idx1:numpy.ndarray,
+    wgt1:numpy.ndarray,
+    out:numpy.ndarray,
+    ):
+    """
+    Weighted (separable) image resampling for uint8 images
+
+    Parameters
+    ----------
+    image : ndarray
+        Image array (uint8, 3D)
+    idx0, wgt0 : ndarray
+        Source indices (int32) and weights (float32) per target row
+    idx1, wgt1 : ndarray
+        Source indices (int32) and weights (float32) per target column
+    out : ndarray
+        Output array (uint8, 3D, filled in place)
+    """
+    im_shape = image.shape
+    d0 = out.shape[0]
+    d1 = out.shape[1]
+    nplanes = im_shape[2]
+    k0 = idx0.shape[1]
+    k1 = idx1.shape[1]
+    temp = numpy.zeros((im_shape[0], d1, nplanes), dtype=numpy.float32)
+    for r in prange(im_shape[0]): #pylint: disable=not-an-iterable
+        for c in range(d1):
+            for k in range(k1):
+                w = wgt1[c,k]
+                if w == 0.0:
+                    continue
+                sc = idx1[c,k]
+                for p in range(nplanes):
+                    temp[r,c,p] += w * numpy.float32(image[r,sc,p])
+    for r in prange(d0): #pylint: disable=not-an-iterable
+        for c in range(d1):
+            for p in range(nplanes):
+                v = numpy.float32(0.0)
+                for k in range(k0):
+                    v += wgt0[r,k] * temp[idx0[r,k],c,p]
+                if v <= 0.0:
+                    out[r,c,p] = 0
+                elif v >= 255.0:
+                    out[r,c,p] = 255
+                else:
+                    out[r,c,p] = numpy.uint8(v + 0.5)
+
+# image resampling (weighted, separable, parallel; float32)
+@jit('void(f4[:,:,:],i4[:,:],f4[:,:],i4[:,:],f4[:,:],f4[:,:,:])',
+    nopython=True, cache=True, parallel=True)
+def image_resample_wf4(
+    image:numpy.ndarray,
+    idx0:numpy.ndarray,
+    wgt0:numpy.ndarray,
+    idx1:numpy.ndarray,
+    wgt1:numpy.ndarray,
+    out:numpy.ndarray,
+    ):
+    """
+    Weighted (separable) image resampling for float32 images
+
+    Parameters
+    ----------
+    image : ndarray
+        Image array (float32, 3D)
+    idx0, wgt0 : ndarray
+        Source indices (int32) and weights (float32) per target row
+    idx1, wgt1 : ndarray
+        Source indices (int32) and weights (float32) per target column
+    out : ndarray
+        Output array (float32, 3D, filled in place)
+    """
+    im_shape = image.shape
+    d0 = out.shape[0]
+    d1 = out.shape[1]
+    nplanes = im_shape[2]
+    k0 = idx0.shape[1]
+    k1 = idx1.shape[1]
+    temp = numpy.zeros((im_shape[0], d1, nplanes), dtype=numpy.float32)
+    for r in prange(im_shape[0]): #pylint: disable=not-an-iterable
+        for c in range(d1):
+            for k in range(k1):
+                w = wgt1[c,k]
+                if w == 0.0:
+                    continue
+                sc = idx1[c,k]
+                for p in range(nplanes):
+                    temp[r,c,p] += w * image[r,sc,p]
+    for r in prange(d0): #pylint: disable=not-an-iterable
+        for c in range(d1):
+            for p in range(nplanes):
+                v = numpy.float32(0.0)
+                for k in range(k0):
+                    v += wgt0[r,k] * temp[idx0[r,k],c,p]
+                out[r,c,p] = v
+
+# LUT color mapping (colors and alpha ramp, single pass)
+@jit([
+    'void(f4[:],u1[:,:],u1[:,:],f8,f8,f8,f8,f8,u1[:,:],f4[:])',
+    'void(f8[:],u1[:,:],u1[:,:],f8,f8,f8,f8,f8,u1[:,:],f4[:])',
+    ], nopython=True, cache=True, parallel=True)
+def lut_map(
+    values:numpy.ndarray,
+    pos_lut:numpy.ndarray,
+    neg_lut:numpy.ndarray,
+    min_thresh:numpy.float64,
+    max_thresh:numpy.float64,
+    min_alpha:numpy.float64,
+    max_alpha:numpy.float64,
+    alpha_cap:numpy.float64,
+    rgb_out:numpy.ndarray,
+    alpha_out:numpy.ndarray,
+    ):
+    """
+    Map values to colors and alpha through LUTs (single pass)
+
+    Parameters
+    ----------
+    values : ndarray
+        Values (1D, float32 or float64)
+    pos_lut, neg_lut : ndarray
+        Cx3 color LUTs (uint8) for positive and negative values; for
+        no negative colors, neg_lut must have 0 rows
+    min_thresh, max_thresh : float
+        Values (absolute for negative values) above min_thresh are
+        colored, with max_thresh mapping to the last LUT entry
+    min_alpha, max_alpha : float
+        Alpha ramp (from min_thresh to max_thresh)
+    alpha_cap : float
+        Maximum alpha value
+    rgb_out : ndarray
+        Vx3 output colors (uint8), 0 for values not colored
+    alpha_out : ndarray
+        V output alpha values (float32), 0 for values not colored
+    """
+    num_vals = values.size
+    num_pos = pos_lut.shape[0]
+    num_neg = neg_lut.shape[0]
+    pos_fac = numpy.float64(num_pos - 1)
+    neg_fac = numpy.float64(num_neg - 1)
+    t_fac = 1.0 / (max_thresh - min_thresh)
+    a_fac = max_alpha - min_alpha
+    a_cap = min(1.0, alpha_cap)
+    for p in prange(num_vals): #pylint: disable=not-an-iterable
+        v = numpy.float64(values[p])
+        if v > min_thresh:
+            t = min(1.0, (v - min_thresh) * t_fac)
+            i = min(num_pos - 1, numpy.int64(t * pos_fac))
+            rgb_out[p,0] = pos_lut[i,0]
+            rgb_out[p,1] = pos_lut[i,1]
+            rgb_out[p,2] = pos_lut[i,2]
+        elif num_neg > 0 and -v > min_thresh:
+            t = min(1.0, (-v - min_thresh) * t_fac)
+            i = min(num_neg - 1, numpy.int64(t * neg_fac))
+            rgb_out[p,0] = neg_lut[i,0]
+            rgb_out[p,1] = neg_lut[i,1]
+            rgb_out[p,2] = neg_lut[i,2]
+        else:
+            rgb_out[p,0] = 0
+            rgb_out[p,1] = 0
+            rgb_out[p,2] = 0
+            alpha_out[p] = 0.0
+            continue
+        alpha_out[p] = numpy.float32(max(0.0, min(a_cap, min_alpha + a_fac * t)))
+
+# RGB -> hue, saturation, lightness, value (single pass)
+@jit([
+    'void(u1[:,:],f8,i4[:],f4[:,:])', #(rgb, scale, channel rows, out)
+    'void(u1[:,:],f8,i4[:],f8[:,:])',
+    'void(f4[:,:],f8,i4[:],f4[:,:])',
+    'void(f4[:,:],f8,i4[:],f8[:,:])',
+    'void(f8[:,:],f8,i4[:],f4[:,:])',
+    'void(f8[:,:],f8,i4[:],f8[:,:])',
+    ], nopython=True, cache=True, parallel=True)
+def rgb2hslv(
+    rgb:numpy.ndarray,
+    scale:numpy.float64,
+    chidx:numpy.ndarray,
+    out:numpy.ndarray,
+    ):
+    """
+    Convert RGB to HSLV values (single pass, selected channels only)
+
+    Parameters
+    ----------
+    rgb : ndarray
+        N-by-3 array with red, green, and blue values
+    scale : float
+        Scaling factor applied to RGB values (e.g. 1/255 for uint8)
+    chidx : ndarray
+        5-element int32 array with the row in out for hue, saturation
+        (HSL), lightness, saturation (HSV), and value (-1 to skip)
+    out : ndarray
+        Output array (number of channels by N, filled in place)
+    """
+    hi = chidx[0]
+    sli = chidx[1]
+    li = chidx[2]
+    svi = chidx[3]
+    vi = chidx[4]
+    for i in prange(rgb.shape[0]): #pylint: disable=not-an-iterable
+        r = scale * numpy.float64(rgb[i,0])
+        g = scale * numpy.float64(rgb[i,1])
+        b = scale * numpy.float64(rgb[i,2])
+        if r >= g and r >= b:
+            mx = r
+            mn = min(g, b)
+            h = (g - b) / max(0.0001, r - mn)
+        elif g >= b:
+            mx = g
+            mn = min(r, b)
+            h = 2.0 + (b - r) / max(0.0001, g - mn)
+        else:
+            mx = b
+            mn = min(r, g)
+            h = 4.0 + (r - g) / max(0.0001, b - mn)
+        if hi >= 0:
+            if mx == mn:
+                h = 0.0
+            elif h < 0.0:
+                h += 6.0
+            out[hi,i] = h / 6.0
+        l = 0.5 * (mx + mn)
+        if sli >= 0:
+            if mx == 0.0 or mn == 1.0:
+                out[sli,i] = 0.0
+            else:
+                out[sli,i] = (mx - mn) / max(0.0001, 1.0 - abs(2.0 * l - 1.0))
+        if li >= 0:
+            out[li,i] = l
+        if svi >= 0:
+            if mx == 0.0:
+                out[svi,i] = 0.0
+            else:
+                out[svi,i] = (mx - mn) / max(0.0001, mx)
+        if vi >= 0:
+            out[vi,i] = mx
+
+# superpixel bounding boxes (from superpixel map)
+@jit('i4[:,:](i4[:,:],i4)', nopython=True, cache=True, parallel=True)
+def superpixel_bboxes(spmap:numpy.ndarray, width:numpy.int32) -> numpy.ndarray:
+    """
+    Compute bounding boxes for all superpixels (from map)
+
+    Parameters
+    ----------
+    spmap : ndarray
+        Superpixel map (see superpixel_map)
+    width : int
+        Image width (to decode the flattened pixel indices)
+    
+    Returns
+    -------
+    bboxes : ndarray
+        Sx4 array with [y0, x0, y1, x1] (y1/x1 non inclusive) for each
+        superpixel (all 0 for empty superpixels)
+    """
+    num_sp = spmap.shape[0]
+    bboxes = numpy.zeros(4 * num_sp, dtype=numpy.int32).reshape((num_sp, 4,))
+    for sp in prange(num_sp): #pylint: disable=not-an-iterable
+        num_pix = spmap[sp,-1]
+        if num_pix == 0:
+            continue
+        y0 = spmap[sp,0] // width
+        y1 = y0
+        x0 = spmap[sp,0] - y0 * width
+        x1 = x0
+        for p in range(1, num_pix):
+            y = spmap[sp,p] // width
+            x = spmap[sp,p] - y * width
+            y0 = min(y0, y)
+            y1 = max(y1, y)
+            x0 = min(x0, x)
+            x1 = max(x1, x)
+        bboxes[sp,0] = y0
+        bboxes[sp,1] = x0
+        bboxes[sp,2] = y1 + 1
+        bboxes[sp,3] = x1 + 1
+    return bboxes
+
 # superpixel contour (results match CV2.findContours coords format)
-@jit('i4[:,:](i4,i4,i4,b1[:,::1])', nopython=True)
+@jit('i4[:,:](i4,i4,i4,b1[:,::1])', nopython=True, cache=True)
 def superpixel_contour(
     num_pix:numba.int32,
     ypos:numba.int32,
@@ -450,7 +1095,7 @@ def superpixel_contour(
     return out
 
 # decode image superpixel
-@jit('i4[:,:](u1[:,:,:])', nopython=True)
+@jit('i4[:,:](u1[:,:,:])', nopython=True, cache=True)
 def superpixel_decode(rgb_array:numpy.ndarray) -> numpy.ndarray:
     """
     Decode RGB version of a superpixel image into an index array.
@@ -482,7 +1127,7 @@ def superpixel_decode(rgb_array:numpy.ndarray) -> numpy.ndarray:
     return idx
 
 # create superpixel -> pixel index array
-@jit('i4[:,:](i4[:,:])', nopython=True)
+@jit('i4[:,:](i4[:,:])', nopython=True, cache=True)
 def superpixel_map(pixel_img:numpy.ndarray) -> numpy.ndarray:
     """
     Map a superpixel (patch) image to a dictionary with (1D) coordinates.
@@ -516,7 +1161,7 @@ def superpixel_map(pixel_img:numpy.ndarray) -> numpy.ndarray:
     return sp_to_p
 
 # superpixel outlines
-@jit('Tuple((i4,i4,i4[:]))(i4,b1[:,::1])', nopython=True)
+@jit('Tuple((i4,i4,i4[:]))(i4,b1[:,::1])', nopython=True, cache=True)
 def superpixel_outline_dir(
     num_pix:numba.int32,
     spx_map:numpy.ndarray,
@@ -882,7 +1527,7 @@ def superpixel_outline_dir(
     return (y0,x0,out)
 
 # superpixel path
-@jit('i4[:,:](i4,i4,i4,b1[:,::1])', nopython=True)
+@jit('i4[:,:](i4,i4,i4,b1[:,::1])', nopython=True, cache=True)
 def superpixel_path(
     num_pix:numba.int32,
     ypos:numba.int32,
@@ -991,7 +1636,7 @@ def superpixel_path(
     return out
 
 # SVG path from coordinates list
-@jit('i1[:](i4[:,:])', nopython=True)
+@jit('i1[:](i4[:,:])', nopython=True, cache=True)
 def svg_coord_list(crd_list:numpy.ndarray) -> numpy.ndarray:
     """
     Generate SVG-path-suitable list of directions from coordinates list
@@ -1049,7 +1694,7 @@ def svg_coord_list(crd_list:numpy.ndarray) -> numpy.ndarray:
     return out[0:idx]
 
 # SVG path from v/h list
-@jit('i1[:](i4[:,:])', nopython=True)
+@jit('i1[:](i4[:,:])', nopython=True, cache=True)
 def svg_path_from_list(vh_list:numpy.ndarray) -> numpy.ndarray:
     """
     Generate SVG-path-suitable list of directions from v/h list
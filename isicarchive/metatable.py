@@ -0,0 +1,472 @@
+"""
+isicarchive.metatable (MetaTable)
+
+This module provides the MetaTable helper class and doesn't have to be
+imported from outside the main package functionality (IsicApi).
+
+A MetaTable holds (tree-structured) records, such as the image details
+in IsicApi.image_cache, in columnar form: one numpy.ndarray per (dotted)
+field, with a null mask per field. Fields with non-numeric (hashable)
+values are dictionary-encoded (int32 codes into a list of categories).
+
+>>> table = MetaTable(api.image_cache)
+>>> melanoma = table.select(['meta.clinical.diagnosis', '==', 'melanoma'])
+>>> ages = table.column('meta.clinical.age_approx', rows=melanoma)
+
+Criteria are evaluated with the same semantics as func.select_from, but
+vectorised: numeric comparisons run on the arrays directly, and all
+other tests are evaluated once per distinct value (category).
+"""
+
+# specific version for file
+__version__ = '0.4.8'
+
+
+# imports (needed for majority of functions)
+import json
+from typing import Any, Union
+
+import numpy
+
+from . import func
+
+
+# file format version
+_METATABLE_VERSION = 1
+
+# object array from a list of values (without numpy broadcasting)
+def _object_array(values:list) -> numpy.ndarray:
+    array = numpy.empty(len(values), dtype=object)
+    for (idx, v) in enumerate(values):
+        array[idx] = v
+    return array
+
+# infer column kind from a list of (non-null) values
+def _infer_kind(values:list) -> str:
+    if len(values) == 0:
+        return 'float'
+    types = set([type(v) for v in values])
+    if types == {bool}:
+        return 'bool'
+    if types == {int}:
+        if (min(values) >= -9223372036854775808 and
+            max(values) <= 9223372036854775807):
+            return 'int'
+        return 'object'
+    if types <= {int, float}:
+        return 'float'
+    try:
+        set(values)
+    except TypeError:
+        return 'object'
+    if all([t in [bool, float, int, str] for t in types]):
+        return 'cat'
+    return 'object'
+
+# build one column (array, mask, categories, kind) from values
+def _build_column(values:list) -> tuple:
+    num_rows = len(values)
+    mask = numpy.asarray([v is None for v in values], dtype=numpy.bool_)
+    valid = [v for v in values if not v is None]
+    kind = _infer_kind(valid)
+    categories = None
+    if kind == 'bool':
+        column = numpy.asarray([v is True for v in values], dtype=numpy.bool_)
+    elif kind == 'int':
+        column = numpy.asarray([0 if v is None else v for v in values],
+            dtype=numpy.int64)
+    elif kind == 'float':
+        column = numpy.asarray(
+            [numpy.nan if v is None else v for v in values],
+            dtype=numpy.float64)
+    elif kind == 'cat':
+        codes = dict()
+        categories = []
+        column = numpy.zeros(num_rows, dtype=numpy.int32)
+        for (idx, v) in enumerate(values):
+            if v is None:
+                column[idx] = -1
+                continue
+            code = codes.get((type(v), v), None)
+            if code is None:
+                code = len(categories)
+                codes[(type(v), v)] = code
+                categories.append(v)
+            column[idx] = code
+    else:
+        column = _object_array(values)
+    return (column, mask, categories, kind)
+
+# test results for a list of values (exceptions evaluating as False)
+def _test_values(test:Any, values:Any) -> numpy.ndarray:
+    result = numpy.zeros(len(values), dtype=numpy.bool_)
+    for (idx, v) in enumerate(values):
+        try:
+            result[idx] = bool(test(v))
+        except:
+            pass
+    return result
+
+
+class MetaTable(object):
+    """
+    MetaTable
+
+    Attributes
+    ----------
+    categories : dict
+        Category values (list) for dictionary-encoded fields
+    columns : dict
+        Column arrays (by dotted field name)
+    keys : numpy.ndarray
+        Row keys (e.g. image _id values)
+    kinds : dict
+        Column kind, one of 'bool', 'cat', 'float', 'int', 'object'
+    masks : dict
+        Null masks (True where the value is None or missing)
+
+    Methods
+    -------
+    append(items, fields=None)
+        Append (new) items to the table
+    column(name, rows=None, decode=False)
+        Return a column (view), optionally decoded and for some rows
+    rows(keys)
+        Return the row indices for a list of keys
+    save(filename)
+        Save the table into a .npz file
+    select(criteria, rows=None)
+        Vectorised selection, returning a boolean mask
+    """
+
+
+    def __init__(self,
+        items:Union[dict, list] = None,
+        fields:list = None,
+        from_file:str = None,
+        ):
+
+        # setup object
+        self._pos = dict()
+        self.categories = dict()
+        self.columns = dict()
+        self.keys = numpy.zeros(0, dtype=object)
+        self.kinds = dict()
+        self.masks = dict()
+
+        # load from file
+        if not from_file is None:
+            try:
+                self._load(from_file)
+            except:
+                raise
+            return
+        if not items is None:
+            self.append(items, fields)
+
+    # length
+    def __len__(self) -> int:
+        return self.keys.size
+
+    # output
+    def __repr__(self) -> str:
+        return 'isicarchive.metatable.MetaTable(<{0:d} rows, {1:d} fields>)'.format(
+            self.keys.size, len(self.columns))
+
+    # load from file
+    def _load(self, filename:str):
+        with numpy.load(filename, allow_pickle=False) as npz:
+            header = json.loads(str(npz['header']))
+            if header.get('version', None) != _METATABLE_VERSION:
+                raise ValueError('Invalid MetaTable file version.')
+            self.keys = numpy.asarray(
+                [str(k) for k in npz['keys']], dtype=object)
+            for (idx, name) in enumerate(header['fields']):
+                kind = header['kinds'][idx]
+                mask = npz['m{0:d}'.format(idx)].astype(numpy.bool_)
+                if kind == 'object':
+                    column = _object_array(
+                        json.loads(str(npz['c{0:d}'.format(idx)])))
+                else:
+                    column = npz['c{0:d}'.format(idx)]
+                self.columns[name] = column
+                self.masks[name] = mask
+                self.kinds[name] = kind
+                if kind == 'cat':
+                    self.categories[name] = header['categories'][name]
+        self._pos = {k: idx for (idx, k) in enumerate(self.keys)}
+
+    # decoded values (list) of a column
+    def _values(self, name:str) -> list:
+        column = self.columns[name]
+        mask = self.masks[name]
+        kind = self.kinds[name]
+        if kind == 'cat':
+            categories = self.categories[name]
+            return [None if c < 0 else categories[c] for c in column.tolist()]
+        return [None if m else v for (v, m) in zip(column.tolist(), mask.tolist())]
+
+    # append items
+    def append(self, items:Union[dict, list], fields:list = None):
+        """
+        Append (new) items to the table
+
+        Parameters
+        ----------
+        items : dict or list
+            Items to add; if a dict is given, its keys are used as row
+            keys, otherwise the '_id' field of each item is used; items
+            whose keys are already in the table are skipped
+        fields : list
+            List of (dotted) field names, default: all fields of the
+            table (and, if the table is empty, all fields in items)
+
+        No return value.
+        """
+        if isinstance(items, dict):
+            items = [(k, v) for (k, v) in items.items() if not k in self._pos]
+        else:
+            items = [(func.getxattr(v, '_id'), v) for v in items]
+            items = [(k, v) for (k, v) in items if not k in self._pos]
+        if len(items) == 0:
+            return
+        if fields is None:
+            if self.columns:
+                fields = list(self.columns.keys())
+            else:
+                fields = func.getxkeys([v for (_, v) in items])
+        num_old = self.keys.size
+        new_keys = _object_array([k for (k, _) in items])
+        item_list = [v for (_, v) in items]
+        for name in list(self.columns.keys()) + [
+            f for f in fields if not f in self.columns]:
+            getter = func._compile_getter(name)
+            values = [getter(item) for item in item_list]
+            kind = self.kinds.get(name, None)
+            if kind is None:
+                if num_old > 0:
+                    values = [None] * num_old + values
+                (column, mask, categories, kind) = _build_column(values)
+            else:
+                (column, mask, categories, new_kind) = _build_column(values)
+                valid = any([not v is None for v in values])
+                if kind == 'cat' and (new_kind == 'cat' or not valid):
+                    old_cats = self.categories[name]
+                    cat_codes = {(type(c), c): idx for (idx, c) in enumerate(old_cats)}
+                    if categories:
+                        remap = numpy.zeros(len(categories) + 1, dtype=numpy.int32)
+                        remap[-1] = -1
+                        for (idx, c) in enumerate(categories):
+                            code = cat_codes.get((type(c), c), None)
+                            if code is None:
+                                code = len(old_cats)
+                                cat_codes[(type(c), c)] = code
+                                old_cats.append(c)
+                            remap[idx] = code
+                        column = remap[column]
+                    else:
+                        column = numpy.zeros(len(values), dtype=numpy.int32) - 1
+                    categories = old_cats
+                    column = numpy.concatenate((self.columns[name], column))
+                elif not valid:
+                    if kind == 'object':
+                        column = _object_array(values)
+                    else:
+                        column = numpy.zeros(len(values),
+                            dtype=self.columns[name].dtype)
+                        if kind == 'float':
+                            column.fill(numpy.nan)
+                    column = numpy.concatenate((self.columns[name], column))
+                elif kind == new_kind or (kind == 'float' and new_kind == 'int'):
+                    column = numpy.concatenate((self.columns[name],
+                        column.astype(self.columns[name].dtype)))
+                else:
+                    (column, mask, categories, kind) = _build_column(
+                        self._values(name) + values)
+                    self.columns[name] = column
+                    self.masks[name] = mask
+                    self.kinds[name] = kind
+                    if kind == 'cat':
+                        self.categories[name] = categories
+                    else:
+                        self.categories.pop(name, None)
+                    continue
+                mask = numpy.concatenate((self.masks[name], mask))
+            self.columns[name] = column
+            self.masks[name] = mask
+            self.kinds[name] = kind
+            if kind == 'cat':
+                self.categories[name] = categories
+        for (idx, k) in enumerate(new_keys.tolist()):
+            self._pos[k] = num_old + idx
+        self.keys = numpy.concatenate((self.keys, new_keys))
+
+    # get column
+    def column(self,
+        name:str,
+        rows:Union[numpy.ndarray, list] = None,
+        decode:bool = False,
+        ) -> numpy.ndarray:
+        """
+        Return a column (view), optionally decoded and for some rows
+
+        Parameters
+        ----------
+        name : str
+            Field name
+        rows : numpy.ndarray or list
+            Optional row indices or boolean mask (default: all rows)
+        decode : bool
+            If True, return the values of dictionary-encoded columns
+            (as object array, with None for null), and integer and
+            boolean columns with nulls as float64 (with NaN for null)
+
+        Returns
+        -------
+        column : numpy.ndarray
+            Column values; without rows and decode, a read-only view
+        """
+        if not name in self.columns:
+            raise ValueError('Invalid field name: ' + name)
+        column = self.columns[name]
+        if not rows is None:
+            column = column[rows]
+        else:
+            column = column.view()
+            column.flags.writeable = False
+        if not decode:
+            return column
+        kind = self.kinds[name]
+        if kind == 'cat':
+            categories = numpy.empty(len(self.categories[name]) + 1, dtype=object)
+            categories[:-1] = self.categories[name]
+            categories[-1] = None
+            return categories[column]
+        elif kind in ['bool', 'int']:
+            mask = self.masks[name] if rows is None else self.masks[name][rows]
+            if numpy.any(mask):
+                column = column.astype(numpy.float64)
+                column[mask] = numpy.nan
+        return column
+
+    # get row indices for keys
+    def rows(self, keys:list) -> numpy.ndarray:
+        """
+        Return the row indices for a list of keys
+
+        Parameters
+        ----------
+        keys : list
+            List of row keys (e.g. image _id values)
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            Row indices (int64), -1 for keys not in the table
+        """
+        pos = self._pos
+        return numpy.asarray([pos.get(k, -1) for k in keys], dtype=numpy.int64)
+
+    # save table
+    def save(self, filename:str):
+        """
+        Save the table into a .npz file
+
+        Parameters
+        ----------
+        filename : str
+            Filename of the .npz file (written without pickled objects)
+
+        No return value.
+        """
+        fields = list(self.columns.keys())
+        header = {
+            'categories': self.categories,
+            'fields': fields,
+            'kinds': [self.kinds[name] for name in fields],
+            'version': _METATABLE_VERSION,
+        }
+        arrays = {
+            'header': numpy.asarray(json.dumps(header)),
+            'keys': numpy.asarray(self.keys.tolist(), dtype=numpy.str_),
+        }
+        for (idx, name) in enumerate(fields):
+            if self.kinds[name] == 'object':
+                arrays['c{0:d}'.format(idx)] = numpy.asarray(
+                    json.dumps(self.columns[name].tolist()))
+            else:
+                arrays['c{0:d}'.format(idx)] = self.columns[name]
+            arrays['m{0:d}'.format(idx)] = self.masks[name]
+        try:
+            with open(filename, 'wb') as npz_file:
+                numpy.savez_compressed(npz_file, **arrays)
+        except:
+            raise
+
+    # vectorised selection
+    def select(self,
+        criteria:list,
+        rows:Union[numpy.ndarray, list] = None,
+        ) -> numpy.ndarray:
+        """
+        Vectorised selection, returning a boolean mask
+
+        Parameters
+        ----------
+        criteria : list
+            List of criteria (see func.selected), whereas all field
+            names must be columns of the table
+        rows : numpy.ndarray or list
+            Optional row indices (or boolean mask) to select from
+
+        Returns
+        -------
+        selected : numpy.ndarray
+            Boolean mask (over all rows, or the rows given)
+        """
+        if criteria is None:
+            criteria = []
+        if (len(criteria) == 3 and isinstance(criteria[0], str)):
+            criteria = [criteria]
+        num_rows = self.keys.size
+        if not rows is None:
+            num_rows = numpy.zeros(num_rows, dtype=numpy.bool_)[rows].size
+        selected = numpy.ones(num_rows, dtype=numpy.bool_)
+        for c in criteria:
+            if len(c) != 3:
+                raise ValueError('Invalid criterion.')
+            (c_name, c_op, c_test) = c
+            if not c_name in self.columns:
+                raise ValueError('Invalid field name: ' + c_name)
+            (test, _, _, _) = func._compile_test(c_op, c_test)
+            column = self.columns[c_name]
+            mask = self.masks[c_name]
+            if not rows is None:
+                column = column[rows]
+                mask = mask[rows]
+            kind = self.kinds[c_name]
+            if kind == 'cat':
+                passed = _test_values(test, self.categories[c_name] + [None])
+                c_sel = passed[column]
+            elif kind == 'object':
+                c_sel = _test_values(test, column)
+                c_sel[mask] = _test_values(test, [None])[0]
+            else:
+                if (c_op in ['==', '!=', '<', '<=', '>', '>='] and
+                    type(c_test) in [int, float] and kind != 'bool'):
+                    c_sel = {
+                        '==': numpy.equal,
+                        '!=': numpy.not_equal,
+                        '<': numpy.less,
+                        '<=': numpy.less_equal,
+                        '>': numpy.greater,
+                        '>=': numpy.greater_equal,
+                    }[c_op](column, c_test)
+                else:
+                    (values, inverse) = numpy.unique(column, return_inverse=True)
+                    values = values.tolist()
+                    passed = _test_values(test, values)
+                    c_sel = passed[inverse]
+                c_sel[mask] = _test_values(test, [None])[0]
+            selected &= c_sel
+        return selected
@@ -39,7 +39,7 @@ def _gauss_kernel(fwhm:numpy.float64 = 2.0) -> numpy.ndarray:
     'f8[:,:](f8[:,:],f8[:],f8[:],f8[:],i8)', #output(array, crd0, crd1, kernel, ksize)
     'f8[:,:](f4[:,:],f8[:],f8[:],f8[:],i8)',
     'f8[:,:](u1[:,:],f8[:],f8[:],f8[:],i8)',
-    ], nopython=True)
+    ], nopython=True, cache=True)
 def _sample_grid_2d(
     a:numpy.ndarray,
     c0:numpy.ndarray,
@@ -109,7 +109,7 @@ def _sample_grid_2d(
     'f8[:](f8[:,:],f8[:,:],f8[:],i8)', #output(array, crd, kernel, ksize)
     'f8[:](f4[:,:],f8[:,:],f8[:],i8)',
     'f8[:](u1[:,:],f8[:,:],f8[:],i8)',
-    ], nopython=True)
+    ], nopython=True, cache=True)
 def _sample_grid_coords(
     a:numpy.ndarray,
     c:numpy.ndarray,
@@ -165,7 +165,7 @@ def _sample_grid_coords(
     'f8[:](f8[:,:],f8[:,:],f8[:],i8)', #output(array, crd, kernel, ksize)
     'f8[:](f4[:,:],f8[:,:],f8[:],i8)',
     'f8[:](u1[:,:],f8[:,:],f8[:],i8)',
-    ], nopython=True)
+    ], nopython=True, cache=True)
 def _sample_grid_coords_fine(
     a:numpy.ndarray,
     c:numpy.ndarray,
@@ -227,7 +227,7 @@ def _sample_grid_coords_fine(
     'f8[:](f8[:],f8[:],f8[:],i8)', #output(vector, crd0, kernel, ksize)
     'f8[:](f4[:],f8[:],f8[:],i8)',
     'f8[:](u1[:],f8[:],f8[:],i8)',
-    ], nopython=True)
+    ], nopython=True, cache=True)
 def _sample_values(
     a:numpy.ndarray,
     c:numpy.ndarray,
@@ -14,12 +14,31 @@ from numba import jit
 import numpy
 
 from . import colorlut
-from .imfunc import image_mix, lut_lookup
+from .imfunc import image_mix, lut_map
 
 
 class StatsLayer(object):
     """
     StatsLayer
+
+    Attributes
+    ----------
+    alpha : ndarray
+        Optional (per-pixel) opacity, multiplied with the alpha ramp
+    data : ndarray
+        Statistical data (2D)
+    lut : list
+        Positive and (optional) negative Cx3 color LUTs
+    min_thresh, max_thresh : float
+        Values to map onto the first and last LUT entries
+    min_alpha, max_alpha : float
+        Alpha ramp (from min_thresh to max_thresh)
+    show_neg : bool
+        Flag whether negative values are colored (using lut[1])
+
+    After in-place changes of the data, alpha, or lut arrays, the
+    invalidate() method must be called; replacing any of the above
+    attributes is detected automatically.
     """
 
 
@@ -50,45 +69,84 @@ class StatsLayer(object):
                     dtype=numpy.float32).reshape(shape)
             elif alpha.shape != shape:
                 raise ValueError('Alpha layer shape must match.')
-        else:
-            alpha = numpy.zeros(shape[0] * shape[1],
-                dtype=numpy.float32).reshape(shape)
-        self._rendered = None
-        self._rendered_a = None
-        self._shape = shape
+        self._rendered = dict()
+        self._rendered_state = None
+        self._version = 0
         self.alpha = alpha
         self.data = data
         if isinstance(lut_name, str) and (lut_name in colorlut.LUTs):
-            self.lut = colorlut.LUTs[lut_name]
+            self.lut = list(colorlut.LUTs[lut_name])
+        elif isinstance(lut_name, list) and len(lut_name) in [1, 2]:
+            self.lut = [numpy.asarray(l, dtype=numpy.uint8).reshape((-1, 3,))
+                for l in lut_name if not l is None]
         else:
-            self.lut = colorlut.LUTs['standard']
-        for (idx, l) in enumerate(self.lut):
-            self.lut[idx] = numpy.asarray(l, dtype=numpy.uint8)
+            self.lut = list(colorlut.LUTs['standard'])
         if len(self.lut) < 2:
             self.lut.append(None)
         self.max_alpha = max_alpha
         self.max_thresh = max_thresh
         self.min_alpha = min_alpha
         self.min_thresh = min_thresh
+        self.show_neg = show_neg
     
-    def _render(self):
+    # render layer (optionally at a different shape, and into out)
+    def _render(self,
+        shape:Tuple = None,
+        out:Tuple[numpy.ndarray, numpy.ndarray] = None,
+        ) -> Tuple[numpy.ndarray, numpy.ndarray]:
         if self.min_thresh <= 0.0:
             self.min_thresh = 0.000000001
         if self.max_thresh <= self.min_thresh:
             self.max_thresh = self.min_thresh + 0.000001
-        abs_data = (numpy.abs(self.data) - self.min_thresh) / (
-            self.max_thresh - self.min_thresh)
-        show_data = (abs_data >= self.min_thresh)
-        self._rendered = lut_lookup(self.data, self.lut[0], self.lut[1],
-            self.max_thresh - self.min_thresh, self.min_thresh)
-        self._rendered_a = numpy.zeros(self._shape[0] * self._shape[1],
-            dtype=numpy.float32).reshape(self._shape)
-        self._rendered_a[show_data] = numpy.minimum(1.0, self.min_alpha + 
-            (self.max_alpha - self.min_alpha) * abs_data[show_data])
-    def rendered(self):
-        if self._rendered is None:
-            self._render()
-        return (self._rendered, self._rendered_a)
+        data = self.data
+        alpha = self.alpha
+        if not shape is None and tuple(shape) != data.shape:
+
+            # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+            from .sampler import Sampler
+            sampler = Sampler()
+
+            data = sampler.sample_grid(data, list(shape), 'resample', 'float32')
+            if not alpha is None:
+                alpha = sampler.sample_grid(alpha, list(shape), 'resample', 'float32')
+        if self.show_neg:
+            neg_lut = self.lut[1]
+        else:
+            neg_lut = None
+        (rendered, rendered_a) = lut_map(data, self.lut[0], neg_lut,
+            self.min_thresh, self.max_thresh, self.min_alpha, self.max_alpha,
+            out=out)
+        if not alpha is None:
+            numpy.multiply(rendered_a, alpha, out=rendered_a)
+        return (rendered, rendered_a)
+
+    # state (objects and values) that the rendering depends on
+    def _state(self) -> tuple:
+        return (self._version, self.data, self.alpha, self.lut[0], self.lut[1],
+            self.min_thresh, self.max_thresh, self.min_alpha, self.max_alpha,
+            self.show_neg)
+
+    # invalidate rendering (after in-place changes)
+    def invalidate(self):
+        self._version += 1
+        self._rendered = dict()
+
+    # rendered colors and alpha (cached, per shape; read-only arrays)
+    def rendered(self, shape:Tuple = None) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        if shape is None:
+            shape = self.data.shape
+        shape = tuple(shape)
+        state = self._state()
+        if not _same_state(state, self._rendered_state):
+            self._rendered = dict()
+            self._rendered_state = state
+        if not shape in self._rendered:
+            rendered = self._render(shape)
+            for arr in rendered:
+                arr.setflags(write=False)
+            self._rendered[shape] = rendered
+            self._rendered_state = self._state()
+        return self._rendered[shape]
 
 
 class StatsImage(object):
@@ -99,12 +157,16 @@ class StatsImage(object):
     ----------
     shape : tuple
         2-element array with Y (height) and X (width) elements
-    stats : list of dicts
-        Statistics layers with mandatory fields
-        stats['data'] : ndarray (the statistical data)
-        stats['lut'] : Cx3 color lookup table or str with name
+    stats : list of StatsLayer objects
+        Statistics layers (composited in order, first layer at bottom)
     underlay : ndarray
         Either Grayscale or RGB underlay image, can be none
+
+    The render method composites the underlay and all layers in a
+    single (compiled) pass; each layer's colors and alpha are kept
+    (per output shape), and only layers whose data, alpha, LUT, or
+    thresholds changed are rendered again. After in-place changes of
+    the underlay, the invalidate() method must be called.
     """
 
 
@@ -114,7 +176,7 @@ class StatsImage(object):
         stats_lut:Any = None,
         shape:Tuple = None,
         ):
-        self._rendered = None
+        self._composites = dict()
         if not underlay is None:
             shape = underlay.shape
         if len(shape) > 2:
@@ -123,14 +185,125 @@ class StatsImage(object):
         self.underlay = underlay
         self.stats = []
         if not stats_data is None:
-            self.stats.append(StatsLayer(stats_data, stats_lut))
+            self.stats.append(StatsLayer(stats_data, lut_name=stats_lut))
     
-    def render(self):
-        if self.underlay is None:
-            pass
-        pass
+    # output shape (for a maximum display size)
+    def _render_shape(self, max_size:int = None) -> Tuple:
+        shape = tuple(self.shape[0:2])
+        if max_size is None or max_size >= max(shape):
+            return shape
+        if max_size < 1:
+            raise ValueError('Invalid max_size parameter.')
+        scale = float(max_size) / float(max(shape))
+        return (max(1, int(0.5 + scale * float(shape[0]))),
+            max(1, int(0.5 + scale * float(shape[1]))))
+
+    # underlay (resampled, as pixel vectors)
+    def _render_underlay(self, shape:Tuple) -> numpy.ndarray:
+        underlay = self.underlay
+        if underlay is None:
+            return numpy.zeros(shape[0] * shape[1], dtype=numpy.uint8).reshape(
+                (shape[0] * shape[1], 1,))
+        if underlay.ndim > 2 and underlay.shape[2] > 3:
+            underlay = underlay[:,:,0:3]
+        if underlay.shape[0] != shape[0] or underlay.shape[1] != shape[1]:
+
+            # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+            from .sampler import Sampler
+            sampler = Sampler()
+
+            underlay = sampler.sample_grid(underlay, list(shape), 'resample', 'uint8')
+        elif underlay.dtype != numpy.uint8:
+            underlay = numpy.trunc(0.5 + numpy.minimum(255.0, numpy.maximum(0.0,
+                underlay.astype(numpy.float64)))).astype(numpy.uint8)
+        if underlay.ndim < 3:
+            planes = 1
+        else:
+            planes = underlay.shape[2]
+        return numpy.ascontiguousarray(underlay).reshape(
+            (shape[0] * shape[1], planes,))
+
+    # invalidate rendering (after in-place changes of the underlay)
+    def invalidate(self):
+        self._composites = dict()
+
+    # render (composite) image
+    def render(self, max_size:int = None) -> numpy.ndarray:
+        """
+        Render (composite) the underlay and all layers
+
+        Parameters
+        ----------
+        max_size : int
+            Optional maximum output size (e.g. for display), default:
+            full resolution (self.shape)
+        
+        Returns
+        -------
+        image : ndarray
+            RGB image (uint8), a copy of the (cached) composite, such
+            that changes to it do not affect later renderings
+        """
+
+        # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+        from .jitfunc import image_composite
+
+        shape = self._render_shape(max_size)
+        num_pix = shape[0] * shape[1]
+        layers = list(self.stats)
+        num_layers = len(layers)
+        composite = self._composites.get(shape, None)
+        if composite is None or len(composite['layers']) != num_layers or any(
+            [not l1 is l2 for (l1, l2) in zip(composite['layers'], layers)]):
+            while len(self._composites) >= 2:
+                self._composites.pop(next(iter(self._composites)))
+            composite = {
+                'image': numpy.zeros(num_pix * 3, dtype=numpy.uint8).reshape(
+                    (shape[0], shape[1], 3,)),
+                'layers': layers,
+                'layers_alpha': numpy.zeros(num_layers * num_pix,
+                    dtype=numpy.float32).reshape((num_layers, shape[0], shape[1],)),
+                'layers_rgb': numpy.zeros(num_layers * num_pix * 3,
+                    dtype=numpy.uint8).reshape((num_layers, shape[0], shape[1], 3,)),
+                'states': [None] * num_layers,
+                'underlay': None,
+                'underlay_src': None,
+            }
+            self._composites[shape] = composite
+        dirty = False
+        if composite['underlay'] is None or not composite['underlay_src'] is self.underlay:
+            composite['underlay'] = self._render_underlay(shape)
+            composite['underlay_src'] = self.underlay
+            dirty = True
+        for (idx, layer) in enumerate(layers):
+            state = layer._state()
+            if _same_state(state, composite['states'][idx]):
+                continue
+            layer._render(shape, out=(composite['layers_rgb'][idx],
+                composite['layers_alpha'][idx]))
+            composite['states'][idx] = layer._state()
+            dirty = True
+        if dirty:
+            image_composite(composite['underlay'],
+                composite['layers_rgb'].reshape((num_layers, num_pix, 3,)),
+                composite['layers_alpha'].reshape((num_layers, num_pix,)),
+                composite['image'].reshape((num_pix, 3,)))
+        return composite['image'].copy()
     
-    def rendered(self):
-        if not self._rendered:
-            self.render()
-        return self._rendered
+    # rendered image (only renders/composites changed layers)
+    def rendered(self, max_size:int = None) -> numpy.ndarray:
+        return self.render(max_size)
+
+
+# compare rendering states (arrays by identity, values by equality)
+def _same_state(state1:tuple, state2:tuple) -> bool:
+    if state1 is None or state2 is None or len(state1) != len(state2):
+        return False
+    for (v1, v2) in zip(state1, state2):
+        if v1 is v2:
+            continue
+        if isinstance(v1, numpy.ndarray) or isinstance(v2, numpy.ndarray):
+            return False
+        if v1 != v2:
+            return False
+    return True
@@ -24,11 +24,11 @@ import datetime
 import glob
 import os
 import re
-from typing import Any, Tuple, Union
+from typing import Any, Callable, Tuple, Union
 import warnings
 
 from . import func
-from .annotation import Annotation
+from .annotation import Annotation, _feature_arrays, _feature_from_list
 from .image import Image
 from .vars import ISIC_IMAGE_DETAILS_PER_REQUEST, ISIC_IMAGE_DISPLAY_SIZE_MAX
 
@@ -67,6 +67,15 @@ _repr_pretty_list = [
     'questions',
     'users',
 ]
+_stann_journal_arrays = [
+    ('idx', '<i4'),
+    ('lst', '<f4'),
+    ('area', '<i4'),
+    ('area_pct', '<f4'),
+    ('area_mpct', '<f4'),
+]
+_stann_journal_header = '<4sIQI'
+_stann_journal_magic = b'STNJ'
 _test_cache_exts = [
     '.jpg',
     '.bmp',
@@ -74,6 +83,383 @@ _test_cache_exts = [
     '.tif',
 ]
 
+# image heatmap (rendering and resampling, e.g. in a worker process)
+def _heatmap_process(
+    inputs:dict,
+    options:dict,
+    resize_output:Union[int,Tuple] = None,
+    ) -> Tuple[Any, dict]:
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    from .sampler import Sampler
+
+    (image_data, stats) = _heatmap_render(inputs, options)
+    if not resize_output is None:
+        image_data = Sampler().sample_grid(image_data, resize_output,
+            out_type='uint8')
+    return (image_data, stats)
+
+# image heatmap (rendering options, with defaults)
+def _heatmap_options(
+    max_raters:int = None,
+    min_raters:int = None,
+    mix_colors:bool = True,
+    alpha_scale:str = 'sqrt',
+    underlay_gray:float = 0.75,
+    ) -> dict:
+    return {
+        'alpha_scale': 'sqrt' if alpha_scale is None else alpha_scale,
+        'max_raters': max_raters,
+        'min_raters': min_raters,
+        'mix_colors': True if mix_colors is None else mix_colors,
+        'underlay_gray': 0.75 if underlay_gray is None else underlay_gray,
+    }
+
+# image heatmap (rendering, from inputs prepared by Study._heatmap_inputs)
+def _heatmap_render(inputs:dict, options:dict) -> Tuple[Any, dict]:
+
+    # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+    import numpy
+    from . import imfunc
+    from .jitfunc import superpixel_map
+
+    max_raters = options['max_raters']
+    min_raters = options['min_raters']
+    mix_colors = options['mix_colors']
+    alpha_scale = options['alpha_scale']
+    underlay_gray = options['underlay_gray']
+    image_data = inputs['image']
+    im_shape = image_data.shape
+    if underlay_gray > 0.0:
+        if underlay_gray >= 1.0:
+            image_data = imfunc.image_gray(image_data)
+        else:
+            image_data = imfunc.image_mix(image_data,
+                imfunc.image_gray(image_data), underlay_gray)
+    if not inputs['mask'] is None:
+        try:
+            seg_mask = inputs['mask']
+            seg_outline = imfunc.segmentation_outline(seg_mask, 'coords')
+            seg_outline = seg_outline[:,1] + seg_mask.shape[1] * seg_outline[:,0]
+            if len(im_shape) == 3:
+                planes = im_shape[2]
+            else:
+                planes = 1
+            im_rshape = (im_shape[0] * im_shape[1], planes, )
+            image_data.shape = im_rshape
+            for pc in range(planes):
+                image_data[seg_outline, pc] = 0
+            image_data.shape = im_shape
+        except:
+            pass
+    spmap = superpixel_map(inputs['spidx'])
+    fdict = inputs['features']
+    flist = sorted(fdict.keys())
+    fcols = numpy.asarray([inputs['fcols'][f] for f in flist],
+        dtype=numpy.float64).reshape((len(flist), 3))
+    udict = inputs['users']
+    if max_raters is None or max_raters <= 0:
+        max_raters = len(udict)
+    max_raters = float(max_raters)
+    stats = {
+        'feat': dict(),
+        'featcols': dict(),
+        'featnum': dict(),
+        'sp': dict(),
+        'users': udict,
+    }
+
+    # rater counts (feature x superpixel) and per-feature rater lists
+    num_sp = spmap.shape[0]
+    counts = numpy.zeros((len(flist), num_sp), dtype=numpy.int32)
+    sp_users = []
+    sp_first = numpy.zeros(num_sp, dtype=numpy.int64)
+    sp_first[:] = numpy.iinfo(numpy.int64).max
+    sp_order = 0
+    for f in fdict.keys():
+        uids = [fa[0] for fa in fdict[f]]
+        idxs = [numpy.asarray(fa[1], dtype=numpy.int64) for fa in fdict[f]]
+        fidxs = numpy.concatenate(idxs)
+        fusers = numpy.repeat(numpy.arange(len(uids)), [i.size for i in idxs])
+        counts[flist.index(f),:] = numpy.bincount(fidxs,
+            minlength=num_sp)[0:num_sp]
+        (sp_uniq, sp_upos) = numpy.unique(fidxs, return_index=True)
+        sp_first[sp_uniq] = numpy.minimum(sp_first[sp_uniq], sp_upos + sp_order)
+        sp_order += fidxs.size
+        sp_sort = numpy.argsort(fidxs, kind='stable')
+        sp_split = numpy.searchsorted(fidxs[sp_sort], sp_uniq, side='right')[:-1]
+        sp_users.append((f, dict(zip(sp_uniq.tolist(), [[uids[u] for u in ul.tolist()]
+            for ul in numpy.split(fusers[sp_sort], sp_split)]))))
+    sp_users.sort(key=lambda fu: fu[0])
+    touched = numpy.flatnonzero(counts.sum(axis=0) > 0)
+    touched = touched[numpy.argsort(sp_first[touched], kind='stable')]
+
+    # alpha values and (mixed) colors, as arrays
+    sp_counts = counts[:, touched]
+    sp_valid = sp_counts > 0
+    if not min_raters is None:
+        sp_valid = numpy.logical_and(sp_valid, sp_counts >= min_raters)
+    sp_alpha = sp_counts.astype(numpy.float64) / max_raters
+    if alpha_scale == 'sqrt':
+        sp_alpha = numpy.sqrt(sp_alpha)
+    sp_alpha[numpy.logical_not(sp_valid)] = 0.0
+    sp_asum = numpy.sum(sp_alpha, axis=0)
+    sp_nvalid = numpy.sum(sp_valid, axis=0)
+    sp_mixed = numpy.trunc(numpy.matmul(sp_alpha.T, fcols) /
+        numpy.maximum(sp_asum, 1.0e-12).reshape((-1, 1))).astype(numpy.int32)
+    sp_malpha = sp_asum / numpy.maximum(sp_nvalid, 1)
+
+    # statistics (once per distinct feature/rater pattern)
+    if touched.size > 0:
+        (patterns, pattern_idx) = numpy.unique(sp_counts.T, axis=0,
+            return_inverse=True)
+        pattern_idx = pattern_idx.reshape(pattern_idx.size)
+    else:
+        patterns = numpy.zeros((0, len(flist)), dtype=numpy.int32)
+    pattern_info = [None] * patterns.shape[0]
+    paint_sp = []
+    paint_color = []
+    paint_alpha = []
+    multi_sp = []
+    multi_color = []
+    multi_alpha = []
+    for (tidx, idx) in enumerate(touched.tolist()):
+        pidx = pattern_idx[tidx]
+        if pattern_info[pidx] is None:
+            pvalid = numpy.flatnonzero(sp_valid[:,tidx]).tolist()
+            pattern_info[pidx] = (
+                '+'.join([flist[f] + '#' + str(patterns[pidx,f]) for f in pvalid]),
+                '+'.join([flist[f] for f in numpy.flatnonzero(patterns[pidx,:])]),
+                pvalid,
+                )
+        (ftfl, spk, pvalid) = pattern_info[pidx]
+        stats['sp'][idx] = {f: fu[idx] for (f, fu) in sp_users if idx in fu}
+        if not spk in stats['feat']:
+            stats['feat'][spk] = []
+        stats['feat'][spk].append(idx)
+        if len(pvalid) < 1:
+            continue
+        if mix_colors and len(pvalid) > 1:
+            colors = [sp_mixed[tidx,:].tolist()]
+            alpha = [float(sp_malpha[tidx])]
+        else:
+            colors = fcols[pvalid,:].astype(numpy.int32).tolist()
+            alpha = sp_alpha[pvalid,tidx].tolist()
+        stats['featcols'][ftfl] = [colors, alpha]
+        if len(colors) == 1:
+            paint_sp.append(idx)
+            paint_color.append(colors[0])
+            paint_alpha.append(alpha[0])
+        else:
+            multi_sp.append(idx)
+            multi_color.append(colors)
+            multi_alpha.append(alpha)
+    if paint_sp:
+        imfunc.color_superpixels(image_data, paint_sp, spmap,
+            numpy.asarray(paint_color, dtype=numpy.float64),
+            numpy.asarray(paint_alpha, dtype=numpy.float64))
+    if multi_sp:
+        imfunc.color_superpixels(image_data, multi_sp, spmap,
+            multi_color, multi_alpha)
+
+    # feature information
+    featc = sorted([k for k in stats['feat'].keys()])
+    for feat in featc:
+        stats['featnum'][feat] = len(stats['feat'][feat])
+    featcols = dict()
+    fnum_p = re.compile(r'\#\d+')
+    for (f, fd) in stats['featcols'].items():
+        fr = fnum_p.sub('', f)
+        fda = sum(fd[1])
+        if not fr in featcols:
+            featcols[fr] = [fda, fd]
+        elif fda > featcols[fr][0]:
+            featcols[fr] = [fda, fd]
+    stats['featcols'] = dict()
+    for f in sorted(list(featcols.keys())):
+        stats['featcols'][f] = featcols[f][1]
+
+    return (image_data, stats)
+
+# image heatmap stats read back from JSON (superpixel keys as int)
+def _heatmap_stats_json(stats:dict) -> dict:
+    if isinstance(stats, dict) and isinstance(stats.get('sp', None), dict):
+        stats['sp'] = {int(k): v for (k, v) in stats['sp'].items()}
+    return stats
+
+# study annotation (features) journal: compact into (binary) file
+def _stann_compact(
+    stann_filename:str,
+    journal_file:object,
+    study_anno_data:dict,
+    ):
+    temp_filename = stann_filename + '.tmp'
+    _stann_save(temp_filename, study_anno_data)
+    os.replace(temp_filename, stann_filename)
+    if not journal_file is None:
+        journal_file.truncate(0)
+        journal_file.flush()
+
+# study annotation (features) journal: read (valid) records
+def _stann_journal_read(
+    journal_filename:str,
+    study_anno_data:dict,
+    ) -> Tuple[int, int]:
+
+    # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+    import json
+    import struct
+    import zlib
+    import numpy
+
+    with open(journal_filename, 'rb') as journal_file:
+        raw = journal_file.read()
+    hsize = struct.calcsize(_stann_journal_header)
+    records = 0
+    pos = 0
+    while (pos + hsize) <= len(raw):
+        (magic, hlen, dlen, crc) = struct.unpack_from(
+            _stann_journal_header, raw, pos)
+        if magic != _stann_journal_magic:
+            break
+        hpos = pos + hsize
+        dpos = hpos + hlen
+        end = dpos + dlen
+        if end > len(raw) or zlib.crc32(raw[hpos:end]) != crc:
+            break
+        header = json.loads(raw[hpos:dpos].decode('utf-8'))
+        annotation_id = header['id']
+        if not annotation_id in study_anno_data:
+            study_anno_data[annotation_id] = dict()
+        for (feature, num, tarea, tarea_pct, tarea_mpct) in header['features']:
+            fcont = {
+                'num': num,
+                'tarea': tarea,
+                'tarea_pct': tarea_pct,
+                'tarea_mpct': tarea_mpct,
+            }
+            for (key, dtype) in _stann_journal_arrays:
+                fcont[key] = numpy.frombuffer(raw, dtype=dtype,
+                    count=num, offset=dpos).copy()
+                dpos += 4 * num
+            if tarea is None:
+                fcont['area'] = None
+                fcont['area_pct'] = None
+                fcont['area_mpct'] = None
+            study_anno_data[annotation_id][feature] = fcont
+        records += 1
+        pos = end
+    return (records, pos)
+
+# study annotation (features) journal: append one annotation (record)
+def _stann_journal_write(
+    journal_file:object,
+    annotation_id:str,
+    features:dict,
+    ):
+
+    # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+    import json
+    import struct
+    import zlib
+    import numpy
+
+    records = []
+    blobs = []
+    for (feature, fcont) in features.items():
+        idx = numpy.asarray(fcont['idx'], dtype=numpy.int32)
+        num = idx.size
+        tarea = fcont.get('tarea', None)
+        records.append([feature, num, tarea,
+            fcont.get('tarea_pct', None), fcont.get('tarea_mpct', None)])
+        for (key, dtype) in _stann_journal_arrays:
+            if key == 'idx':
+                blobs.append(idx.tobytes())
+            elif fcont.get(key, None) is None or (
+                key.startswith('area') and tarea is None):
+                blobs.append(numpy.zeros(num, dtype=dtype).tobytes())
+            else:
+                blobs.append(numpy.asarray(fcont[key], dtype=dtype).tobytes())
+    payload = json.dumps({'id': annotation_id, 'features': records}).encode('utf-8')
+    hlen = len(payload)
+    payload += b''.join(blobs)
+    journal_file.write(struct.pack(_stann_journal_header, _stann_journal_magic,
+        hlen, len(payload) - hlen, zlib.crc32(payload)) + payload)
+    journal_file.flush()
+
+# study annotation (features) cache: load from (binary) file
+def _stann_load(stann_filename:str) -> dict:
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import json
+    import numpy
+
+    study_anno_data = dict()
+    with numpy.load(stann_filename, allow_pickle=False) as stann:
+        header = json.loads(str(stann['header']))
+        if header.get('version', None) != 1:
+            raise ValueError('Invalid study annotations file version.')
+        offsets = stann['offsets']
+        arrays = {k: stann[k] for k in
+            ['idx', 'lst', 'area', 'area_pct', 'area_mpct']}
+    for (ridx, record) in enumerate(header['records']):
+        (annotation_id, feature, tarea, tarea_pct, tarea_mpct) = record
+        (fo, to) = (offsets[ridx], offsets[ridx+1])
+        fcont = {
+            'idx': arrays['idx'][fo:to],
+            'lst': arrays['lst'][fo:to],
+            'num': int(to - fo),
+            'tarea': tarea,
+            'tarea_pct': tarea_pct,
+            'tarea_mpct': tarea_mpct,
+        }
+        if tarea is None:
+            fcont['area'] = None
+            fcont['area_pct'] = None
+            fcont['area_mpct'] = None
+        else:
+            fcont['area'] = arrays['area'][fo:to]
+            fcont['area_pct'] = arrays['area_pct'][fo:to]
+            fcont['area_mpct'] = arrays['area_mpct'][fo:to]
+        if not annotation_id in study_anno_data:
+            study_anno_data[annotation_id] = dict()
+        study_anno_data[annotation_id][feature] = fcont
+    return study_anno_data
+
+# study annotation (features) cache: save into (binary) file
+def _stann_save(stann_filename:str, study_anno_data:dict):
+
+    # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+    import json
+    import numpy
+
+    records = []
+    arrays = {k: [] for k in ['idx', 'lst', 'area', 'area_pct', 'area_mpct']}
+    offsets = [0]
+    for (annotation_id, features) in study_anno_data.items():
+        for (feature, fcont) in features.items():
+            idx = numpy.asarray(fcont['idx'], dtype=numpy.int32)
+            num = idx.size
+            tarea = fcont.get('tarea', None)
+            records.append([annotation_id, feature, tarea,
+                fcont.get('tarea_pct', None), fcont.get('tarea_mpct', None)])
+            arrays['idx'].append(idx)
+            arrays['lst'].append(numpy.asarray(fcont['lst'], dtype=numpy.float32))
+            for (key, dtype) in [('area', numpy.int32),
+                ('area_pct', numpy.float32), ('area_mpct', numpy.float32)]:
+                if tarea is None or fcont.get(key, None) is None:
+                    arrays[key].append(numpy.zeros(num, dtype=dtype))
+                else:
+                    arrays[key].append(numpy.asarray(fcont[key], dtype=dtype))
+            offsets.append(offsets[-1] + num)
+    header = {'version': 1, 'records': records}
+    out = {k: (numpy.concatenate(v) if v else numpy.zeros(0, dtype=numpy.int32))
+        for (k, v) in arrays.items()}
+    out['header'] = numpy.asarray(json.dumps(header))
+    out['offsets'] = numpy.asarray(offsets, dtype=numpy.int64)
+    with open(stann_filename, 'wb') as stann_file:
+        numpy.savez_compressed(stann_file, **out)
+
 class Study(object):
     """
     Study object. If the details are not filled in, only the `description`,
@@ -141,6 +527,9 @@ class Study(object):
         self._detail = False
         self._in_archive = False
         self._model_type = 'study'
+        self._annotation_index = None
+        self._markups = None
+        self._markups_selected = []
         self._obj_annotations = dict()
         self._obj_images = dict()
         # still needs timezone information!!
@@ -241,6 +630,442 @@ class Study(object):
             except:
                 warnings.warn('Error retrieving annotations.')
 
+    # compute feature areas, grouped by image (superpixels prefetched)
+    def _compute_areas(self,
+        to_areas:dict,
+        workers:int,
+        didwarn:list,
+        store:Callable = None,
+        ) -> set:
+
+        # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+
+        failed = set()
+        image_ids = list(to_areas.keys())
+        total = len(image_ids)
+        if total == 0:
+            return failed
+        workers = max(1, workers)
+
+        # superpixels (and segmentation mask) are loaded in threads
+        def load_image(image_id:str) -> object:
+            image_obj = to_areas[image_id][0]._image_obj
+            if image_obj is None:
+                image_obj = self._api.image(image_id)
+            image_obj.load_superpixels()
+            if image_obj.superpixels['idx'] is None:
+                raise ValueError('Error loading superpixels.')
+            try:
+                image_obj.load_segmentation()
+            except:
+                pass
+            return image_obj
+
+        # whereas the mapping and areas are computed in order
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            next_image = 0
+            for image_idx in range(total):
+                func.print_progress(image_idx, total, 'Computing areas:')
+                while next_image < total and len(pending) < workers:
+                    pending.append(executor.submit(load_image, image_ids[next_image]))
+                    next_image += 1
+                image_obj = None
+                image_error = ''
+                try:
+                    image_obj = pending.popleft().result()
+                except Exception as e:
+                    image_error = str(e)
+                for annotation_obj in to_areas[image_ids[image_idx]]:
+                    try:
+                        if image_obj is None:
+                            raise ValueError(image_error)
+                        annotation_obj._image_obj = image_obj
+                        annotation_obj.compute_areas()
+                        if not store is None:
+                            store(annotation_obj.id, {key: annotation_obj.features[key]
+                                for (key, val) in annotation_obj.markups.items() if val})
+                    except Exception as e:
+                        failed.add(annotation_obj.id)
+                        didwarn.append(
+                            'Error retrieving annotation {0:s} details: {1:s}'.format(
+                            annotation_obj.id, str(e)))
+                if not image_obj is None:
+                    try:
+                        image_obj.clear_data()
+                    except:
+                        pass
+        func.print_progress(total, total, 'Computing areas:')
+        return failed
+
+    # annotation index (image, user, feature -> annotation ids), features
+    # are re-indexed by the annotation objects whenever they (re-)load them
+    def _index_annotations(self) -> dict:
+
+        # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+        import itertools
+
+        index = self._annotation_index
+        objs = self._obj_annotations
+
+        # objects are only appended, so (with deletions) the last indexed
+        # object is no longer found at its position, requiring a rebuild
+        last_id = None
+        if not index is None and index['count'] > 0 and index['count'] <= len(objs):
+            last_id = next(itertools.islice(objs.keys(), index['count'] - 1, None))
+        if (index is None or not index['source'] is objs or
+            index['count'] > len(objs) or last_id != index['last']):
+            index = {
+                'a_features': dict(),
+                'count': 0,
+                'feature': dict(),
+                'image': dict(),
+                'last': None,
+                'pos': dict(),
+                'source': objs,
+                'user': dict(),
+            }
+            self._annotation_index = index
+        if index['count'] == len(objs):
+            return index
+
+        # only annotation objects added since the last call are indexed
+        for (a_id, a_obj) in itertools.islice(objs.items(), index['count'], None):
+            index['pos'][a_id] = index['count']
+            index['count'] += 1
+            for (field, value) in [
+                ('image', a_obj.image_id),
+                ('user', a_obj.user_id),
+                ]:
+                field_index = index[field]
+                if not value in field_index:
+                    field_index[value] = set()
+                field_index[value].add(a_id)
+            index['last'] = a_id
+            self._index_features(a_obj)
+            if not self._index_features in a_obj._feature_listeners:
+                a_obj._feature_listeners.append(self._index_features)
+        return index
+
+    # annotation index: (re-)index the features of one annotation object
+    def _index_features(self, a_obj:object):
+        index = self._annotation_index
+        a_id = a_obj.id
+        if (index is None or not a_id in index['pos'] or
+            not index['source'].get(a_id, None) is a_obj):
+            return
+        old_features = index['a_features'].get(a_id, set())
+        new_features = set(a_obj.features.keys())
+        field_index = index['feature']
+        for f in old_features - new_features:
+            field_index[f].discard(a_id)
+        for f in new_features - old_features:
+            field_index.setdefault(f, set()).add(a_id)
+        index['a_features'][a_id] = new_features
+
+    # annotation index lookup (union over values)
+    def _index_lookup(self, field:str, values:set) -> set:
+        field_index = self._annotation_index[field]
+        return set().union(*[field_index[v] for v in values if v in field_index])
+
+    # image heatmaps (pipelined: decoding threads, rendering processes, writing threads)
+    def _heatmap_pipeline(self,
+        images:list,
+        to_process:list,
+        load_image:Callable,
+        options:dict,
+        exem_options:dict,
+        resize_output:Union[int,Tuple],
+        stitch_image:Callable,
+        write_image:Callable,
+        stream_stats:Callable,
+        stream_file:object,
+        workers:int,
+        ):
+
+        # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        import multiprocessing
+
+        # rendering processes are spawned (forking after the parallel
+        # compiled functions were loaded leaves the process hanging at exit)
+        num_process = len(to_process)
+        with ThreadPoolExecutor(max_workers=workers) as loader, \
+            ProcessPoolExecutor(max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn')) as renderer, \
+            ThreadPoolExecutor(max_workers=max(1, workers // 2)) as writer:
+
+            # rendering is submitted from this (main) thread, as soon as loaded
+            # (images that failed to load raise their error when finished)
+            def submit_render(job:list):
+                loaded = job[1].result()
+                job[2] = renderer.submit(_heatmap_process,
+                    loaded.pop('inputs'), options, resize_output)
+                exem_inputs = loaded.pop('exem_inputs')
+                if not exem_inputs is None:
+                    job[3] = renderer.submit(_heatmap_process,
+                        exem_inputs, exem_options, resize_output)
+            def finish_write(write:tuple):
+                (future, idx, stats) = write
+                try:
+                    future.result()
+                    stream_stats(stream_file, idx, stats)
+                except Exception as e:
+                    warnings.warn('Error writing heatmap for {0:s}: {1:s}'.format(
+                        images[idx]['name'], str(e)))
+
+            # bounded number of images in flight between the stages
+            jobs = deque()
+            writes = deque()
+            next_job = 0
+            for pidx in range(num_process):
+                while next_job < num_process and len(jobs) < 2 * workers:
+                    jobs.append([to_process[next_job],
+                        loader.submit(load_image, to_process[next_job]), None, None])
+                    next_job += 1
+                for job in jobs:
+                    if (job[2] is None and job[1].done() and
+                        job[1].exception() is None):
+                        submit_render(job)
+                job = jobs.popleft()
+                idx = job[0]
+                image_name = images[idx]['name']
+                func.print_progress(pidx, num_process, 'Creating heatmaps:',
+                    image_name)
+                try:
+                    if job[2] is None:
+                        submit_render(job)
+                    (image_feats, stats) = job[2].result()
+                    image_exem = None
+                    if not job[3] is None:
+                        image_exem = job[3].result()[0]
+                    image_out = stitch_image(idx, job[1].result()['plain'],
+                        image_feats, stats, image_exem)
+                except Exception as e:
+                    warnings.warn('Error creating heatmap for {0:s}: {1:s}'.format(
+                        image_name, str(e)))
+                    continue
+                writes.append((writer.submit(write_image, image_out, idx),
+                    idx, stats))
+                while len(writes) > workers:
+                    finish_write(writes.popleft())
+            while writes:
+                finish_write(writes.popleft())
+
+    # image heatmap (inputs: image, mask, superpixels, and feature lists)
+    def _heatmap_inputs(self,
+        image_name:str,
+        annotation_status:Union[str,list] = 'ok',
+        features:Union[str,list] = 'all',
+        users:Union[str,list] = 'all',
+        seg_outline:bool = True,
+        reuse:dict = None,
+        ) -> dict:
+        if image_name is None or image_name == '':
+            return None
+        if isinstance(image_name, dict):
+            if '_id' in image_name:
+                image_name = image_name['_id']
+            else:
+                raise ValueError('Invalid image_name parameter.')
+        image_names = {v['name']: v['_id'] for v in self.images}
+        image_ids = {v['_id']: v for v in self.images}
+        if not func.could_be_mongo_object_id(image_name):
+            if not image_name in image_names:
+                raise KeyError('Image name not found in study.')
+            image_id = image_names[image_name]
+        else:
+            image_id = image_name
+        if not image_id in image_ids:
+            raise KeyError('Image ID not found in study.')
+        if isinstance(annotation_status, str):
+            annotation_status = [annotation_status]
+        elif not isinstance(annotation_status, list):
+            raise ValueError('Invalid annotation_status parameter.')
+        annotations = func.select_from(self.annotations, [
+            ['image._id', '==', image_id],
+            ['markups.%%', '~', ':'],
+            ['status', 'in', annotation_status]])
+        all_features = False
+        if isinstance(features, str):
+            if features == 'all':
+                all_features = True
+            elif features and features[0] == '~':
+                feature = features[1:].lower()
+                study_features = sorted([f['id'] for f in self.features])
+                features = []
+                for f in study_features:
+                    if feature in f.lower():
+                        features.append(f)
+                if not features:
+                    raise ValueError('Feature not found.')
+            else:
+                features = [features]
+        if isinstance(features, list):
+            if not all_features:
+                flist = '(' + '|'.join(features) + ')'
+                annotations = func.select_from(annotations,
+                    [['markups.%%', '~', flist]])
+        elif not features is None:
+            if not (isinstance(features, str) and features == 'all'):
+                raise ValueError('Invalid feature selection.')
+        if not users is None and (isinstance(users, list) or users != 'all'):
+            if isinstance(users, str):
+                users = [users]
+            elif not isinstance(users, list):
+                raise ValueError('Invalid users list.')
+            usel = []
+            for user in users:
+                for tuser in self.users:
+                    if (tuser['_id'] == user or
+                        (tuser['firstName'] + ' ' + tuser['lastName']) == user or
+                        tuser['lastName'] == user or
+                        tuser['login'] == user or
+                        tuser['name'] == user or
+                        (len(tuser['name']) > 5 and tuser['name'][5:] == user)):
+                        usel.append(tuser['_id'])
+            if len(usel) == 0:
+                warnings.warn('No valid users found.')
+                return None
+            annotations = func.select_from(annotations,
+                [['user._id', 'in', usel]])
+        a_objs = dict()
+        for a in annotations:
+            if a['_id'] in self._obj_annotations:
+                a_o = self._obj_annotations[a['_id']]
+            else:
+                a_o = self._api.annotation(a['_id'])
+                self._obj_annotations[a['_id']] = a_o
+            a_objs[a['_id']] = a_o
+            a_o.load_data()
+        fdict = dict()
+        spdict = dict()
+        udict = dict()
+        for a in annotations:
+            if all_features:
+                for (f, v) in a['markups'].items():
+                    if not v:
+                        continue
+                    elif f in fdict:
+                        fdict[f].append(a['_id'])
+                    else:
+                        fdict[f] = [a['_id']]
+                    if not a['user']['_id'] in udict:
+                        udict[a['user']['_id']] = a['user']
+            else:
+                for f in features:
+                    if not f in a['markups']:
+                        continue
+                    elif not a['markups'][f]:
+                        continue
+                    elif f in fdict:
+                        fdict[f].append(a['_id'])
+                    else:
+                        fdict[f] = [a['_id']]
+                    if not a['user']['_id'] in udict:
+                        udict[a['user']['_id']] = True
+        inputs = {
+            'features': {f: [(a_objs[a].user_id, a_objs[a].features[f]['idx'])
+                for a in fdict[f]] for f in fdict.keys()},
+            'fcols': {f: self._api.feature_color(f) for f in fdict.keys()},
+            'image': None,
+            'mask': None,
+            'spidx': None,
+            'users': udict,
+        }
+        if not reuse is None:
+            for key in ['image', 'mask', 'spidx']:
+                inputs[key] = reuse[key]
+            return inputs
+        try:
+            if image_id in self._obj_images:
+                image = self._obj_images[image_id]
+            else:
+                image = self._api.image(image_id)
+            image.load_image_data()
+            inputs['image'] = image.data
+            if seg_outline:
+                try:
+                    seg_obj = self._api.segmentation(image_id)
+                    seg_obj.load_mask_data()
+                    inputs['mask'] = seg_obj.mask
+                    seg_obj.clear_data()
+                except:
+                    try:
+                        seg_obj.clear_data()
+                    except:
+                        pass
+                    pass
+            image.load_superpixels()
+            inputs['spidx'] = image.superpixels['idx']
+            if inputs['spidx'] is None:
+                raise ValueError('Error loading superpixels.')
+        finally:
+            try:
+                image.clear_data()
+            except:
+                pass
+        return inputs
+
+    # prefetch (concurrently) and store feature lists not yet in the cache
+    def _prefetch_features(self,
+        study_anno_data:dict,
+        workers:int,
+        store:Callable,
+        ) -> int:
+
+        # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+        from concurrent.futures import ThreadPoolExecutor
+
+        to_fetch = []
+        for annotation in self.annotations:
+            annotation_id = annotation['_id']
+            if annotation_id in self._obj_annotations:
+                continue
+            if not 'state' in annotation or annotation['state'] != 'complete':
+                continue
+            if not isinstance(annotation.get('markups', None), dict):
+                continue
+            if annotation_id in study_anno_data:
+                cached = study_anno_data[annotation_id]
+            else:
+                cached = dict()
+            for (key, value) in annotation['markups'].items():
+                if not value:
+                    continue
+                if (key in cached and isinstance(cached[key], dict) and
+                    'idx' in cached[key] and len(cached[key]['idx']) > 0):
+                    continue
+                to_fetch.append((annotation_id, key))
+        total = len(to_fetch)
+        if total == 0:
+            return 0
+
+        # requests for which this fails are retried by Annotation.load_data
+        def fetch_feature(annotation_id:str, key:str) -> dict:
+            feat_lst = self._api.get('annotation/' + annotation_id +
+                '/' + func.uri_encode(key), parse_json=False)
+            if not feat_lst.ok:
+                raise ValueError('Error loading feature ' + key)
+            return _feature_from_list(feat_lst.json())
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(fetch_feature, annotation_id, key)
+                for (annotation_id, key) in to_fetch]
+            fetched = 0
+            for (idx, future) in enumerate(futures):
+                func.print_progress(idx, total, 'Fetching features:')
+                (annotation_id, key) = to_fetch[idx]
+                try:
+                    store(annotation_id, {key: future.result()})
+                    fetched += 1
+                except:
+                    pass
+        func.print_progress(total, total, 'Fetching features:')
+        return fetched
+
     # JSON
     def __repr__(self):
         return 'isicarchive.study.Study(from_json=%s)' % (self.as_json())
@@ -271,6 +1096,33 @@ class Study(object):
                 json_dumps(getattr(self, field))))
         return '{' + ', '.join(json_list) + '}'
 
+    # markups views (of the current selection, built on first access)
+    @property
+    def markups(self) -> dict:
+        if self._markups is None:
+            markups = {'image.user.feature': dict()}
+            for (img, user, fkey, fdet) in self._markups_selected:
+                for (k1, k2, k3) in [
+                    (fkey, img, user),
+                    (fkey, user, img),
+                    (img, fkey, user),
+                    (img, user, fkey),
+                    (user, fkey, img),
+                    (user, img, fkey),
+                    ]:
+                    if not k1 in markups:
+                        markups[k1] = dict()
+                    if not k2 in markups[k1]:
+                        markups[k1][k2] = dict()
+                    markups[k1][k2][k3] = fdet
+                markups['image.user.feature'][img + '.' + user + '.' + fkey] = fdet
+            self._markups = markups
+        return self._markups
+    @markups.setter
+    def markups(self, markups:dict):
+        self._markups = markups
+        self._markups_selected = []
+
     # get annotation
     def annotation(self, object_id:str):
         if not self._api:
@@ -302,7 +1154,8 @@ class Study(object):
             raise
         for key, value in annotation_obj.features.items():
             try:
-                if isinstance(value, dict) and ('lst' in value) and value['lst']:
+                if isinstance(value, dict) and ('lst' in value) and (
+                    len(value['lst']) > 0):
                     if not key in self.loaded_features:
                         self.loaded_features[key] = 0
                     self.loaded_features[key] += 1
@@ -456,257 +1309,19 @@ class Study(object):
         ) -> Any:
 
         # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
-        import numpy
-        from . import imfunc
         from .sampler import Sampler
         smp = Sampler()
 
-        if mix_colors is None:
-            mix_colors = True
-        if alpha_scale is None:
-            alpha_scale = 'sqrt'
-        if underlay_gray is None:
-            underlay_gray = 0.75
         if seg_outline is None:
             seg_outline = True
         self.load_annotations()
-        if image_name is None or image_name == '':
+        inputs = self._heatmap_inputs(image_name, annotation_status,
+            features, users, seg_outline)
+        if inputs is None:
             return None
-        if isinstance(image_name, dict):
-            if '_id' in image_name:
-                image_name = image_name['_id']
-            else:
-                raise ValueError('Invalid image_name parameter.')
-        image_names = {v['name']: v['_id'] for v in self.images}
-        image_ids = {v['_id']: v for v in self.images}
-        if not func.could_be_mongo_object_id(image_name):
-            if not image_name in image_names:
-                raise KeyError('Image name not found in study.')
-            image_id = image_names[image_name]
-        else:
-            image_id = image_name
-        if not image_id in image_ids:
-            raise KeyError('Image ID not found in study.')
-        try:
-            if image_id in self._obj_images:
-                image = self._obj_images[image_id]
-            else:
-                image = self._api.image(image_id)
-            image.load_image_data()
-            image_data = image.data
-            im_shape = image_data.shape
-            if underlay_gray > 0.0:
-                if underlay_gray >= 1.0:
-                    image_data = imfunc.image_gray(image_data)
-                else:
-                    image_data = imfunc.image_mix(image_data,
-                        imfunc.image_gray(image_data), underlay_gray)
-            if seg_outline:
-                try:
-                    seg_obj = self._api.segmentation(image_id)
-                    seg_obj.load_mask_data()
-                    seg_outline = imfunc.segmentation_outline(seg_obj.mask, 'coords')
-                    seg_outline = seg_outline[:,1] + seg_obj.mask.shape[1] * seg_outline[:,0]
-                    seg_obj.clear_data()
-                    if len(im_shape) == 3:
-                        planes = im_shape[2]
-                    else:
-                        planes = 1
-                    im_rshape = (im_shape[0] * im_shape[1], planes, )
-                    image_data.shape = im_rshape
-                    for pc in range(planes):
-                        image_data[seg_outline, pc] = 0
-                    image_data.shape = im_shape
-                except:
-                    try:
-                        seg_obj.clear_data()
-                    except:
-                        pass
-                    pass
-            image.load_superpixels()
-            image.map_superpixels()
-            spmap = image.superpixels['map']
-        except:
-            try:
-                image.clear_data()
-            except:
-                pass
-            raise
-        if isinstance(annotation_status, str):
-            annotation_status = [annotation_status]
-        elif not isinstance(annotation_status, list):
-            raise ValueError('Invalid annotation_status parameter.')
-        annotations = func.select_from(self.annotations, [
-            ['image._id', '==', image_id],
-            ['markups.%%', '~', ':'],
-            ['status', 'in', annotation_status]])
-        all_features = False
-        if isinstance(features, str):
-            if features == 'all':
-                all_features = True
-            elif features and features[0] == '~':
-                feature = features[1:].lower()
-                study_features = sorted([f['id'] for f in self.features])
-                features = []
-                for f in study_features:
-                    if feature in f.lower():
-                        features.append(f)
-                if not features:
-                    raise ValueError('Feature not found.')
-            else:
-                features = [features]
-        if isinstance(features, list):
-            if not all_features:
-                flist = '(' + '|'.join(features) + ')'
-                annotations = func.select_from(annotations,
-                    [['markups.%%', '~', flist]])
-        elif not features is None:
-            if not (isinstance(features, str) and features == 'all'):
-                raise ValueError('Invalid feature selection.')
-        if not users is None and (isinstance(users, list) or users != 'all'):
-            if isinstance(users, str):
-                users = [users]
-            elif not isinstance(users, list):
-                raise ValueError('Invalid users list.')
-            usel = []
-            for user in users:
-                for tuser in self.users:
-                    if (tuser['_id'] == user or
-                        (tuser['firstName'] + ' ' + tuser['lastName']) == user or
-                        tuser['lastName'] == user or
-                        tuser['login'] == user or
-                        tuser['name'] == user or
-                        (len(tuser['name']) > 5 and tuser['name'][5:] == user)):
-                        usel.append(tuser['_id'])
-            if len(usel) == 0:
-                warnings.warn('No valid users found.')
-                image.clear_data()
-                return None
-            annotations = func.select_from(annotations,
-                [['user._id', 'in', usel]])
-        a_objs = dict()
-        for a in annotations:
-            if a['_id'] in self._obj_annotations:
-                a_o = self._obj_annotations[a['_id']]
-            else:
-                a_o = self._api.annotation(a['_id'])
-                self._obj_annotations[a['_id']] = a_o
-            a_objs[a['_id']] = a_o
-            a_o.load_data()
-        fdict = dict()
-        spdict = dict()
-        udict = dict()
-        for a in annotations:
-            if all_features:
-                for (f, v) in a['markups'].items():
-                    if not v:
-                        continue
-                    elif f in fdict:
-                        fdict[f].append(a['_id'])
-                    else:
-                        fdict[f] = [a['_id']]
-                    if not a['user']['_id'] in udict:
-                        udict[a['user']['_id']] = a['user']
-            else:
-                for f in features:
-                    if not f in a['markups']:
-                        continue
-                    elif not a['markups'][f]:
-                        continue
-                    elif f in fdict:
-                        fdict[f].append(a['_id'])
-                    else:
-                        fdict[f] = [a['_id']]
-                    if not a['user']['_id'] in udict:
-                        udict[a['user']['_id']] = True
-        flist = list(fdict.keys())
-        fcols = dict()
-        for f in flist:
-            fcols[f] = self._api.feature_color(f)
-            for a in fdict[f]:
-                a_o = a_objs[a]
-                f_detail = a_o.features[f]
-                for idx in f_detail['idx']:
-                    if not idx in spdict:
-                        spdict[idx] = []
-                    spdict[idx].append([a, f, a_o.user_id])
-        if max_raters is None or max_raters <= 0:
-            max_raters = len(udict)
-        max_raters = float(max_raters)
-        stats = {
-            'feat': dict(),
-            'featcols': dict(),
-            'featnum': dict(),
-            'sp': dict(),
-            'users': udict,
-        }
-        for [idx, fs] in spdict.items():
-            ft = dict()
-            ftl = []
-            spstats = dict()
-            for f in fs:
-                if f[1] in ft:
-                    ft[f[1]].append(f[2])
-                else:
-                    ftl.append(f[1])
-                    ft[f[1]] = [f[2]]
-            ftl = sorted(ftl)
-            colors = []
-            alpha = []
-            ftfl = []
-            for f in ftl:
-                fa = ft[f]
-                spstats[f] = fa
-                if not min_raters is None and len(fa) < min_raters:
-                    continue
-                ftfl.append(f + '#' + str(len(fa)))
-                colors.append(fcols[f])
-                av = float(len(fa)) / max_raters
-                if alpha_scale == 'sqrt':
-                    av = numpy.sqrt(av)
-                alpha.append(av)
-            ftfl = '+'.join(ftfl)
-            r = 0.0
-            g = 0.0
-            b = 0.0
-            a = 0.0
-            for (c, av) in zip(colors, alpha):
-                r += av * float(c[0])
-                g += av * float(c[1])
-                b += av * float(c[2])
-                a += av
-            mix_color = [[int(r / a), int(g / a), int(b / a)]]
-            mix_alpha = [a / float(len(alpha))]
-            if mix_colors and len(colors) > 1:
-                colors = mix_color
-                alpha = mix_alpha
-            stats['featcols'][ftfl] = [colors, alpha]
-            stats['sp'][idx] = spstats
-            spk = '+'.join(sorted(list(spstats.keys())))
-            if not spk in stats['feat']:
-                stats['feat'][spk] = []
-            stats['feat'][spk].append(idx)
-            if len(colors) < 1:
-                continue
-            imfunc.color_superpixels(image_data, [idx], spmap, [colors], [alpha])
-        image.clear_data()
-
-        # feature information
-        featc = sorted([k for k in stats['feat'].keys()])
-        for feat in featc:
-            stats['featnum'][feat] = len(stats['feat'][feat])
-        featcols = dict()
-        fnum_p = re.compile(r'\#\d+')
-        for (f, fd) in stats['featcols'].items():
-            fr = fnum_p.sub('', f)
-            fda = sum(fd[1])
-            if not fr in featcols:
-                featcols[fr] = [fda, fd]
-            elif fda > featcols[fr][0]:
-                featcols[fr] = [fda, fd]
-        stats['featcols'] = dict()
-        for f in sorted(list(featcols.keys())):
-            stats['featcols'][f] = featcols[f][1]
+        im_shape = inputs['image'].shape
+        (image_data, stats) = _heatmap_render(inputs, _heatmap_options(
+            max_raters, min_raters, mix_colors, alpha_scale, underlay_gray))
 
         # resize image
         if isinstance(resize_output, tuple):
@@ -764,9 +1379,12 @@ class Study(object):
         resize_output:Union[int,Tuple] = 1024,
         legend_position:str = 'northwest',
         single_colors:bool = False,
+        workers:int = 0,
+        resume:bool = False,
         ):
 
         # IMPORTS DONE HERE TO SAVE TIME ON MODULE INIT
+        import json
         import numpy
         from . import imfunc
         from .sampler import Sampler
@@ -814,93 +1432,161 @@ class Study(object):
             leg_patch_size = (int(0.8 * font_size), int(1.25 * font_size))
         except:
             leg_patch_size = (32, 48)
+        if seg_outline is None:
+            seg_outline = True
+        options = _heatmap_options(max_raters, min_raters, mix_colors,
+            alpha_scale, underlay_gray)
+        exem_options = _heatmap_options(None, None, mix_colors,
+            alpha_scale, underlay_gray)
+        self.load_annotations()
+
+        # per-image stats are streamed (and re-read when resuming)
+        stats_filename = target_folder + 'heatmap_stats.json.gz'
+        stream_filename = target_folder + 'heatmap_stats.jsonl'
+        if resume:
+            if os.path.exists(stats_filename):
+                try:
+                    all_stats.update({name: _heatmap_stats_json(stats) for
+                        (name, stats) in func.gzip_load_var(stats_filename).items()})
+                except Exception as e:
+                    warnings.warn('Error reading heatmap stats: ' + str(e))
+            if os.path.exists(stream_filename):
+                with open(stream_filename, 'r') as stream_file:
+                    for line in stream_file:
+                        try:
+                            line = json.loads(line)
+                            all_stats[line['name']] = _heatmap_stats_json(line['stats'])
+                        except:
+                            break
+        elif os.path.exists(stream_filename):
+            os.remove(stream_filename)
+        to_process = []
         for (idx, image) in enumerate(images):
-            func.print_progress(idx, num_images, 'Creating heatmaps:', image['name'])
-            try:
-                image_obj = self._api.image(image['_id'])
-                image_obj.load_image_data()
-                image_plain = image_obj.data
-                if image_plain.ndim < 3:
-                    im_shape = image_plain.shape
-                    image_plain = numpy.repeat(image_plain.reshape(
-                        (im_shape[0], im_shape[1], 1,)), 3, axis=2)
-                else:
-                    image_plain = image_plain[:,:,0:3]
-                if not resize_output is None:
-                    image_plain = smp.sample_grid(image_plain, resize_output,
-                        out_type = 'uint8')
-                q_shape = image_plain.shape
-                half_y = q_shape[0]
-                full_y = half_y * 2
-                half_x = q_shape[1]
-                full_x = half_x * 2
-                (image_feats, stats) = self.image_heatmap(image['_id'],
-                    features=features, users=users, max_raters=max_raters,
-                    min_raters=min_raters, mix_colors=mix_colors,
-                    alpha_scale=alpha_scale, underlay_gray=underlay_gray,
-                    seg_outline=seg_outline)
-                if not resize_output is None:
-                    image_feats = smp.sample_grid(image_feats, resize_output,
-                        out_type = 'uint8')
-                if exemplar_features and exemplar_features[idx]:
-                    image_exem = self.image_heatmap(image['_id'],
-                    features=exemplar_features[idx], users=users,
-                    mix_colors=mix_colors, alpha_scale=alpha_scale,
-                    underlay_gray=underlay_gray, seg_outline=seg_outline)[0]
-                    if not resize_output is None:
-                        image_exem = smp.sample_grid(image_exem, resize_output,
-                            out_type = 'uint8')
-                else:
-                    image_exem = numpy.asarray([255,255,255],
-                        dtype=numpy.uint8).reshape((1,1,3,))
-                
-                # legend
-                stat_cols = stats['featcols']
-                flabels = list(stat_cols.keys())
-                fcolors = [stat_cols[label][0] for label in flabels]
-                falphas = [stat_cols[label][1] for label in flabels]
-                image_leg_text = self._api.feature_legend(flabels, fcolors,
-                    falphas, fsize=font_size, patch_size=leg_patch_size,
-                    single_colors=single_colors)
+            if (image['name'] in all_stats and os.path.exists(
+                target_folder + image['name'] + image_ext)):
+                continue
+            to_process.append(idx)
+        num_process = len(to_process)
+
+        # stage 1: decode image, prepare heatmap inputs
+        def load_image(idx:int) -> dict:
+            image = images[idx]
+            inputs = self._heatmap_inputs(image['_id'], 'ok', features,
+                users, seg_outline)
+            image_plain = inputs['image']
+            if image_plain.ndim < 3:
+                im_shape = image_plain.shape
+                image_plain = numpy.repeat(image_plain.reshape(
+                    (im_shape[0], im_shape[1], 1,)), 3, axis=2)
+            else:
+                image_plain = image_plain[:,:,0:3]
+            if not resize_output is None:
+                image_plain = smp.sample_grid(image_plain, resize_output,
+                    out_type = 'uint8')
+            else:
+                image_plain = image_plain.copy()
+            exem_inputs = None
+            if exemplar_features and exemplar_features[idx]:
+                exem_inputs = self._heatmap_inputs(image['_id'], 'ok',
+                    exemplar_features[idx], users, seg_outline, reuse=inputs)
+            return {
+                'exem_inputs': exem_inputs,
+                'idx': idx,
+                'inputs': inputs,
+                'plain': image_plain,
+            }
+
+        # stage 3: legend and stitching (encoding and writing in a thread)
+        def stitch_image(idx:int, image_plain:Any, image_feats:Any,
+            stats:dict, image_exem:Any) -> Any:
+            if image_exem is None:
+                image_exem = numpy.asarray([255,255,255],
+                    dtype=numpy.uint8).reshape((1,1,3,))
+            q_shape = image_plain.shape
+            half_y = q_shape[0]
+            full_y = half_y * 2
+            half_x = q_shape[1]
+            full_x = half_x * 2
+            stat_cols = stats['featcols']
+            flabels = list(stat_cols.keys())
+            fcolors = [stat_cols[label][0] for label in flabels]
+            falphas = [stat_cols[label][1] for label in flabels]
+            image_leg_text = self._api.feature_legend(flabels, fcolors,
+                falphas, fsize=font_size, patch_size=leg_patch_size,
+                single_colors=single_colors)
+            leg_shape = image_leg_text.shape
+            if leg_shape[0] > q_shape[0] or leg_shape[1] > q_shape[1]:
+                rs_factor = min(float(q_shape[0]) / float(leg_shape[0]),
+                    float(q_shape[1]) / float(leg_shape[1]))
+                image_leg_text = smp.sample_grid(image_leg_text, rs_factor,
+                    out_type = 'uint8')
                 leg_shape = image_leg_text.shape
-                if leg_shape[0] > q_shape[0] or leg_shape[1] > q_shape[1]:
-                    rs_factor = min(float(q_shape[0]) / float(leg_shape[0]),
-                        float(q_shape[1]) / float(leg_shape[1]))
-                    image_leg_text = smp.sample_grid(image_leg_text, rs_factor,
-                        out_type = 'uint8')
-                    leg_shape = image_leg_text.shape
-                if (isinstance(legend_position, str) and legend_position.lower() in
-                    ['ne', 'northeast', 'nw', 'northwest', 'se', 'southeast', 'sw', 'southwest']):
-                    lp = legend_position.lower()
-                    if len(lp) > 2:
-                        lp = lp[0] + lp[5]
-                else:
-                    lp = 'se'
-                lfromy = 0
-                lfromx = 0
-                if lp[0] == 's':
-                    lfromy = q_shape[0] - leg_shape[0]
-                if lp[1] == 'e':
-                    lfromx = q_shape[1] - leg_shape[1]
-                ltoy = lfromy + leg_shape[0]
-                ltox = lfromx + leg_shape[1]
-                
-                # stitch images together
-                image_out = numpy.zeros(full_x * full_y * 3, dtype=numpy.uint8).reshape(
-                    (full_y, full_x, 3,))
-                image_out[:,:,:] = 255
-                image_out[0:half_y, 0:half_x, :] = image_feats
-                image_out[half_y:, 0:half_x, :] = image_plain
-                image_out[lfromy:ltoy, half_x+lfromx:half_x+ltox, :] = image_leg_text
-                image_out[half_y:, half_x:, :] = image_exem
-                    
-                imfunc.write_image(image_out, target_folder + image['name'] + image_ext)
-                all_stats[image['name']] = stats
-            except:
-                func.print_progress(num_images, num_images, 'Error')
-                raise
-        func.print_progress(num_images, num_images, 'Creating heatmaps:')
-        func.gzip_save_var(target_folder + 'heatmap_stats.json.gz', all_stats)
+            if (isinstance(legend_position, str) and legend_position.lower() in
+                ['ne', 'northeast', 'nw', 'northwest', 'se', 'southeast', 'sw', 'southwest']):
+                lp = legend_position.lower()
+                if len(lp) > 2:
+                    lp = lp[0] + lp[5]
+            else:
+                lp = 'se'
+            lfromy = 0
+            lfromx = 0
+            if lp[0] == 's':
+                lfromy = q_shape[0] - leg_shape[0]
+            if lp[1] == 'e':
+                lfromx = q_shape[1] - leg_shape[1]
+            ltoy = lfromy + leg_shape[0]
+            ltox = lfromx + leg_shape[1]
+            image_out = numpy.zeros(full_x * full_y * 3, dtype=numpy.uint8).reshape(
+                (full_y, full_x, 3,))
+            image_out[:,:,:] = 255
+            image_out[0:half_y, 0:half_x, :] = image_feats
+            image_out[half_y:, 0:half_x, :] = image_plain
+            image_out[lfromy:ltoy, half_x+lfromx:half_x+ltox, :] = image_leg_text
+            image_out[half_y:, half_x:, :] = image_exem
+            return image_out
+        def write_image(image_out:Any, idx:int):
+            image_filename = target_folder + images[idx]['name'] + image_ext
+            imfunc.write_image(image_out, image_filename + '.tmp' + image_ext)
+            os.replace(image_filename + '.tmp' + image_ext, image_filename)
+        def stream_stats(stream_file:object, idx:int, stats:dict):
+            all_stats[images[idx]['name']] = stats
+            stream_file.write(json.dumps(
+                {'name': images[idx]['name'], 'stats': stats}) + '\n')
+            stream_file.flush()
+
+        # serial processing
+        stream_file = open(stream_filename, 'a')
+        try:
+            if workers <= 0:
+                for (pidx, idx) in enumerate(to_process):
+                    image = images[idx]
+                    func.print_progress(pidx, num_process,
+                        'Creating heatmaps:', image['name'])
+                    try:
+                        loaded = load_image(idx)
+                        (image_feats, stats) = _heatmap_process(
+                            loaded['inputs'], options, resize_output)
+                        image_exem = None
+                        if not loaded['exem_inputs'] is None:
+                            image_exem = _heatmap_process(loaded['exem_inputs'],
+                                exem_options, resize_output)[0]
+                        write_image(stitch_image(idx, loaded['plain'],
+                            image_feats, stats, image_exem), idx)
+                        stream_stats(stream_file, idx, stats)
+                    except:
+                        func.print_progress(num_process, num_process, 'Error')
+                        raise
+
+            # pipelined processing (threads -> processes -> threads)
+            else:
+                self._heatmap_pipeline(images, to_process, load_image, options,
+                    exem_options, resize_output, stitch_image, write_image,
+                    stream_stats, stream_file, workers)
+        finally:
+            stream_file.close()
+        func.print_progress(num_process, num_process, 'Creating heatmaps:')
+        func.gzip_save_var(stats_filename, all_stats)
+        os.remove(stream_filename)
         self.heatmap_stats = all_stats
         return all_stats
 
@@ -911,36 +1597,100 @@ class Study(object):
     # load annotations
     def load_annotations(self,
         save_failed:bool = False,
+        workers:int = 8,
+        compact_every:int = 2000,
         ):
         if (not self._api) or len(self._obj_annotations) == len(self.annotations):
             return
         study_anno_filename = self._api.cache_filename(self.id,
+            'stann', '.npz')
+        study_anno_journal = self._api.cache_filename(self.id,
+            'stann', '.jnl')
+        study_anno_jsonname = self._api.cache_filename(self.id,
             'stann', '.json.gz')
         study_anno_data = dict()
+        compact = False
         if self._api._cache_folder and os.path.exists(study_anno_filename):
             try:
-                study_anno_data = func.gzip_load_var(study_anno_filename)
+                study_anno_data = _stann_load(study_anno_filename)
             except Exception as e:
                 os.remove(study_anno_filename)
                 warnings.warn('Error reading study annotations file: ' + str(e))
+        elif self._api._cache_folder and os.path.exists(study_anno_jsonname):
+            try:
+                study_anno_data = func.gzip_load_var(study_anno_jsonname)
+                for features in study_anno_data.values():
+                    for fcont in features.values():
+                        _feature_arrays(fcont)
+                compact = True
+            except Exception as e:
+                os.remove(study_anno_jsonname)
+                warnings.warn('Error reading study annotations file: ' + str(e))
+
+        # replay the journal (features stored since the last compaction)
+        journal_file = None
+        journal_records = 0
+        journal_size = 0
+        if self._api._cache_folder and os.path.exists(study_anno_journal):
+            try:
+                (journal_records, journal_size) = _stann_journal_read(
+                    study_anno_journal, study_anno_data)
+            except Exception as e:
+                warnings.warn('Error reading study annotations journal: ' + str(e))
+        if self._api._cache_folder:
+            try:
+                journal_file = open(study_anno_journal, 'ab')
+                journal_file.truncate(journal_size)
+            except Exception as e:
+                journal_file = None
+                warnings.warn('Error opening study annotations journal: ' + str(e))
+
+        # store features (in memory and journal) as soon as available
+        def store_features(annotation_id:str, features:dict):
+            nonlocal journal_file, journal_records
+            if not annotation_id in study_anno_data:
+                study_anno_data[annotation_id] = dict()
+            study_anno_data[annotation_id].update(features)
+            if journal_file is None:
+                return
+            try:
+                _stann_journal_write(journal_file, annotation_id, features)
+                journal_records += 1
+                if journal_records >= compact_every:
+                    _stann_compact(study_anno_filename, journal_file,
+                        study_anno_data)
+                    journal_records = 0
+            except Exception as e:
+                warnings.warn('Error writing study annotations journal: ' + str(e))
+                journal_file.close()
+                journal_file = None
+
         didwarn = []
-        total = len(self.annotations)
-        for idx in range(total):
-            func.print_progress(idx, total, 'Loading annotations:')
-            annotation = self.annotations[idx]
-            annotation_id = annotation['_id']
-            if 'state' in annotation:
-                annotation_state = annotation['state']
-            else:
-                annotation_state = 'active'
-            if 'status' in annotation:
-                annotation_status = annotation['status']
-            else:
-                annotation_status = 'missing'
-            if not annotation_id in self._obj_annotations:
+        try:
+
+            # prefetch missing feature lists (concurrently)
+            self._prefetch_features(study_anno_data, workers, store_features)
+
+            # create annotation objects (with features already available)
+            to_areas = dict()
+            total = len(self.annotations)
+            for idx in range(total):
+                func.print_progress(idx, total, 'Loading annotations:')
+                annotation = self.annotations[idx]
+                annotation_id = annotation['_id']
+                if 'state' in annotation:
+                    annotation_state = annotation['state']
+                else:
+                    annotation_state = 'active'
+                if 'status' in annotation:
+                    annotation_status = annotation['status']
+                else:
+                    annotation_status = 'missing'
+                if annotation_id in self._obj_annotations:
+                    continue
                 if annotation_id in study_anno_data:
                     annotation = copy.copy(annotation)
-                    annotation['features'] = study_anno_data[annotation_id]
+                    annotation['features'] = copy.copy(study_anno_data[annotation_id])
                 try:
                     self.annotation(annotation)
                     if annotation_state != 'complete':
@@ -950,33 +1700,33 @@ class Study(object):
                     if (not save_failed) and annotation_status != 'ok':
                         continue
                     annotation_obj = self._obj_annotations[annotation_id]
-                    try:
-                        features = list(annotation_obj.features.values())
-                        if any([f['tarea'] is None for f in features]):
-                            annotation_obj.compute_areas()
-                    except:
-                        raise
-                    try:
-                        annotation_obj._image_obj.clear_data()
-                    except:
-                        pass
-                    annotation_features = annotation_obj.features
-                    for key, val in annotation_obj.markups.items():
-                        if not val:
-                            continue
-                        if not annotation_id in study_anno_data:
-                            study_anno_data[annotation_id] = dict()
-                        study_anno_data[annotation_id][key] = annotation_features[key]
+                    features = list(annotation_obj.features.values())
+                    if any([f['tarea'] is None for f in features]):
+                        if not annotation_obj.image_id in to_areas:
+                            to_areas[annotation_obj.image_id] = []
+                        to_areas[annotation_obj.image_id].append(annotation_obj)
                 except Exception as e:
                     didwarn.append('Error retrieving annotation {0:s} details: {1:s}'.format(
                         annotation['_id'], str(e)))
-        func.print_progress(total, total, 'Loading annotations:')
+            func.print_progress(total, total, 'Loading annotations:')
+
+            # compute areas (superpixels loaded once per image, prefetched)
+            self._compute_areas(to_areas, workers, didwarn, store_features)
+
+        # compact the journal into the (binary) file
+        finally:
+            if not journal_file is None:
+                try:
+                    if journal_records > 0 or compact:
+                        _stann_compact(study_anno_filename, journal_file,
+                            study_anno_data)
+                        if os.path.exists(study_anno_jsonname):
+                            os.remove(study_anno_jsonname)
+                except Exception as e:
+                    warnings.warn('Error writing study annotations file: ' + str(e))
+                journal_file.close()
         if didwarn:
             warnings.warn('Problems retrieving {0:d} annotations.'.format(len(didwarn)))
-        if self._api._cache_folder and len(study_anno_data) > 0:
-            if os.path.exists(study_anno_filename):
-                os.remove(study_anno_filename)
-            func.gzip_save_var(study_anno_filename, study_anno_data)
         self.select_annotations()
 
     # load images
@@ -1374,6 +2124,10 @@ class Study(object):
         user_completion:int = 0,
         superpixels:Union[str,int,list] = 'all',
         ):
+
+        # IMPORT DONE HERE TO SAVE TIME AT MODULE INIT
+        import numpy
+
         if isinstance(annotation_state, str):
             annotation_state = set([annotation_state])
         elif not isinstance(annotation_state, list):
@@ -1400,47 +2154,52 @@ class Study(object):
                 features.remove(f)
         if isinstance(images, str):
             if images == 'all':
-                images = sorted(list(set([a['image']['_id'] for a in self.annotations])))
+                images = None
             else:
                 images = [images]
         elif not isinstance(images, list):
             raise ValueError('Parameter images must be string or list.')
-        images = images[:]
-        study_image_names = {i['name']:i['_id'] for i in self.images}
-        for ii in range(len(images)):
-            if not func.could_be_mongo_object_id(images[ii]):
-                try:
-                    images[ii] = study_image_names[images[ii]]
-                except:
-                    raise ValueError('Image ' + images[ii] + ' not found.')
-        images = set(images)
+        if not images is None:
+            images = images[:]
+            study_image_names = None
+            for ii in range(len(images)):
+                if not func.could_be_mongo_object_id(images[ii]):
+                    if study_image_names is None:
+                        study_image_names = {i['name']:i['_id'] for i in self.images}
+                    try:
+                        images[ii] = study_image_names[images[ii]]
+                    except:
+                        raise ValueError('Image ' + images[ii] + ' not found.')
+            images = set(images)
+        index = self._index_annotations()
         if isinstance(users, str):
             if users == 'all':
-                users = sorted(list(set([a['user']['_id'] for a in self.annotations])))
+                users = None
                 if isinstance(user_completion, int) and user_completion > 0:
-                    for u in users[:]:
-                        if (not u in self.user_completion or
-                            self.user_completion[u] < user_completion):
-                            users.remove(u)
+                    users = set([u for u in index['user'] if
+                        u in self.user_completion and
+                        self.user_completion[u] >= user_completion])
             else:
                 users = [users]
         elif not isinstance(users, list):
             raise ValueError('Parameter users must be string or list.')
-        study_users = {u['_id'] for u in self.users}
-        study_user_logins = {u['login']: u['_id'] for u in self.users}
-        study_user_lnames = {u['lastName']: u['_id'] for u in self.users}
-        for ui in range(len(users)):
-            u = users[ui]
-            if u in study_user_logins:
-                users[ui] = study_user_logins[u]
-            elif u in study_user_lnames:
-                users[ui] = study_user_lnames[u]
-            elif not u in study_users:
-                raise ValueError('User with ID ' + u + ' not found.')
-        users = set(users)
+        if isinstance(users, list):
+            study_users = {u['_id'] for u in self.users}
+            study_user_logins = {u['login']: u['_id'] for u in self.users}
+            study_user_lnames = {u['lastName']: u['_id'] for u in self.users}
+            users = users[:]
+            for ui in range(len(users)):
+                u = users[ui]
+                if u in study_user_logins:
+                    users[ui] = study_user_logins[u]
+                elif u in study_user_lnames:
+                    users[ui] = study_user_lnames[u]
+                elif not u in study_users:
+                    raise ValueError('User with ID ' + u + ' not found.')
+            users = set(users)
         if isinstance(superpixels, str):
             if superpixels == 'all':
-                superpixels = False
+                superpixels = None
             else:
                 raise ValueError('Invalid superpixels parameter value.')
         elif isinstance(superpixels, int):
@@ -1448,55 +2207,50 @@ class Study(object):
         elif not isinstance(superpixels, list):
             raise ValueError('Parameter superpixels must be ''all'', int, or list.')
         if superpixels:
-            superpixels = set(superpixels)
+            superpixels = numpy.asarray(superpixels)
+        else:
+            superpixels = None
+
+        # candidates from the index (image, user, and feature)
+        candidates = []
+        if not images is None:
+            candidates.append(self._index_lookup('image', images))
+        if not users is None:
+            candidates.append(self._index_lookup('user', users))
+        if len(features) < len(study_features):
+            candidates.append(self._index_lookup('feature', features))
+        if candidates:
+            candidates.sort(key=len)
+            candidates = sorted(candidates[0].intersection(*candidates[1:]),
+                key=index['pos'].__getitem__)
+        else:
+            candidates = self._obj_annotations.keys()
+
+        # selection (markups views are built on first access)
         self.annotation_selection = dict()
-        self.markups = dict()
-        self.markups['image.user.feature'] = dict()
-        for (a_id, a_obj) in self._obj_annotations.items():
+        selected = []
+        for a_id in candidates:
+            a_obj = self._obj_annotations[a_id]
             if not a_obj.state in annotation_state:
                 continue
             if not a_obj.status in annotation_status:
                 continue
-            feat = a_obj.features
-            img = a_obj.image['_id']
-            if not img in images:
+            img = a_obj.image_id
+            if not images is None and not img in images:
                 continue
-            user = a_obj.user['_id']
-            if not user in users:
+            user = a_obj.user_id
+            if not users is None and not user in users:
                 continue
-            for (fkey, fdet) in feat.items():
+            for (fkey, fdet) in a_obj.features.items():
                 if not fkey in features:
                     continue
-                if superpixels:
-                    sset = {s for s in fdet['idx']}
-                    if len(sset.intersection(superpixels)) == 0:
-                        continue
+                if not superpixels is None and not numpy.any(
+                    numpy.isin(fdet['idx'], superpixels)):
+                    continue
                 self.annotation_selection[a_id] = a_obj
-                if not fkey in self.markups:
-                    self.markups[fkey] = dict()
-                if not img in self.markups:
-                    self.markups[img] = dict()
-                if not user in self.markups:
-                    self.markups[user] = dict()
-                if not fkey in self.markups[img]:
-                    self.markups[img][fkey] = dict()
-                if not fkey in self.markups[user]:
-                    self.markups[user][fkey] = dict()
-                if not img in self.markups[fkey]:
-                    self.markups[fkey][img] = dict()
-                if not img in self.markups[user]:
-                    self.markups[user][img] = dict()
-                if not user in self.markups[fkey]:
-                    self.markups[fkey][user] = dict()
-                if not user in self.markups[img]:
-                    self.markups[img][user] = dict()
-                self.markups[fkey][img][user] = fdet
-                self.markups[fkey][user][img] = fdet
-                self.markups[img][fkey][user] = fdet
-                self.markups[img][user][fkey] = fdet
-                self.markups[user][fkey][img] = fdet
-                self.markups[user][img][fkey] = fdet
-                self.markups['image.user.feature'][img + '.' + user + '.' + fkey] = fdet
+                selected.append((img, user, fkey, fdet))
+        self._markups = None
+        self._markups_selected = selected
         return self.annotation_selection
 
     # show annotations (grid)
@@ -1569,3 +2323,208 @@ class Study(object):
                     hboxes.append(Label('Not completed.'))
             vboxes.append(VBox(hboxes))
         display(HBox(vboxes))
+
+    # superpixel patches (of the current annotation selection)
+    def superpixel_patches(self,
+        features:Union[str,list] = 'all',
+        patch_size:Union[int,tuple] = 64,
+        padding:int = 0,
+        neighbors:int = 0,
+        square:bool = True,
+        kernel:str = 'box',
+        out_filename:str = None,
+        workers:int = 4,
+        ) -> Tuple[Any, dict]:
+        """
+        Extract fixed-size patches for all annotated superpixels
+
+        Parameters
+        ----------
+        features : str or list
+            Features to extract patches for (default: 'all' features
+            in the current annotation selection, see select_annotations)
+        patch_size : int or tuple
+            Size of the output patches (default: 64, i.e. 64 x 64)
+        padding : int
+            Additional padding around each superpixel in pixels
+        neighbors : int
+            If > 0, crops include the neighbors up to this degree (see
+            imfunc.superpixel_neighbors, default: 0)
+        square : bool
+            If True (default), crops are extended to squares
+        kernel : str
+            Resampling kernel (see imfunc.image_resample)
+        out_filename : str
+            If given, patches are written into a memory-mapped .npy
+            file, and the index is stored alongside (as .index.npz)
+        workers : int
+            Number of threads loading images (default: 4)
+        
+        Returns
+        -------
+        patches : ndarray
+            N-by-patch_size[0]-by-patch_size[1]-by-3 uint8 array
+        index : dict
+            Fields 'features', 'image_ids', 'image' (index into
+            image_ids), 'superpixel', 'labels' (N-by-F rater counts),
+            'valid' (False where an image could not be loaded), and
+            'neighbors' (superpixel indices of the neighbors included
+            in patch i are neighbors[neighbors_offset[i]:
+            neighbors_offset[i+1]], empty unless neighbors > 0)
+        """
+
+        # IMPORTS DONE HERE TO SAVE TIME AT MODULE INIT
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+        import numpy
+        from .imfunc import superpixel_patches
+        from .jitfunc import superpixel_bboxes
+
+        if isinstance(patch_size, int):
+            patch_size = (patch_size, patch_size)
+        elif isinstance(patch_size, list):
+            patch_size = tuple(patch_size)
+        if not isinstance(patch_size, tuple) or len(patch_size) != 2:
+            raise ValueError('Invalid patch_size parameter.')
+        if not isinstance(neighbors, int) or neighbors < 0:
+            neighbors = 0
+        elif neighbors > 8:
+            neighbors = 8
+        if isinstance(features, str):
+            if features == 'all':
+                features = None
+            else:
+                features = [features]
+        elif not isinstance(features, list):
+            raise ValueError('Invalid features parameter.')
+        if not self._markups_selected:
+            self.select_annotations()
+
+        # unique superpixels (per image) with per-feature rater counts
+        sp_counts = dict()
+        feature_list = []
+        feature_idx = dict()
+        for (img, _, fkey, fdet) in self._markups_selected:
+            if not features is None and not fkey in features:
+                continue
+            if not fkey in feature_idx:
+                feature_idx[fkey] = len(feature_list)
+                feature_list.append(fkey)
+            if not img in sp_counts:
+                sp_counts[img] = dict()
+            img_counts = sp_counts[img]
+            for sp in numpy.asarray(fdet['idx']).reshape(-1).tolist():
+                if not sp in img_counts:
+                    img_counts[sp] = dict()
+                img_counts[sp][fkey] = img_counts[sp].get(fkey, 0) + 1
+        image_ids = sorted(sp_counts.keys())
+        num_features = len(feature_list)
+        image_offset = [0]
+        for image_id in image_ids:
+            image_offset.append(image_offset[-1] + len(sp_counts[image_id]))
+        num_patches = image_offset[-1]
+        index = {
+            'features': feature_list,
+            'image_ids': image_ids,
+            'image': numpy.zeros(num_patches, dtype=numpy.int32),
+            'superpixel': numpy.zeros(num_patches, dtype=numpy.int32),
+            'labels': numpy.zeros(num_patches * num_features,
+                dtype=numpy.uint16).reshape((num_patches, num_features,)),
+            'valid': numpy.zeros(num_patches, dtype=numpy.bool_),
+            'neighbors': None,
+            'neighbors_offset': None,
+        }
+        patch_neighbors = [[]] * num_patches
+        for (image_idx, image_id) in enumerate(image_ids):
+            offset = image_offset[image_idx]
+            for (sp_idx, sp) in enumerate(sorted(sp_counts[image_id].keys())):
+                index['image'][offset+sp_idx] = image_idx
+                index['superpixel'][offset+sp_idx] = sp
+                for (fkey, count) in sp_counts[image_id][sp].items():
+                    index['labels'][offset+sp_idx,feature_idx[fkey]] = min(
+                        count, 65535)
+        out_shape = (num_patches, patch_size[0], patch_size[1], 3,)
+        if out_filename:
+            patches = numpy.lib.format.open_memmap(out_filename, mode='w+',
+                dtype=numpy.uint8, shape=out_shape)
+        else:
+            patches = numpy.zeros(num_patches * patch_size[0] * patch_size[1] * 3,
+                dtype=numpy.uint8).reshape(out_shape)
+
+        # images and superpixels are loaded in threads, whereas patches are
+        # cut in this (main) thread (parallel compiled functions must not be
+        # called from pool threads)
+        def load_image(image_idx:int) -> Tuple[numpy.ndarray, numpy.ndarray, list]:
+            image_id = image_ids[image_idx]
+            if image_id in self._obj_images:
+                image_obj = self._obj_images[image_id]
+            else:
+                image_obj = self._api.image(image_id)
+            had_data = not image_obj.data is None
+            had_superpixels = not image_obj.superpixels['map'] is None
+            try:
+                image_obj.load_image_data()
+                image_obj.load_superpixels(map_superpixels=True)
+                if image_obj.data is None or image_obj.superpixels['map'] is None:
+                    raise ValueError('Error loading image or superpixels.')
+                image_data = image_obj.data
+                if image_data.ndim < 3:
+                    image_data = numpy.repeat(image_data.reshape((image_data.shape[0],
+                        image_data.shape[1], 1,)), 3, axis=2)
+                elif image_data.shape[2] != 3:
+                    image_data = image_data[:,:,0:3]
+                spnei = None
+                if neighbors > 0:
+                    spnei = image_obj.superpixel_neighbors(neighbors)[neighbors-1]
+                return (image_data, image_obj.superpixels['map'], spnei)
+            finally:
+                try:
+                    image_obj.clear_data(clear_data=not had_data,
+                        clear_superpixels=not had_superpixels,
+                        clear_segmentation=False)
+                except:
+                    pass
+
+        total = len(image_ids)
+        workers = max(1, workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            next_image = 0
+            for image_idx in range(total):
+                func.print_progress(image_idx, total, 'Extracting patches:')
+                while next_image < total and len(pending) < workers:
+                    pending.append(executor.submit(load_image, next_image))
+                    next_image += 1
+                try:
+                    (image_data, spmap, spnei) = pending.popleft().result()
+                    from_idx = image_offset[image_idx]
+                    to_idx = image_offset[image_idx+1]
+                    superpixel_patches(image_data, spmap,
+                        index['superpixel'][from_idx:to_idx], patch_size, padding,
+                        square, kernel, spnei=spnei, bboxes=superpixel_bboxes(spmap,
+                        numpy.int32(image_data.shape[1])), out=patches[from_idx:to_idx])
+                    index['valid'][from_idx:to_idx] = True
+                    if not spnei is None:
+                        for patch_idx in range(from_idx, to_idx):
+                            patch_neighbors[patch_idx] = spnei[
+                                index['superpixel'][patch_idx]]
+                except Exception as e:
+                    warnings.warn('Error extracting patches for image {0:s}: {1:s}'.format(
+                        image_ids[image_idx], str(e)))
+        func.print_progress(total, total, 'Extracting patches:')
+        index['neighbors_offset'] = numpy.zeros(num_patches + 1, dtype=numpy.int64)
+        index['neighbors_offset'][1:] = numpy.cumsum(
+            [len(nei) for nei in patch_neighbors], dtype=numpy.int64)
+        index['neighbors'] = numpy.zeros(index['neighbors_offset'][-1],
+            dtype=numpy.int32)
+        for (patch_idx, nei) in enumerate(patch_neighbors):
+            index['neighbors'][index['neighbors_offset'][patch_idx]:
+                index['neighbors_offset'][patch_idx+1]] = nei
+        if out_filename:
+            patches.flush()
+            index_filename = out_filename
+            if index_filename[-4:].lower() == '.npy':
+                index_filename = index_filename[:-4]
+            numpy.savez(index_filename + '.index.npz', **{k: numpy.asarray(v)
+                for (k, v) in index.items()})
+        return (patches, index)
@@ -23,6 +23,15 @@ ISIC_DATASET_GRACE_PERIOD = 7 * 86400
 # IsicApi: image cache settings
 ISIC_IMAGE_CACHE_UPDATE_LASTS = 3600.0 # minimum time between updates in seconds
 ISIC_IMAGES_PER_CACHING = 3000 # number of image detail items per get(...) call
+ISIC_IMAGE_CACHE_INDEXES = { # secondary indexes (built on first use)
+    'dataset._id': 'hash',
+    'dataset.name': 'hash',
+    'meta.clinical.age_approx': 'sorted',
+    'meta.clinical.diagnosis': 'hash',
+}
+
+# IsicApi: render cache settings (legends, text insets)
+ISIC_RENDER_CACHE_SIZE = 256
 
 # IsicApi: segmentation cache settings
 ISIC_SEG_SAVE_EVERY = 50
@@ -31,6 +40,9 @@ ISIC_SEG_GRACE_PERIOD = 30 * 86400
 # IsicApi: study cache settings
 ISIC_STUDY_GRACE_PERIOD = 7 * 86400
 
+# font: number of pre-scaled glyph atlases kept (per font and size)
+ISIC_FONT_ATLAS_CACHE_SIZE = 16
+
 # func: screen settings
 ISIC_FUNC_PPI = 72
 
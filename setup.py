@@ -30,7 +30,7 @@ setuptools.setup(
     url="https://github.com/neuroelf/isicarchive",
     packages=setuptools.find_packages(),
     package_dir={'isicarchive': 'isicarchive'},
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     install_requires=requires,
     include_package_data=True,
     license='MIT',